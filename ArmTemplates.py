@@ -0,0 +1,264 @@
+import json
+
+from PrivateDnsZones import PrivateDnsZonePlacement
+from ProvisioningSpecs import (
+    network_security_group_model,
+    virtual_network_model,
+    workspace_model,
+    private_endpoint_model,
+)
+from RoleAssignments import assignment_name
+
+DEPLOYMENT_TEMPLATE_SCHEMA = "https://schema.management.azure.com/schemas/2019-04-01/deploymentTemplate.json#"
+
+NETWORK_API_VERSION = "2023-09-01"
+DATABRICKS_API_VERSION = "2024-05-01"
+PRIVATE_DNS_API_VERSION = "2020-06-01"
+DNS_ZONE_GROUP_API_VERSION = "2020-03-01"
+ROLE_ASSIGNMENT_API_VERSION = "2022-04-01"
+DEPLOYMENT_API_VERSION = "2021-04-01"
+
+RESOURCE_GROUP_TYPE = "Microsoft.Resources/resourceGroups"
+DEPLOYMENT_TYPE = "Microsoft.Resources/deployments"
+NSG_TYPE = "Microsoft.Network/networkSecurityGroups"
+VNET_TYPE = "Microsoft.Network/virtualNetworks"
+SUBNET_TYPE = "Microsoft.Network/virtualNetworks/subnets"
+WORKSPACE_TYPE = "Microsoft.Databricks/workspaces"
+PRIVATE_ENDPOINT_TYPE = "Microsoft.Network/privateEndpoints"
+PRIVATE_DNS_ZONE_TYPE = "Microsoft.Network/privateDnsZones"
+VNET_LINK_TYPE = "Microsoft.Network/privateDnsZones/virtualNetworkLinks"
+DNS_ZONE_GROUP_TYPE = "Microsoft.Network/privateEndpoints/privateDnsZoneGroups"
+STORAGE_ACCOUNT_TYPE = "Microsoft.Storage/storageAccounts"
+ROLE_ASSIGNMENT_TYPE = "Microsoft.Authorization/roleAssignments"
+PRIVATE_ENDPOINT_CONNECTION_TYPE = "Microsoft.Databricks/workspaces/privateEndpointConnections"
+
+RESOURCE_API_VERSIONS = {
+    NSG_TYPE: NETWORK_API_VERSION,
+    VNET_TYPE: NETWORK_API_VERSION,
+    SUBNET_TYPE: NETWORK_API_VERSION,
+    WORKSPACE_TYPE: DATABRICKS_API_VERSION,
+    PRIVATE_ENDPOINT_TYPE: NETWORK_API_VERSION,
+    PRIVATE_DNS_ZONE_TYPE: PRIVATE_DNS_API_VERSION,
+    VNET_LINK_TYPE: PRIVATE_DNS_API_VERSION,
+    DNS_ZONE_GROUP_TYPE: NETWORK_API_VERSION,
+}
+
+
+def resource_id_expression(resource_type, *names):
+    quoted = ", ".join(f"'{name}'" for name in names)
+    return f"[resourceId('{resource_type}', {quoted})]"
+
+
+def arm_resource(resource_type, api_version, name, body, depends_on=()):
+    """A template resource; depends_on holds (type, name, ...) tuples of resources in the same template."""
+    resource = {"type": resource_type, "apiVersion": api_version, "name": name, **body}
+    if depends_on:
+        resource["dependsOn"] = [resource_id_expression(*dependency) for dependency in depends_on]
+    return resource
+
+
+def compose_template(resources, outputs=None):
+    template = {
+        "$schema": DEPLOYMENT_TEMPLATE_SCHEMA,
+        "contentVersion": "1.0.0.0",
+        "resources": list(resources),
+    }
+    if outputs:
+        template["outputs"] = outputs
+    return template
+
+
+def render(template):
+    return json.dumps(template, indent=2)
+
+
+# Resources
+def private_dns_zone_resource(zone_name):
+    return arm_resource(PRIVATE_DNS_ZONE_TYPE, PRIVATE_DNS_API_VERSION, zone_name,
+                        {"location": "global", "properties": {}})
+
+
+def vnet_link_resource(zone_name, vnet_id, link_name=None, depends_on=(), zone_in_template=True):
+    zone = [(PRIVATE_DNS_ZONE_TYPE, zone_name)] if zone_in_template else []
+    return arm_resource(
+        VNET_LINK_TYPE, PRIVATE_DNS_API_VERSION, f"{zone_name}/{link_name or zone_name + '-link'}",
+        {
+            "location": "global",
+            "properties": {
+                "virtualNetwork": {"id": vnet_id},
+                "registrationEnabled": False
+            }
+        },
+        depends_on=[*zone, *depends_on]
+    )
+
+
+def nested_deployment_resource(name, resource_group, resources, depends_on=()):
+    """A deployment into another resource group of the subscription, for resources that must live there."""
+    return arm_resource(
+        DEPLOYMENT_TYPE, DEPLOYMENT_API_VERSION, name,
+        {
+            "resourceGroup": resource_group,
+            "properties": {"mode": "Incremental", "template": compose_template(resources)}
+        },
+        depends_on=depends_on
+    )
+
+
+def default_dns_zone(zone_id):
+    """The placement of a zone no registry was asked about: new, in its own resource group, with a <zone>-link."""
+    return PrivateDnsZonePlacement(zone_id, f"{zone_id.split('/')[-1]}-link", zone_exists=False, linked=False)
+
+
+def private_dns_resources(dns_zone, resource_group, vnet_id, depends_on=()):
+    """The zone and VNet link a placement still lacks; in a nested deployment when the zone lives in another group."""
+    resources = []
+    if not dns_zone.zone_exists:
+        resources.append(private_dns_zone_resource(dns_zone.zone_name))
+    if not dns_zone.linked:
+        same_group = dns_zone.resource_group.lower() == resource_group.lower()
+        resources.append(vnet_link_resource(dns_zone.zone_name, vnet_id, dns_zone.link_name,
+                                            depends_on if same_group else (), not dns_zone.zone_exists))
+    if not resources or dns_zone.resource_group.lower() == resource_group.lower():
+        return resources
+    return [nested_deployment_resource(_dns_deployment_name(vnet_id), dns_zone.resource_group, resources, depends_on)]
+
+
+def _dns_deployment_name(vnet_id):
+    return f"PrivateDnsZone-{vnet_id.split('/')[-1]}"[:64]
+
+
+def zone_dependency(dns_zone, resource_group, vnet_id):
+    """dependsOn entries for whatever private_dns_resources() deploys the placement's zone with, if anything."""
+    if dns_zone.zone_exists:
+        return []
+    if dns_zone.resource_group.lower() == resource_group.lower():
+        return [(PRIVATE_DNS_ZONE_TYPE, dns_zone.zone_name)]
+    return [(DEPLOYMENT_TYPE, _dns_deployment_name(vnet_id))]
+
+
+def dns_zone_group_resource(private_endpoint_name, zone_configs, depends_on=()):
+    """zone_configs is a list of (config name, private DNS zone ID)."""
+    return arm_resource(
+        DNS_ZONE_GROUP_TYPE, DNS_ZONE_GROUP_API_VERSION, f"{private_endpoint_name}/default",
+        {
+            "location": "global",
+            "properties": {
+                "privateDnsZoneConfigs": [
+                    {"name": config_name, "properties": {"privateDnsZoneId": zone_id}}
+                    for config_name, zone_id in zone_configs
+                ]
+            }
+        },
+        depends_on=depends_on
+    )
+
+
+def private_endpoint_resource(name, model, depends_on=()):
+    return arm_resource(PRIVATE_ENDPOINT_TYPE, NETWORK_API_VERSION, name, model.serialize(), depends_on)
+
+
+def role_assignment_resource(storage_account_id, storage_account_name, principal_id, role_definition_id):
+    """Role assignment on a storage account in the deployment's resource group.
+
+    It is named as RoleAssignmentReconciler names it, so either path finds
+    the grant the other created.
+    """
+    scope = resource_id_expression(STORAGE_ACCOUNT_TYPE, storage_account_name)[1:-1]
+    return {
+        "type": ROLE_ASSIGNMENT_TYPE,
+        "apiVersion": ROLE_ASSIGNMENT_API_VERSION,
+        "name": assignment_name(storage_account_id, principal_id, role_definition_id),
+        "scope": f"[{scope}]",
+        "properties": {
+            "principalId": principal_id,
+            "roleDefinitionId": role_definition_id,
+            "principalType": "ServicePrincipal"
+        }
+    }
+
+
+# Templates
+def private_dns_zone_template(zone_name, vnet_id):
+    """ARM template for a private DNS zone and its link to a VNet."""
+    return compose_template([private_dns_zone_resource(zone_name), vnet_link_resource(zone_name, vnet_id)])
+
+
+def private_dns_zone_group_template(private_endpoint_name, zone_id, config_name):
+    """ARM template attaching a private endpoint to a private DNS zone."""
+    return compose_template([dns_zone_group_resource(private_endpoint_name, [(config_name, zone_id)])])
+
+
+def private_dns_zone_groups_template(zone_groups):
+    """ARM template attaching many private endpoints to their DNS zones in one deployment.
+
+    zone_groups maps each private endpoint name to its (config name, zone ID) list.
+    """
+    return compose_template([dns_zone_group_resource(name, configs) for name, configs in zone_groups.items()])
+
+
+def workspace_stack_template(stack, current_vnet=None, dns_zone=None):
+    """The whole workspace stack as one deployment; ARM runs independent resources in parallel.
+
+    Given the current VNet, the template keeps its other subnets. Given
+    the DNS zone registry's placement, the zone group points at its zone
+    and only a missing zone or link is deployed, under the registry's
+    link name.
+    """
+    dns_zone = dns_zone or default_dns_zone(stack.private_dns_zone_id)
+    nsg = (NSG_TYPE, stack.nsg_name)
+    vnet = (VNET_TYPE, stack.vnet_name)
+    workspace = (WORKSPACE_TYPE, stack.workspace_name)
+    private_endpoint = (PRIVATE_ENDPOINT_TYPE, stack.private_endpoint_name)
+
+    resources = [
+        arm_resource(NSG_TYPE, NETWORK_API_VERSION, stack.nsg_name, network_security_group_model(stack).serialize()),
+        arm_resource(VNET_TYPE, NETWORK_API_VERSION, stack.vnet_name, virtual_network_model(stack, current_vnet).serialize(),
+                     depends_on=[nsg]),
+        arm_resource(WORKSPACE_TYPE, DATABRICKS_API_VERSION, stack.workspace_name, workspace_model(stack),
+                     depends_on=[vnet]),
+        private_endpoint_resource(
+            stack.private_endpoint_name,
+            private_endpoint_model(stack.location, stack.private_link_subnet_id, stack.private_endpoint_name,
+                                   stack.workspace_id, "databricks_ui_api"),
+            depends_on=[vnet, workspace]
+        ),
+        *private_dns_resources(dns_zone, stack.resource_group, stack.vnet_id, depends_on=[vnet]),
+        dns_zone_group_resource(stack.private_endpoint_name, [(dns_zone.zone_name, dns_zone.zone_id)],
+                                depends_on=[private_endpoint, *zone_dependency(dns_zone, stack.resource_group, stack.vnet_id)]),
+    ]
+    outputs = {
+        "workspaceId": {"type": "string", "value": resource_id_expression(*workspace)},
+        "workspaceUrl": {"type": "string",
+                         "value": f"[reference({resource_id_expression(*workspace)[1:-1]}).workspaceUrl]"},
+    }
+    return compose_template(resources, outputs)
+
+
+def storage_connection_template(connection, storage_account_id, subnet_id, principal_id=None, role_definition_id=None,
+                                dns_zone=None):
+    """The ADLS private endpoint, DNS zone, VNet link, zone group and (optionally) role grant as one deployment.
+
+    The role assignment is only rendered when principal_id and
+    role_definition_id are given (leave the role out when the grant
+    already exists), and assumes the storage account lives in
+    the deployment's resource group. The DNS zone and link follow the
+    registry's placement, as in workspace_stack_template.
+    """
+    dns_zone = dns_zone or default_dns_zone(connection.private_dns_zone_id)
+    private_endpoint = (PRIVATE_ENDPOINT_TYPE, connection.private_endpoint_name)
+    resources = [
+        private_endpoint_resource(
+            connection.private_endpoint_name,
+            private_endpoint_model(connection.location, subnet_id, "adls-private-link", storage_account_id,
+                                   connection.group_id)
+        ),
+        *private_dns_resources(dns_zone, connection.resource_group, connection.vnet_id),
+        dns_zone_group_resource(connection.private_endpoint_name, [("dnsZoneConfig", dns_zone.zone_id)],
+                                depends_on=[private_endpoint, *zone_dependency(dns_zone, connection.resource_group,
+                                                                                    connection.vnet_id)]),
+    ]
+    if principal_id and role_definition_id:
+        resources.append(role_assignment_resource(storage_account_id, connection.storage_account_name, principal_id,
+                                                  role_definition_id))
+    return compose_template(resources)
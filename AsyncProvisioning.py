@@ -0,0 +1,903 @@
+import asyncio
+import functools
+import inspect
+import time
+import uuid
+from dataclasses import dataclass
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from AzureEndpoints import arm_client_options
+from AzureSdk import create_client
+from ArmTemplates import (
+    RESOURCE_GROUP_TYPE,
+    PRIVATE_DNS_ZONE_TYPE,
+    VNET_LINK_TYPE,
+    private_dns_zone_group_template,
+    private_dns_zone_groups_template,
+    workspace_stack_template,
+    storage_connection_template,
+)
+from LroPolling import (
+    DEFAULT_POLICY,
+    PollingHistory,
+    PollScheduler,
+    TunedPolling,
+    deployment_resource_type,
+    history_key,
+    load_policies,
+    operation_resource_type,
+)
+from PrivateDnsZones import PrivateDnsZoneRegistry
+from Preflight import PreflightFailed, preflight_workspaces
+from PrivateEndpointApproval import (
+    DEFAULT_APPROVAL_TIMEOUT,
+    PENDING,
+    approve_connection,
+    connection_state,
+    wait_for_approval,
+)
+from ProvisioningGraph import ProvisioningGraph, ProvisioningGraphError
+from ProvisioningJournal import ProvisioningJournal, flow_key
+from ProvisioningPlan import plan_workspace_stack
+from ProvisioningSpecs import (
+    network_security_group_model,
+    virtual_network_model,
+    workspace_model,
+    private_endpoint_model,
+)
+from ProvisioningTeardown import (
+    TeardownTarget,
+    TeardownRequest,
+    build_teardown_graph,
+    deleted_resources,
+    externally_linked_zones,
+    shared_resource_ids,
+    workspace_stack_teardown,
+)
+from ProvisioningTrace import get_tracer, lro_span_name
+from RoleAssignments import RoleAssignmentReconciler, RoleGrant
+from SubnetAllocator import allocate_subnets
+from TokenBroker import AsyncTokenBroker
+from WorkspaceMetadata import WorkspaceMetadataCache
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_WRITE_BURST = 50
+
+
+class ArmWriteLimiter:
+    """Token bucket that spaces out ARM writes to stay under a subscription's write quota."""
+
+    def __init__(self, writes_per_hour, burst=DEFAULT_WRITE_BURST):
+        self.rate = writes_per_hour / 3600.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncAzureClients:
+    """Async management clients that share one credential and one HTTP connection pool.
+
+    Clients are imported and created on first use and cached per
+    subscription, so any number of provisioning flows on the same event
+    loop reuse the same tokens and TCP/TLS connections. Without an explicit credential, tokens
+    come from an AsyncTokenBroker, so they are shared with every other
+    client in the process. When writes_per_hour is set, every write goes
+    through a per-subscription ArmWriteLimiter.
+
+    Long-running operations are polled on a per-resource-type
+    PollingPolicy, tuned from the durations in the PollingHistory, and all
+    of them wait in one shared PollScheduler.
+
+    Private DNS zones go through one PrivateDnsZoneRegistry, so every flow
+    on the clients reuses the zones and VNet links the others found or made,
+    role grants go through one RoleAssignmentReconciler, and workspace URLs
+    and managed identities come from one WorkspaceMetadataCache.
+    """
+
+    def __init__(self, credential=None, max_connections=100, writes_per_hour=None, polling_policies=None,
+                 history=None, max_polls_per_second=None):
+        self.credential = credential
+        self._owns_credential = credential is None
+        self._max_connections = max_connections
+        self._writes_per_hour = writes_per_hour
+        self._session = None
+        self._transport = None
+        self._clients = {}
+        self._limiters = {}
+        self._locks = {}
+        self.polling_policies = {**load_policies(), **(polling_policies or {})}
+        self.history = history if history is not None else PollingHistory()
+        self.poll_scheduler = PollScheduler(max_polls_per_second=max_polls_per_second)
+        self.dns_zones = PrivateDnsZoneRegistry(self)
+        self.role_assignments = RoleAssignmentReconciler(self)
+        self.workspace_metadata = WorkspaceMetadataCache()
+
+    async def __aenter__(self):
+        # Imported here, like the clients, so that scripts start without loading the HTTP stack.
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self._max_connections))
+        self._transport = AioHttpTransport(session=self._session, session_owner=False)
+        if self.credential is None:
+            self.credential = AsyncTokenBroker()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+        if self._owns_credential:
+            await self.credential.close()
+        await self._session.close()
+        self.history.save()
+        self.workspace_metadata.save()
+
+    def _client(self, name, subscription_id):
+        key = (name, subscription_id)
+        if key not in self._clients:
+            self._clients[key] = create_client(name, self.credential, subscription_id, aio=True,
+                                               transport=self._transport, **arm_client_options())
+        return self._clients[key]
+
+    def resource(self, subscription_id):
+        return self._client("resource", subscription_id)
+
+    def network(self, subscription_id):
+        return self._client("network", subscription_id)
+
+    def databricks(self, subscription_id):
+        return self._client("databricks", subscription_id)
+
+    def storage(self, subscription_id):
+        return self._client("storage", subscription_id)
+
+    def authorization(self, subscription_id):
+        return self._client("authorization", subscription_id)
+
+    def private_dns(self, subscription_id):
+        return self._client("private_dns", subscription_id)
+
+    def compute(self, subscription_id):
+        return self._client("compute", subscription_id)
+
+    async def throttle(self, subscription_id):
+        """Wait for a write slot in the subscription's ARM write quota."""
+        if self._writes_per_hour is None:
+            return
+        if subscription_id not in self._limiters:
+            self._limiters[subscription_id] = ArmWriteLimiter(self._writes_per_hour)
+        await self._limiters[subscription_id].acquire()
+
+    def lock(self, key):
+        """An asyncio.Lock per key, for read-modify-write updates of a shared resource such as a VNet."""
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def polling(self, resource_type, operation):
+        """A TunedPolling for one operation; its duration is added to the history when it succeeds."""
+        key = history_key(resource_type, operation)
+        policy = self.polling_policies.get(resource_type, DEFAULT_POLICY).tuned(self.history.get(key))
+
+        def finished(polling):
+            if polling.status().lower() == "succeeded":
+                self.history.record(key, polling.duration)
+
+        return TunedPolling(policy, self.poll_scheduler, finished)
+
+    async def run_lro(self, subscription_id, begin_operation, *args, resource_type=None, **kwargs):
+        """Start a long-running write operation and wait for its result, traced as an "lro" span."""
+        resource_type = resource_type or operation_resource_type(begin_operation)
+        kwargs.setdefault("polling", self.polling(resource_type, begin_operation.__name__))
+        await self.throttle(subscription_id)
+        with get_tracer().span(lro_span_name(begin_operation, args), kind="lro", subscription_id=subscription_id):
+            poller = await begin_operation(*args, **kwargs)
+            return await poller.result()
+
+
+@dataclass
+class ProvisioningResult:
+    """Outcome of one provisioning flow."""
+    name: str
+    report: object = None
+    error: Exception = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+def unique_deployment_name(prefix, name):
+    """A deployment name no other run uses, so parallel deployments in one resource group never replace each other."""
+    return f"{prefix}-{name}"[:55] + f"-{uuid.uuid4().hex[:8]}"
+
+
+async def deploy_template(clients, subscription_id, resource_group, deployment_name, template):
+    return await clients.run_lro(
+        subscription_id,
+        clients.resource(subscription_id).deployments.begin_create_or_update,
+        resource_group,
+        deployment_name,
+        {
+            "properties": {
+                "mode": "Incremental",
+                "template": template,
+                "parameters": {}
+            }
+        },
+        resource_type=deployment_resource_type(template),
+    )
+
+
+async def create_resource_group(clients, subscription_id, resource_group, location, label):
+    print(f"[{label}] Creating Resource Group: {resource_group} in {location}")
+    await clients.throttle(subscription_id)
+    group = await clients.resource(subscription_id).resource_groups.create_or_update(resource_group, {"location": location})
+    return group.id
+
+
+async def get_virtual_network(clients, subscription_id, resource_group, vnet_name):
+    try:
+        return await clients.network(subscription_id).virtual_networks.get(resource_group, vnet_name)
+    except ResourceNotFoundError:
+        return None
+
+
+# Workspace stack (AzureDatabricksVNETProvisioning.py)
+def build_workspace_graph(clients, stack, plan=None):
+    """Declare the steps of a workspace stack; each step returns the ID of what it created.
+
+    With a plan, steps whose resource already matches the desired state
+    return its ID without issuing a PUT.
+    """
+    sub, rg = stack.subscription_id, stack.resource_group
+    network = clients.network(sub)
+
+    def unless_converged(step, action):
+        async def run(deps):
+            if plan is not None and plan.is_converged(step):
+                change = plan.changes[step]
+                print(f"[{stack.name}] {change.resource_type} {change.name} is up to date, skipping.")
+                return change.resource_id
+            return await action(deps)
+        return run
+
+    async def create_stack_resource_group(deps):
+        return await create_resource_group(clients, sub, rg, stack.location, stack.name)
+
+    async def create_network_security_group(deps):
+        print(f"[{stack.name}] Creating Network Security Group...")
+        nsg = await clients.run_lro(sub, network.network_security_groups.begin_create_or_update,
+                                    rg, stack.nsg_name, network_security_group_model(stack))
+        return nsg.id
+
+    async def create_virtual_network(deps):
+        print(f"[{stack.name}] Creating Virtual Network and Subnets...")
+        # Stacks may share the VNet: merge into its current subnets, one writer at a time.
+        async with clients.lock(stack.vnet_id.lower()):
+            current = await get_virtual_network(clients, sub, rg, stack.vnet_name)
+            vnet = await clients.run_lro(sub, network.virtual_networks.begin_create_or_update,
+                                         rg, stack.vnet_name, virtual_network_model(stack, current))
+        print(f"[{stack.name}] Virtual Network {stack.vnet_name} created successfully.")
+        return vnet.id
+
+    async def create_workspace(deps):
+        print(f"[{stack.name}] Creating Databricks Workspace...")
+        workspace = await clients.run_lro(sub, clients.databricks(sub).workspaces.begin_create_or_update,
+                                          rg, stack.workspace_name, workspace_model(stack))
+        print(f"[{stack.name}] Databricks Workspace {stack.workspace_name} created successfully.")
+        return workspace.id
+
+    async def create_private_endpoint(deps):
+        print(f"[{stack.name}] Creating Private Endpoint for Databricks Workspace...")
+        private_endpoint = await clients.run_lro(
+            sub,
+            network.private_endpoints.begin_create_or_update,
+            rg,
+            stack.private_endpoint_name,
+            private_endpoint_model(stack.location, stack.private_link_subnet_id, stack.private_endpoint_name,
+                                   deps["workspace"], "databricks_ui_api")
+        )
+        print(f"[{stack.name}] Private Endpoint {stack.private_endpoint_name} created successfully.")
+        return private_endpoint.id
+
+    async def ensure_private_dns_zone(deps):
+        return await clients.dns_zones.ensure_zone(sub, rg, stack.private_dns_zone_name, deps["vnet"], stack.name)
+
+    async def deploy_private_dns_zone_group(deps):
+        print(f"[{stack.name}] Deploying ARM Template for Private DNS Zone Group...")
+        await deploy_template(clients, sub, rg,
+                              unique_deployment_name("PrivateDnsZoneGroupDeployment", stack.private_endpoint_name),
+                              private_dns_zone_group_template(stack.private_endpoint_name, deps["dns_zone"],
+                                                              stack.private_dns_zone_name))
+        print(f"[{stack.name}] Private DNS Zone Group associated with Private Endpoint successfully.")
+        return f"{deps['private_endpoint']}/privateDnsZoneGroups/default"
+
+    graph = ProvisioningGraph(stack.name, plan)
+    graph.add_step("resource_group", unless_converged("resource_group", create_stack_resource_group))
+    graph.add_step("nsg", unless_converged("nsg", create_network_security_group), depends_on=["resource_group"])
+    graph.add_step("vnet", unless_converged("vnet", create_virtual_network), depends_on=["nsg"])
+    graph.add_step("workspace", unless_converged("workspace", create_workspace), depends_on=["vnet"])
+    graph.add_step("dns_zone", unless_converged("dns_zone", ensure_private_dns_zone), depends_on=["vnet"])
+    graph.add_step("private_endpoint", unless_converged("private_endpoint", create_private_endpoint),
+                   depends_on=["vnet", "workspace"])
+    graph.add_step("dns_zone_group", unless_converged("dns_zone_group", deploy_private_dns_zone_group),
+                   depends_on=["private_endpoint", "dns_zone"])
+    return graph
+
+
+def build_workspace_template_graph(clients, stack, plan=None):
+    """Declare the workspace stack as its resource group plus one ARM deployment of everything else."""
+    sub, rg = stack.subscription_id, stack.resource_group
+
+    async def create_stack_resource_group(deps):
+        if plan is not None and plan.is_converged("resource_group"):
+            return plan.changes["resource_group"].resource_id
+        return await create_resource_group(clients, sub, rg, stack.location, stack.name)
+
+    async def place_private_dns_zone(deps):
+        # The registry creates a missing zone; the template deploys the link under the name it reserves.
+        await clients.dns_zones.ensure_zone(sub, rg, stack.private_dns_zone_name, stack.vnet_id, stack.name, link=False)
+        return await clients.dns_zones.placement(sub, rg, stack.private_dns_zone_name, stack.vnet_id)
+
+    async def deploy_stack(deps):
+        if plan is not None and all(change.action == "no-op" for change in plan.changes.values()):
+            print(f"[{stack.name}] All resources are up to date, skipping deployment.")
+            return stack.workspace_id
+        print(f"[{stack.name}] Deploying workspace stack as a single ARM template...")
+        # The template PUTs the whole VNet, so stacks sharing it deploy one at a time.
+        async with clients.lock(stack.vnet_id.lower()):
+            current = await get_virtual_network(clients, sub, rg, stack.vnet_name)
+            deployment = await deploy_template(clients, sub, rg, f"WorkspaceStack-{stack.workspace_name}",
+                                               workspace_stack_template(stack, current, deps["dns_zone"]))
+        clients.dns_zones.record_link(sub, deps["dns_zone"], stack.vnet_id)
+        print(f"[{stack.name}] Workspace stack deployed successfully.")
+        return deployment.properties.outputs["workspaceId"]["value"]
+
+    if plan is not None:
+        for change in plan.changes.values():
+            if change.step not in ("resource_group", "dns_zone"):
+                change.applied_by = "stack_deployment"
+
+    graph = ProvisioningGraph(stack.name, plan)
+    graph.add_step("resource_group", create_stack_resource_group)
+    graph.add_step("dns_zone", place_private_dns_zone, depends_on=["resource_group"])
+    graph.add_step("stack_deployment", deploy_stack, depends_on=["resource_group", "dns_zone"])
+    return graph
+
+
+async def plan_and_build_workspace_graph(clients, stack, single_deployment=False):
+    """Plan the stack with GETs first so converged resources are skipped."""
+    plan = await plan_workspace_stack(clients, stack)
+    print(f"[{stack.name}] Plan: {plan.count('create')} to create, {plan.count('update')} to update, "
+          f"{plan.count('no-op')} unchanged.")
+    if single_deployment:
+        return build_workspace_template_graph(clients, stack, plan)
+    return build_workspace_graph(clients, stack, plan)
+
+
+def _used_by_others(entry, shared):
+    resource_id = entry["resource_id"].lower()
+    if entry["resource_type"] == RESOURCE_GROUP_TYPE:
+        # A resource group goes only when nothing of another flow lives in it.
+        return any(other == resource_id or other.startswith(resource_id + "/") for other in shared)
+    return resource_id in shared
+
+
+async def rollback_workspace(clients, stack, journal, stacks=()):
+    """Delete the resources this run created for the stack, independent ones in parallel.
+
+    A resource group, NSG, VNet or DNS zone that another stack of the run
+    or another flow in the journal also uses is left in place, even when
+    this stack's flow created it.
+    """
+    created = journal.created_resources() if journal is not None else []
+    shared = shared_resource_ids(stack, [other for other in stacks if other is not stack])
+    shared |= journal.other_flows_resources() if journal is not None else set()
+    kept = [entry for entry in created if _used_by_others(entry, shared)]
+    if kept:
+        print(f"[{stack.name}] Keeping {len(kept)} resources other stacks also use: "
+              f"{', '.join(entry['resource_id'].split('/')[-1] for entry in kept)}.")
+    created = [entry for entry in created if entry not in kept]
+    if not created:
+        print(f"[{stack.name}] Nothing created by this run, skipping rollback.")
+        return
+    print(f"[{stack.name}] Rolling back: Deleting {len(created)} resources created by this run...")
+    targets = [TeardownTarget(entry["resource_type"], entry["resource_id"]) for entry in created]
+    if any(t.resource_type == PRIVATE_DNS_ZONE_TYPE for t in targets):
+        # A zone with VNet links cannot be deleted, so drop our link along with it.
+        dns_zone = await clients.dns_zones.placement(stack.subscription_id, stack.resource_group,
+                                                     stack.private_dns_zone_name, stack.vnet_id)
+        targets.append(TeardownTarget(VNET_LINK_TYPE, dns_zone.link_id))
+    request = TeardownRequest(stack.name, stack.subscription_id, stack.resource_group, targets)
+    try:
+        report = await build_teardown_graph(clients, request).run_async()
+        print(f"[{stack.name}] Rollback complete.")
+    except ProvisioningGraphError as e:
+        print(f"[{stack.name}] Error during rollback: {e}")
+        report = e.report
+    deleted = deleted_resources(request, report)
+    for entry in created:
+        if entry["resource_id"].lower() in deleted:
+            # A later --resume must not treat the deleted resource's step as done.
+            journal.record_step(entry["step"], "rolled_back")
+
+
+# Storage connection (ConnectStorageAccountToADB.py)
+def build_storage_connection_graph(clients, connection):
+    """Declare the steps that wire an ADLS account into a workspace VNet."""
+    sub, rg = connection.subscription_id, connection.resource_group
+    network = clients.network(sub)
+
+    async def fetch_storage_account(deps):
+        print(f"[{connection.name}] Fetching Storage Account Resource ID...")
+        account = await clients.storage(sub).storage_accounts.get_properties(rg, connection.storage_account_name)
+        return account.id
+
+    async def fetch_private_link_subnet(deps):
+        print(f"[{connection.name}] Fetching Private Link Subnet...")
+        vnet = await network.virtual_networks.get(rg, connection.vnet_name)
+        return next(s for s in vnet.subnets if s.name == connection.private_link_subnet_name).id
+
+    async def fetch_managed_identity_principal_id(deps):
+        print(f"[{connection.name}] Retrieving Databricks Managed Identity Principal ID...")
+        metadata = await clients.workspace_metadata.lookup_async(clients, sub, rg, connection.workspace_name)
+        return metadata.msi_principal_id
+
+    async def create_private_endpoint(deps):
+        print(f"[{connection.name}] Creating Private Endpoint for ADLS Gen2 Storage Account...")
+        private_endpoint = await clients.run_lro(
+            sub,
+            network.private_endpoints.begin_create_or_update,
+            rg,
+            connection.private_endpoint_name,
+            private_endpoint_model(connection.location, deps["private_link_subnet"], "adls-private-link",
+                                   deps["storage_account"], connection.group_id)
+        )
+        print(f"[{connection.name}] Private Endpoint {connection.private_endpoint_name} created successfully.")
+        return private_endpoint.id
+
+    async def ensure_private_dns_zone(deps):
+        return await clients.dns_zones.ensure_zone(sub, rg, connection.private_dns_zone_name, connection.vnet_id,
+                                                   connection.name)
+
+    async def deploy_private_dns_zone_group(deps):
+        print(f"[{connection.name}] Creating DNS Zone Group for Private Endpoint...")
+        await deploy_template(clients, sub, rg,
+                              unique_deployment_name("PrivateDnsZoneGroupDeployment", connection.private_endpoint_name),
+                              private_dns_zone_group_template(connection.private_endpoint_name, deps["dns_zone"],
+                                                              "dnsZoneConfig"))
+        print(f"[{connection.name}] DNS Zone Group linked to Private Endpoint successfully.")
+        return f"{deps['private_endpoint']}/privateDnsZoneGroups/default"
+
+    async def grant_storage_role(deps):
+        print(f"[{connection.name}] Granting {connection.role_definition_name} role to Managed Identity Principal ID...")
+        grant = RoleGrant(sub, deps["storage_account"], deps["managed_identity"], connection.role_definition_name)
+        assignment_id, created = await clients.role_assignments.ensure(grant, connection.name)
+        if created:
+            print(f"[{connection.name}] Role {connection.role_definition_name} assigned successfully to Principal ID {deps['managed_identity']}.")
+        return assignment_id
+
+    graph = ProvisioningGraph(connection.name)
+    graph.add_step("storage_account", fetch_storage_account)
+    graph.add_step("private_link_subnet", fetch_private_link_subnet)
+    graph.add_step("managed_identity", fetch_managed_identity_principal_id)
+    graph.add_step("dns_zone", ensure_private_dns_zone)
+    graph.add_step("private_endpoint", create_private_endpoint, depends_on=["storage_account", "private_link_subnet"])
+    graph.add_step("dns_zone_group", deploy_private_dns_zone_group, depends_on=["private_endpoint", "dns_zone"])
+    graph.add_step("role_assignment", grant_storage_role, depends_on=["storage_account", "managed_identity"])
+    return graph
+
+
+def build_storage_connection_template_graph(clients, connection):
+    """Declare the storage connection as lookups plus one ARM deployment."""
+    sub, rg = connection.subscription_id, connection.resource_group
+    base = build_storage_connection_graph(clients, connection).steps
+
+    async def fetch_role_definition_id(deps):
+        # A grant that already exists, under whatever name, stays out of the template.
+        grant = RoleGrant(sub, deps["storage_account"], deps["managed_identity"], connection.role_definition_name)
+        role_definition_id, assignment_id = await clients.role_assignments.lookup(grant)
+        if assignment_id is not None:
+            print(f"[{connection.name}] {connection.role_definition_name} is already granted; not deploying it.")
+            return None
+        return role_definition_id
+
+    async def place_private_dns_zone(deps):
+        await clients.dns_zones.ensure_zone(sub, rg, connection.private_dns_zone_name, connection.vnet_id,
+                                            connection.name, link=False)
+        return await clients.dns_zones.placement(sub, rg, connection.private_dns_zone_name, connection.vnet_id)
+
+    async def deploy_connection(deps):
+        print(f"[{connection.name}] Deploying storage connection as a single ARM template...")
+        await deploy_template(
+            clients, sub, rg, f"StorageConnection-{connection.storage_account_name}",
+            storage_connection_template(connection, deps["storage_account"], deps["private_link_subnet"],
+                                        deps["managed_identity"], deps["role_definition"], deps["dns_zone"])
+        )
+        clients.dns_zones.record_link(sub, deps["dns_zone"], connection.vnet_id)
+        print(f"[{connection.name}] Storage connection deployed successfully.")
+        return f"{connection.private_endpoint_name}/default"
+
+    graph = ProvisioningGraph(connection.name)
+    for step in ("storage_account", "private_link_subnet", "managed_identity"):
+        graph.add_step(step, base[step].action)
+    graph.add_step("role_definition", fetch_role_definition_id, depends_on=["storage_account", "managed_identity"])
+    graph.add_step("dns_zone", place_private_dns_zone)
+    graph.add_step("connection_deployment", deploy_connection,
+                   depends_on=["storage_account", "private_link_subnet", "managed_identity", "role_definition",
+                               "dns_zone"])
+    return graph
+
+
+def build_storage_account_set_graph(clients, account_set):
+    """Declare the steps that wire many ADLS accounts into a workspace VNet in one pass.
+
+    Account IDs come from one list call, every private endpoint is created
+    concurrently, and all of them join their DNS zones in one deployment.
+    """
+    sub, rg = account_set.subscription_id, account_set.resource_group
+    network = clients.network(sub)
+    label = account_set.name
+    endpoints = [(account, sub_resource) for account in account_set.storage_account_names
+                 for sub_resource in account_set.sub_resources]
+
+    async def fetch_storage_accounts(deps):
+        print(f"[{label}] Looking up {len(account_set.storage_account_names)} Storage Accounts...")
+        wanted = {name.lower() for name in account_set.storage_account_names}
+        found = {account.name.lower(): account.id async for account in clients.storage(sub).storage_accounts.list()
+                 if account.name.lower() in wanted}
+        missing = sorted(wanted - found.keys())
+        if missing:
+            raise ValueError(f"Storage accounts not found in subscription {sub}: {', '.join(missing)}")
+        return {name: found[name.lower()] for name in account_set.storage_account_names}
+
+    async def fetch_private_link_subnet(deps):
+        print(f"[{label}] Fetching Private Link Subnet...")
+        vnet = await network.virtual_networks.get(rg, account_set.vnet_name)
+        return next(s for s in vnet.subnets if s.name == account_set.private_link_subnet_name).id
+
+    async def fetch_managed_identity_principal_id(deps):
+        print(f"[{label}] Retrieving Databricks Managed Identity Principal ID...")
+        metadata = await clients.workspace_metadata.lookup_async(clients, sub, rg, account_set.workspace_name)
+        return metadata.msi_principal_id
+
+    async def ensure_private_dns_zones(deps):
+        zone_ids = await asyncio.gather(*(
+            clients.dns_zones.ensure_zone(sub, rg, account_set.private_dns_zone_name(sub_resource),
+                                          account_set.vnet_id, label)
+            for sub_resource in account_set.sub_resources
+        ))
+        return dict(zip(account_set.sub_resources, zone_ids))
+
+    async def create_private_endpoints(deps):
+        print(f"[{label}] Creating {len(endpoints)} Private Endpoints...")
+
+        async def create(account, sub_resource):
+            name = account_set.private_endpoint_name(account, sub_resource)
+            private_endpoint = await clients.run_lro(
+                sub,
+                network.private_endpoints.begin_create_or_update,
+                rg,
+                name,
+                private_endpoint_model(account_set.location, deps["private_link_subnet"], "adls-private-link",
+                                       deps["storage_accounts"][account], sub_resource)
+            )
+            return name, private_endpoint.id
+
+        # Let every create finish before failing, so no endpoint is left half-made by a sibling's error.
+        created = await asyncio.gather(*(create(*endpoint) for endpoint in endpoints), return_exceptions=True)
+        errors = [result for result in created if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+        print(f"[{label}] {len(created)} Private Endpoints created successfully.")
+        return dict(created)
+
+    async def deploy_private_dns_zone_groups(deps):
+        print(f"[{label}] Creating DNS Zone Groups for {len(endpoints)} Private Endpoints...")
+        zone_groups = {
+            account_set.private_endpoint_name(account, sub_resource): [("dnsZoneConfig", deps["dns_zones"][sub_resource])]
+            for account, sub_resource in endpoints
+        }
+        await deploy_template(clients, sub, rg, unique_deployment_name("PrivateDnsZoneGroupDeployment", label),
+                              private_dns_zone_groups_template(zone_groups))
+        print(f"[{label}] DNS Zone Groups linked to Private Endpoints successfully.")
+        return [f"{endpoint_id}/privateDnsZoneGroups/default" for endpoint_id in deps["private_endpoints"].values()]
+
+    async def grant_storage_roles(deps):
+        print(f"[{label}] Granting {account_set.role_definition_name} role on "
+              f"{len(deps['storage_accounts'])} Storage Accounts...")
+        grants = [RoleGrant(sub, account_id, deps["managed_identity"], account_set.role_definition_name)
+                  for account_id in deps["storage_accounts"].values()]
+        results = await clients.role_assignments.reconcile(grants)
+        for result in results:
+            if not result.succeeded:
+                raise result.error
+        return [result.assignment_id for result in results]
+
+    graph = ProvisioningGraph(label)
+    graph.add_step("storage_accounts", fetch_storage_accounts)
+    graph.add_step("private_link_subnet", fetch_private_link_subnet)
+    graph.add_step("managed_identity", fetch_managed_identity_principal_id)
+    graph.add_step("dns_zones", ensure_private_dns_zones)
+    graph.add_step("private_endpoints", create_private_endpoints, depends_on=["storage_accounts", "private_link_subnet"])
+    graph.add_step("dns_zone_groups", deploy_private_dns_zone_groups, depends_on=["private_endpoints", "dns_zones"])
+    graph.add_step("role_assignments", grant_storage_roles, depends_on=["storage_accounts", "managed_identity"])
+    return graph
+
+
+# Cross-subscription private endpoint (SourcePrivateEndpointRequest.py)
+def build_source_private_endpoint_graph(clients, request, auto_approve=False,
+                                        approval_timeout=DEFAULT_APPROVAL_TIMEOUT):
+    """Declare the steps that connect the query VNet to a remote workspace.
+
+    The flow only succeeds once the connection is approved. With
+    auto_approve, a pending connection is approved from the workspace's
+    side, which needs rights on its subscription too.
+    """
+    sub, rg = request.subscription_id, request.resource_group
+
+    async def create_private_endpoint(deps):
+        print(f"[{request.name}] Creating Private Endpoint...")
+        private_endpoint = await clients.run_lro(
+            sub,
+            clients.network(sub).private_endpoints.begin_create_or_update,
+            rg,
+            request.private_endpoint_name,
+            private_endpoint_model(request.location, request.private_link_subnet_id, request.private_endpoint_name,
+                                   request.remote_workspace_id, "databricks_ui_api", request.manual_approval,
+                                   request.request_message)
+        )
+        print(f"[{request.name}] Private Endpoint '{request.private_endpoint_name}' created successfully.")
+        return private_endpoint.id
+
+    async def ensure_private_dns_zone(deps):
+        return await clients.dns_zones.ensure_zone(sub, rg, request.private_dns_zone_name, request.vnet_id, request.name)
+
+    async def deploy_private_dns_zone_group(deps):
+        print(f"[{request.name}] Deploying ARM Template for Private DNS Zone Group...")
+        await deploy_template(clients, sub, rg,
+                              unique_deployment_name("PrivateDnsZoneGroupDeployment", request.private_endpoint_name),
+                              private_dns_zone_group_template(request.private_endpoint_name, deps["dns_zone"],
+                                                              request.private_dns_zone_name))
+        print(f"[{request.name}] Private DNS Zone Group associated with Private Endpoint successfully.")
+        return f"{deps['private_endpoint']}/privateDnsZoneGroups/default"
+
+    async def await_connection_approval(deps):
+        if auto_approve:
+            state = connection_state(await clients.network(sub).private_endpoints.get(rg, request.private_endpoint_name))
+            if state is None or state.status == PENDING:
+                await approve_connection(clients, request.remote_workspace_id, deps["private_endpoint"], request.name)
+        return await wait_for_approval(clients, sub, rg, request.private_endpoint_name, request.name,
+                                       timeout=approval_timeout)
+
+    graph = ProvisioningGraph(request.name)
+    graph.add_step("private_endpoint", create_private_endpoint)
+    graph.add_step("dns_zone", ensure_private_dns_zone)
+    graph.add_step("dns_zone_group", deploy_private_dns_zone_group, depends_on=["private_endpoint", "dns_zone"])
+    graph.add_step("connection_approval", await_connection_approval, depends_on=["private_endpoint"])
+    return graph
+
+
+async def run_graphs(items, build_graph, max_concurrency=DEFAULT_MAX_CONCURRENCY, on_failure=None, clients=None,
+                     per_subscription_limit=None, journal=None, resume=False, per_region_limit=None, progress=None):
+    """Run one graph per item on the current event loop.
+
+    At most max_concurrency graphs run at once, at most
+    per_subscription_limit of them in any one subscription and, when set,
+    at most per_region_limit in any one location. Step progress goes to
+    the journal (in memory when none is given); with resume=True, steps a
+    previous run completed are skipped. A progress object, when given, is
+    told when each flow starts and finishes.
+    """
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await run_graphs(items, build_graph, max_concurrency, on_failure, clients, per_subscription_limit,
+                                    journal, resume, per_region_limit, progress)
+    if journal is None:
+        journal = ProvisioningJournal(path=None)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    subscription_semaphores = {}
+    region_semaphores = {}
+    for item in items:
+        if item.subscription_id not in subscription_semaphores:
+            subscription_semaphores[item.subscription_id] = asyncio.Semaphore(per_subscription_limit or max_concurrency)
+        region = item.location.lower() if per_region_limit else None
+        if region not in region_semaphores:
+            region_semaphores[region] = asyncio.Semaphore(per_region_limit or max_concurrency)
+
+    async def run_one(item):
+        flow_journal = journal.flow(flow_key(item), resume)
+        region = item.location.lower() if per_region_limit else None
+        async with region_semaphores[region], subscription_semaphores[item.subscription_id], semaphore:
+            if progress is not None:
+                progress.started(item)
+            try:
+                graph = build_graph(clients, item)
+                if inspect.isawaitable(graph):
+                    graph = await graph
+                report = await graph.run_async(journal=flow_journal)
+                result = ProvisioningResult(item.name, report)
+            except ProvisioningGraphError as e:
+                print(f"[{item.name}] Error occurred: {e}")
+                if on_failure is not None:
+                    await on_failure(clients, item, flow_journal)
+                result = ProvisioningResult(item.name, e.report, e.error)
+            except Exception as e:
+                # Planning or building the graph failed (a denied read, say): nothing was written for this item.
+                print(f"[{item.name}] Error occurred: {e}")
+                result = ProvisioningResult(item.name, error=e)
+            if progress is not None:
+                progress.finished(item, result)
+            return result
+
+    return await asyncio.gather(*(run_one(item) for item in items))
+
+
+async def provision_workspaces(stacks, max_concurrency=DEFAULT_MAX_CONCURRENCY, rollback_on_failure=False, clients=None,
+                               per_subscription_limit=None, skip_converged=True, single_deployment=False,
+                               journal=None, resume=False, preflight=True, per_region_limit=None, progress=None):
+    """Provision every stack; stacks with max_cluster_nodes get their subnets allocated first.
+
+    With preflight, every stack is checked before any of them is written
+    to, and a stack that fails its checks is not provisioned: its result
+    carries a PreflightFailed error with the full report.
+    """
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await provision_workspaces(stacks, max_concurrency, rollback_on_failure, clients,
+                                              per_subscription_limit, skip_converged, single_deployment, journal, resume,
+                                              preflight, per_region_limit, progress)
+    stacks = await allocate_subnets(clients, stacks)
+    failed = {}
+    if preflight:
+        for stack, report in zip(stacks, await preflight_workspaces(clients, stacks, max_concurrency)):
+            if report.problems:
+                report.print_report()
+            if not report.passed:
+                failed[id(stack)] = ProvisioningResult(stack.name, error=PreflightFailed(report))
+                if progress is not None:
+                    progress.finished(stack, failed[id(stack)])
+        if failed:
+            print(f"{len(failed)} of {len(stacks)} stacks failed pre-flight and will not be provisioned.")
+    on_failure = None
+    if rollback_on_failure:
+        on_failure = functools.partial(rollback_workspace, stacks=stacks)
+    if skip_converged:
+        build_graph = functools.partial(plan_and_build_workspace_graph, single_deployment=single_deployment)
+    else:
+        build_graph = build_workspace_template_graph if single_deployment else build_workspace_graph
+    passed = [stack for stack in stacks if id(stack) not in failed]
+    results = iter(await run_graphs(passed, build_graph, max_concurrency, on_failure, clients, per_subscription_limit,
+                                    journal, resume, per_region_limit, progress))
+    return [failed[id(stack)] if id(stack) in failed else next(results) for stack in stacks]
+
+
+async def check_workspaces(stacks, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None):
+    """Return a PreflightReport per stack without changing anything."""
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await check_workspaces(stacks, max_concurrency, clients)
+    return await preflight_workspaces(clients, await allocate_subnets(clients, stacks), max_concurrency)
+
+
+async def teardown_workspaces(stacks, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None, per_subscription_limit=None,
+                              keep_resource_group=False, no_wait=False, journal=None):
+    """Delete every stack; unless keep_resource_group is set, the resource group delete covers what is in it.
+
+    DNS zones and links are the ones the zone registry finds for each
+    stack, and a VNet, NSG or zone another stack still uses is kept. A
+    zone is only deleted when the journal records this tool creating it,
+    and a resource group holding a zone that VNets in other groups link
+    to is kept. With no_wait the results hold the pollers of the final
+    deletes instead of waiting for them to finish.
+    """
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await teardown_workspaces(stacks, max_concurrency, clients, per_subscription_limit,
+                                             keep_resource_group, no_wait, journal)
+    created = journal.created_resource_ids() if journal is not None else set()
+    dns_zones = await asyncio.gather(*(
+        clients.dns_zones.placement(stack.subscription_id, stack.resource_group, stack.private_dns_zone_name,
+                                    stack.vnet_id)
+        for stack in stacks
+    ))
+    groups = [] if keep_resource_group else list(dict.fromkeys((stack.subscription_id, stack.resource_group.lower())
+                                                                for stack in stacks))
+    linked_zones = dict(zip(groups, await asyncio.gather(*(externally_linked_zones(clients, sub, rg)
+                                                           for sub, rg in groups))))
+    requests = []
+    for stack, dns_zone in zip(stacks, dns_zones):
+        zones = linked_zones.get((stack.subscription_id, stack.resource_group.lower()))
+        if zones:
+            print(f"[{stack.name}] Keeping resource group {stack.resource_group}: VNets in other resource groups "
+                  f"link to {', '.join(zones)}")
+        requests.append(workspace_stack_teardown(stack, keep_resource_group or bool(zones), dns_zone, created))
+    build_graph = functools.partial(build_teardown_graph, no_wait=no_wait)
+    return await run_graphs(requests, build_graph, max_concurrency, clients=clients,
+                            per_subscription_limit=per_subscription_limit)
+
+
+async def plan_workspaces(stacks, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None):
+    """Return a ProvisioningPlan per stack without changing anything."""
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await plan_workspaces(stacks, max_concurrency, clients)
+
+    stacks = await allocate_subnets(clients, stacks)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def plan_one(stack):
+        async with semaphore:
+            return await plan_workspace_stack(clients, stack)
+
+    return await asyncio.gather(*(plan_one(stack) for stack in stacks))
+
+
+async def connect_storage_accounts(connections, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None,
+                                   single_deployment=False, journal=None, resume=False):
+    build_graph = build_storage_connection_template_graph if single_deployment else build_storage_connection_graph
+    return await run_graphs(connections, build_graph, max_concurrency, clients=clients, journal=journal, resume=resume)
+
+
+async def connect_storage_account_sets(account_sets, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None,
+                                       journal=None, resume=False):
+    return await run_graphs(account_sets, build_storage_account_set_graph, max_concurrency, clients=clients,
+                            journal=journal, resume=resume)
+
+
+async def grant_roles(grants, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None):
+    """Ensure many RoleGrants at once; only the missing assignments are created."""
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await grant_roles(grants, max_concurrency, clients)
+    return await clients.role_assignments.reconcile(grants, max_concurrency)
+
+
+async def update_private_dns_zone_group(subscription_id, resource_group, private_endpoint_name, zone_id,
+                                        config_name="dnsZoneConfig", clients=None):
+    """Point an existing private endpoint's zone group at zone_id with one small deployment."""
+    if clients is None:
+        async with AsyncAzureClients() as clients:
+            return await update_private_dns_zone_group(subscription_id, resource_group, private_endpoint_name, zone_id,
+                                                       config_name, clients)
+    print(f"[{private_endpoint_name}] Updating DNS Zone Group...")
+    await deploy_template(clients, subscription_id, resource_group,
+                          unique_deployment_name("PrivateDnsZoneGroupDeployment", private_endpoint_name),
+                          private_dns_zone_group_template(private_endpoint_name, zone_id, config_name))
+    print(f"[{private_endpoint_name}] DNS Zone Group updated successfully.")
+
+
+async def request_source_private_endpoints(requests, max_concurrency=DEFAULT_MAX_CONCURRENCY, clients=None,
+                                           journal=None, resume=False, auto_approve=False,
+                                           approval_timeout=DEFAULT_APPROVAL_TIMEOUT):
+    """Connect the query VNet to every remote workspace at once; see source_private_endpoints() for the fan-out."""
+    build_graph = functools.partial(build_source_private_endpoint_graph, auto_approve=auto_approve,
+                                    approval_timeout=approval_timeout)
+    return await run_graphs(requests, build_graph, max_concurrency, clients=clients, journal=journal, resume=resume)
+
+
+def print_results(results):
+    """Print each flow's step summary and a one-line status per flow."""
+    for result in results:
+        if result.report is not None:
+            result.report.print_summary()
+    print(f"\n{'Name':<32}{'Status':<12}{'Wall time':>12}")
+    for result in results:
+        wall_time = f"{result.report.wall_time:.1f}s" if result.report is not None else "-"
+        print(f"{result.name:<32}{'succeeded' if result.succeeded else 'failed':<12}{wall_time:>12}")
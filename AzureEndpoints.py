@@ -0,0 +1,48 @@
+import os
+from urllib.parse import urlsplit
+
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+
+from ProvisioningTrace import HttpTracingPolicy
+
+DEFAULT_ARM_ENDPOINT = "https://management.azure.com"
+# Point every management client at another ARM endpoint, e.g. the local FakeAzure server.
+ARM_ENDPOINT_ENV = "AZURE_ARM_ENDPOINT"
+# Plain-HTTP endpoints, which get bearer tokens in cleartext, are only allowed on these hosts.
+LOOPBACK_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+class AllowHttpPolicy(SansIOHTTPPolicy):
+    """Lets bearer tokens go to a plain-HTTP endpoint; only applied to loopback ones (see check_plain_http)."""
+
+    def on_request(self, request):
+        request.context["enforce_https"] = False
+
+
+def check_plain_http(url, setting):
+    """Return whether url is plain HTTP; raises ValueError when it is and its host is not a loopback one.
+
+    setting names where the URL came from, for the error message.
+    """
+    if not url.lower().startswith("http://"):
+        return False
+    if urlsplit(url).hostname not in LOOPBACK_HOSTS:
+        raise ValueError(f"{setting} is {url}: plain HTTP would send bearer tokens in cleartext, and is only "
+                         f"allowed for {', '.join(LOOPBACK_HOSTS)}")
+    return True
+
+
+def arm_endpoint():
+    return os.environ.get(ARM_ENDPOINT_ENV, DEFAULT_ARM_ENDPOINT).rstrip("/")
+
+
+def arm_client_options():
+    """Keyword arguments for azure.mgmt clients (sync or aio): AZURE_ARM_ENDPOINT and request tracing."""
+    options = {"per_retry_policies": [HttpTracingPolicy()]}
+    endpoint = arm_endpoint()
+    if endpoint == DEFAULT_ARM_ENDPOINT:
+        return options
+    options["base_url"] = endpoint
+    if check_plain_http(endpoint, ARM_ENDPOINT_ENV):
+        options["per_call_policies"] = [AllowHttpPolicy()]
+    return options
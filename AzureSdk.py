@@ -0,0 +1,48 @@
+import functools
+import importlib
+
+# Client package per name: (package, client class name, API version).
+# SDKs that ship one package per API version are pinned by importing the package of the version ArmTemplates
+# deploys with; SDKs that ship one package for every version, such as azure-mgmt-network, are pinned by passing
+# the API version to the client. Single-API SDKs have nothing to pin.
+CLIENT_PACKAGES = {
+    "resource": ("azure.mgmt.resource.resources.v2022_09_01", "ResourceManagementClient", None),
+    "network": ("azure.mgmt.network", "NetworkManagementClient", "2023-09-01"),
+    "authorization": ("azure.mgmt.authorization.v2022_04_01", "AuthorizationManagementClient", None),
+    "databricks": ("azure.mgmt.databricks", "AzureDatabricksManagementClient", None),
+    "storage": ("azure.mgmt.storage", "StorageManagementClient", None),
+    "private_dns": ("azure.mgmt.privatedns", "PrivateDnsManagementClient", None),
+    "compute": ("azure.mgmt.compute", "ComputeManagementClient", None),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _package(name):
+    """The client's package; raises ImportError naming it when the installed SDK does not ship it."""
+    package = CLIENT_PACKAGES[name][0]
+    try:
+        importlib.import_module(package)
+    except ModuleNotFoundError as e:
+        raise ImportError(f"{package} is not in the installed Azure SDK; install an azure-mgmt package "
+                          f"version that ships it") from e
+    return package
+
+
+def client_class(name, aio=False):
+    """The management client class for a CLIENT_PACKAGES name, imported on first use."""
+    package = _package(name)
+    module = importlib.import_module(f"{package}.aio" if aio else package)
+    return getattr(module, CLIENT_PACKAGES[name][1])
+
+
+def create_client(name, credential, subscription_id, aio=False, **options):
+    """A management client for a CLIENT_PACKAGES name, pinned to its API version."""
+    api_version = CLIENT_PACKAGES[name][2]
+    if api_version is not None:
+        options["api_version"] = api_version
+    return client_class(name, aio)(credential, subscription_id, **options)
+
+
+def models(name):
+    """The models module matching client_class(name)."""
+    return importlib.import_module(f"{_package(name)}.models")
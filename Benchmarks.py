@@ -0,0 +1,428 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from FakeAzure import FakeAzure, DEFAULT_LRO_LATENCY
+
+DEFAULT_RESULTS_PATH = "benchmark-results.jsonl"
+DEFAULT_STACK_COUNTS = (1, 10)
+DEFAULT_LATENCY_SCALE = 0.1
+DEFAULT_POLL_INTERVAL = 0.1
+# A scenario is a regression when it is this much slower than the median of its recorded history.
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+HISTORY_WINDOW = 5
+# Storage accounts per workspace in the storage_account_sets scenario, each with a dfs and a blob endpoint.
+ACCOUNTS_PER_SET = 10
+SUBSCRIPTIONS = ("00000000-0000-0000-0000-000000000001", "00000000-0000-0000-0000-000000000002")
+# The scripts' own constants: the storage account ConnectStorageAccountToADB.py reads must already exist.
+SCRIPT_STORAGE_ACCOUNT_ID = ("/subscriptions/<>/resourceGroups/adqueryvnettestrg"
+                             "/providers/Microsoft.Storage/storageAccounts/adlsstoragedev01")
+SCRIPTS = (
+    "AzureDatabricksVNETProvisioning.py",
+    "ConnectStorageAccountToADB.py",
+    "SourcePrivateEndpointRequest.py",
+    "GenerateDatabricks-Cluster-Jobs-Ini.py",
+)
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# CLI commands the startup benchmark runs, each in a fresh interpreter; see run_startup().
+STARTUP_COMMANDS = {
+    "help": ["--help"],
+    "workspace_help": ["workspace", "--help"],
+    "workspace_plan": ["workspace", "--plan"],
+    "zone_group": ["zone-group", "--subscription-id", "<>", "--resource-group", "adqueryvnettestrg",
+                   "--private-endpoint", "adbdevqueryvnet2wsPE",
+                   "--zone-id", "/subscriptions/<>/resourceGroups/adqueryvnettestrg"
+                                "/providers/Microsoft.Network/privateDnsZones/privatelink.azuredatabricks.net"],
+}
+# A command should reach its first request (or exit, if it makes none) within this many seconds.
+STARTUP_BUDGET = 1.0
+STARTUP_REPEATS = 3
+
+
+def fake_environment(base_url):
+    """Environment that sends every script's ARM, token and Databricks traffic to the fake."""
+    return {
+        "AZURE_ARM_ENDPOINT": base_url,
+        "AZURE_CREDENTIAL_TYPE": "static",
+        "AZURE_ACCESS_TOKEN": "benchmark",
+        "DATABRICKS_WORKSPACE_URL": base_url,
+    }
+
+
+def polling_environment(fake, workdir):
+    """Environment that keeps LRO history and polling policies in workdir, scaled to the fake's latencies.
+
+    The production policies wait minutes before the first workspace poll,
+    and fake durations must not tune the real lro-history.json.
+    """
+    from LroPolling import DEFAULT_POLICIES, HISTORY_PATH_ENV, POLLING_CONFIG_ENV
+
+    policies = {}
+    for resource_type in DEFAULT_POLICIES:
+        latency = fake.lro_latencies.get(resource_type, DEFAULT_LRO_LATENCY) * fake.latency_scale
+        policies[resource_type] = {"initial_delay": latency / 2, "min_interval": fake.poll_interval,
+                                   "max_interval": fake.poll_interval * 4}
+    config_path = os.path.join(workdir, "lro-polling.json")
+    with open(config_path, "w") as f:
+        json.dump(policies, f)
+    return {
+        POLLING_CONFIG_ENV: config_path,
+        HISTORY_PATH_ENV: os.path.join(workdir, "lro-history.json"),
+    }
+
+
+def bench_stacks(count):
+    from ProvisioningSpecs import WorkspaceStack
+
+    return [WorkspaceStack(subscription_id=SUBSCRIPTIONS[i % len(SUBSCRIPTIONS)], resource_group=f"bench-rg-{i:03d}",
+                           location="uksouth", workspace_name=f"benchws{i:03d}", vnet_name=f"benchvnet{i:03d}")
+            for i in range(count)]
+
+
+def bench_connections(stacks):
+    from ProvisioningSpecs import StorageConnection
+
+    return [StorageConnection(subscription_id=stack.subscription_id, resource_group=stack.resource_group,
+                              location=stack.location, storage_account_name=f"benchadls{i:03d}",
+                              vnet_name=stack.vnet_name, workspace_name=stack.workspace_name)
+            for i, stack in enumerate(stacks)]
+
+
+def bench_storage_account_sets(stacks):
+    from ProvisioningSpecs import StorageAccountSet
+
+    return [StorageAccountSet(subscription_id=stack.subscription_id, resource_group=stack.resource_group,
+                              location=stack.location, vnet_name=stack.vnet_name, workspace_name=stack.workspace_name,
+                              storage_account_names=[f"benchlake{i:03d}x{j:02d}" for j in range(ACCOUNTS_PER_SET)],
+                              sub_resources=["dfs", "blob"])
+            for i, stack in enumerate(stacks)]
+
+
+def bench_source_endpoints(stacks):
+    from ProvisioningSpecs import SourcePrivateEndpoint
+
+    # Each stack's VNet reaches the next stack's workspace, as a query VNet would reach a source workspace.
+    return [SourcePrivateEndpoint(subscription_id=stack.subscription_id, resource_group=stack.resource_group,
+                                  location=stack.location, vnet_name=stack.vnet_name,
+                                  remote_workspace_id=stacks[(i + 1) % len(stacks)].workspace_id,
+                                  private_endpoint_name=f"benchsourcepe{i:03d}")
+            for i, stack in enumerate(stacks)]
+
+
+async def run_async_scenario(flow, items):
+    from AsyncProvisioning import AsyncAzureClients
+
+    async with AsyncAzureClients() as clients:
+        results = await flow(items, max_concurrency=len(items), clients=clients)
+    failed = [result.name for result in results if not result.succeeded]
+    if failed:
+        raise RuntimeError(f"{len(failed)} flows failed: {', '.join(failed[:5])}")
+
+
+def run_cluster_jobs(fake, stacks, instance_pool_id=None):
+    """Create a cluster and a job per stack and run them all; returns the time to the first running task.
+
+    With instance_pool_id the clusters take their nodes from that (warm) pool.
+    """
+    from ClusterPools import FirstTaskTimer, attach_to_pool
+    from DatabricksClient import DatabricksClient
+    from RunWatcher import wait_for_cluster, watch_runs
+    from TokenBroker import TokenBroker
+
+    interval = fake.poll_interval
+    timer = FirstTaskTimer()
+    timer.warm = instance_pool_id is not None
+    with DatabricksClient(fake.base_url, TokenBroker()) as client:
+        configs = [{"cluster_name": f"bench-{stack.workspace_name}", "spark_version": "16.1.x-scala2.12",
+                    "node_type_id": "Standard_D4ds_v5", "num_workers": 2} for stack in stacks]
+        if instance_pool_id is not None:
+            configs = [attach_to_pool(config, instance_pool_id) for config in configs]
+        cluster_ids = [result.value for result in client.create_clusters(configs)]
+        job_ids = [result.value for result in client.create_jobs([
+            {"name": f"SparkJarJob-{cluster_id}",
+             "tasks": [{"task_key": "Task", "existing_cluster_id": cluster_id,
+                        "spark_jar_task": {"main_class_name": "org.proj.deltamain"}}]}
+            for cluster_id in cluster_ids])]
+        client.bulk(lambda cluster_id: wait_for_cluster(client, cluster_id, min_interval=interval,
+                                                        max_interval=interval * 4), cluster_ids)
+        run_ids = [result.value for result in client.bulk(client.run_now, job_ids)]
+        states = asyncio.run(watch_runs(client, run_ids, min_interval=interval, max_interval=interval * 4,
+                                        on_transition=timer.task_started))
+    if not all(state.succeeded for state in states.values()):
+        raise RuntimeError("Some job runs did not succeed")
+    return {"time_to_first_task": round(timer.seconds, 3)}
+
+
+def run_job_graph(fake, stacks):
+    """Submit one multi-task job on a shared job cluster and run it once per stack with bulk run-now."""
+    from DatabricksClient import DatabricksClient
+    from JobSpecs import JarTask, JobGraph, SHARED_CLUSTER_KEY
+    from RunWatcher import watch_runs
+    from TokenBroker import TokenBroker
+
+    interval = fake.poll_interval
+    graph = JobGraph("bench-pipeline", {SHARED_CLUSTER_KEY: {"spark_version": "16.1.x-scala2.12",
+                                                             "node_type_id": "Standard_D4ds_v5", "num_workers": 2}},
+                     parameters={"stack": ""}, max_concurrent_runs=len(stacks))
+    graph.add(JarTask("ingest", "org.proj.ingest", ["{{job.parameters.stack}}"]))
+    for name in ("clean", "enrich"):
+        graph.add(JarTask(name, f"org.proj.{name}", depends_on=["ingest"]))
+    graph.add(JarTask("publish", "org.proj.publish", depends_on=["clean", "enrich"]))
+    with DatabricksClient(fake.base_url, TokenBroker()) as client:
+        job_id = client.create_job(graph.settings())
+        run_ids = [result.value for result in client.run_jobs(job_id, [{"stack": stack.workspace_name}
+                                                                       for stack in stacks])]
+        states = asyncio.run(watch_runs(client, run_ids, job_id, min_interval=interval, max_interval=interval * 4))
+    if not all(state.succeeded for state in states.values()):
+        raise RuntimeError("Some job runs did not succeed")
+
+
+def run_reconcile(fake, stacks):
+    """Ensure a cluster and a job per stack through the reconciler; a second call should only list."""
+    from DatabricksClient import DatabricksClient
+    from DatabricksReconciler import DatabricksReconciler
+    from TokenBroker import TokenBroker
+
+    with DatabricksClient(fake.base_url, TokenBroker()) as client:
+        results = DatabricksReconciler(client).reconcile(
+            clusters=[{"cluster_name": f"reconcile-{stack.workspace_name}", "spark_version": "16.1.x-scala2.12",
+                       "node_type_id": "Standard_D4ds_v5", "num_workers": 2} for stack in stacks],
+            jobs=[{"name": f"reconcile-{stack.workspace_name}",
+                   "tasks": [{"task_key": "Task", "spark_jar_task": {"main_class_name": "org.proj.deltamain"}}]}
+                  for stack in stacks])
+    failed = [result.name for result in results if not result.succeeded]
+    if failed:
+        raise RuntimeError(f"{len(failed)} objects failed to reconcile: {', '.join(failed[:5])}")
+
+
+def warm_instance_pool(fake, stacks):
+    """Create a pool with an idle instance per stack and wait until they are all idle; returns its ID."""
+    from ClusterPools import InstancePoolSpec, ensure_instance_pool
+    from DatabricksClient import DatabricksClient
+    from TokenBroker import TokenBroker
+
+    spec = InstancePoolSpec("bench-pool", "Standard_D4ds_v5", min_idle_instances=len(stacks))
+    with DatabricksClient(fake.base_url, TokenBroker()) as client:
+        pool = ensure_instance_pool(client, spec)
+        while client.get_instance_pool(pool.instance_pool_id)["stats"]["idle_count"] < len(stacks):
+            time.sleep(fake.poll_interval)
+    return pool.instance_pool_id
+
+
+def run_scripts(fake):
+    """Run the four scripts unmodified, each in its own interpreter, against the fake."""
+    env = {**os.environ, **fake_environment(fake.base_url), "PYTHONPATH": REPO_DIR}
+    fake.seed(SCRIPT_STORAGE_ACCOUNT_ID, {"location": "uksouth", "kind": "StorageV2"})
+    timings = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for script in SCRIPTS:
+            start = time.monotonic()
+            completed = subprocess.run([sys.executable, os.path.join(REPO_DIR, script)], cwd=workdir, env=env,
+                                       capture_output=True, text=True)
+            timings[script] = time.monotonic() - start
+            if completed.returncode != 0:
+                raise RuntimeError(f"{script} exited with {completed.returncode}:\n{completed.stdout[-2000:]}")
+    return timings
+
+
+def run_startup(fake, repeats=STARTUP_REPEATS):
+    """Median seconds from launch to each CLI command's first request, or to its exit when it makes none."""
+    env = {**os.environ, **fake_environment(fake.base_url), "PYTHONPATH": REPO_DIR}
+    timings = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, argv in STARTUP_COMMANDS.items():
+            samples = []
+            for _ in range(repeats):
+                fake.reset_stats()
+                start = time.monotonic()
+                completed = subprocess.run([sys.executable, os.path.join(REPO_DIR, "ProvisioningCli.py"), *argv],
+                                           cwd=workdir, env=env, capture_output=True, text=True)
+                end = fake.first_request_at or time.monotonic()
+                if completed.returncode != 0:
+                    raise RuntimeError(f"{name} exited with {completed.returncode}:\n{completed.stdout[-2000:]}"
+                                       f"{completed.stderr[-2000:]}")
+                samples.append(end - start)
+            timings[name] = round(statistics.median(samples), 3)
+    return timings
+
+
+def seed_storage_accounts(fake, connections):
+    for connection in connections:
+        fake.seed(f"/subscriptions/{connection.subscription_id}/resourceGroups/{connection.resource_group}"
+                  f"/providers/Microsoft.Storage/storageAccounts/{connection.storage_account_name}",
+                  {"location": connection.location, "kind": "StorageV2", "sku": {"name": "Standard_LRS"}})
+
+
+def seed_storage_account_sets(fake, account_sets):
+    for account_set in account_sets:
+        for name in account_set.storage_account_names:
+            fake.seed(f"/subscriptions/{account_set.subscription_id}/resourceGroups/{account_set.resource_group}"
+                      f"/providers/Microsoft.Storage/storageAccounts/{name}",
+                      {"location": account_set.location, "kind": "StorageV2", "sku": {"name": "Standard_LRS"}})
+
+
+def benchmark(stack_count, fake_options, include_scripts=False, include_startup=False):
+    """Time every flow at stack_count stacks against a fresh fake; returns one record per scenario."""
+    from AsyncProvisioning import (
+        provision_workspaces,
+        connect_storage_accounts,
+        connect_storage_account_sets,
+        request_source_private_endpoints,
+    )
+
+    records = []
+    with FakeAzure(**fake_options) as fake, tempfile.TemporaryDirectory() as polling_dir:
+        os.environ.update(fake_environment(fake.base_url))
+        os.environ.update(polling_environment(fake, polling_dir))
+        stacks = bench_stacks(stack_count)
+        connections = bench_connections(stacks)
+        seed_storage_accounts(fake, connections)
+        account_sets = bench_storage_account_sets(stacks)
+        seed_storage_account_sets(fake, account_sets)
+        instance_pool_id = warm_instance_pool(fake, stacks)
+        scenarios = [
+            ("workspace_stacks", lambda: asyncio.run(run_async_scenario(provision_workspaces, stacks))),
+            ("storage_connections", lambda: asyncio.run(run_async_scenario(connect_storage_accounts, connections))),
+            ("storage_account_sets",
+             lambda: asyncio.run(run_async_scenario(connect_storage_account_sets, account_sets))),
+            ("source_private_endpoints",
+             lambda: asyncio.run(run_async_scenario(request_source_private_endpoints, bench_source_endpoints(stacks)))),
+            ("cluster_jobs", lambda: run_cluster_jobs(fake, stacks)),
+            ("cluster_jobs_pool", lambda: run_cluster_jobs(fake, stacks, instance_pool_id)),
+            ("job_graph", lambda: run_job_graph(fake, stacks)),
+            ("reconcile", lambda: run_reconcile(fake, stacks)),
+            ("reconcile_converged", lambda: run_reconcile(fake, stacks)),
+        ]
+        for scenario, run in scenarios:
+            fake.reset_stats()
+            start = time.monotonic()
+            extra = run()
+            records.append(_record(scenario, stack_count, time.monotonic() - start, fake, fake_options))
+            records[-1].update(extra or {})
+
+        if include_startup:
+            timings = run_startup(fake)
+            record = _record("startup", 1, max(timings.values()), fake, fake_options)
+            record["commands"] = timings
+            records.append(record)
+            for name, seconds in timings.items():
+                print(f"Startup of {name}: {seconds:.2f}s{'  OVER BUDGET' if seconds > STARTUP_BUDGET else ''}")
+
+        if include_scripts:
+            fake.reset_stats()
+            timings = run_scripts(fake)
+            record = _record("scripts", 1, sum(timings.values()), fake, fake_options)
+            record["scripts"] = timings
+            records.append(record)
+    return records
+
+
+def _record(scenario, stack_count, wall_time, fake, fake_options):
+    return {
+        "scenario": scenario,
+        "stacks": stack_count,
+        "wall_time": round(wall_time, 3),
+        "requests": dict(fake.stats),
+        "config": {key: value for key, value in fake_options.items() if key != "seed"},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(record, history):
+    """Ratio of the record's wall time to the median of its last HISTORY_WINDOW comparable runs, or None."""
+    previous = [entry["wall_time"] for entry in history
+                if (entry["scenario"], entry["stacks"], entry["config"]) ==
+                   (record["scenario"], record["stacks"], record["config"])][-HISTORY_WINDOW:]
+    if not previous:
+        return None
+    return record["wall_time"] / statistics.median(previous)
+
+
+def print_records(records, history, threshold):
+    print(f"\n{'Scenario':<28}{'Stacks':>7}{'Wall time':>11}{'Per stack':>11}{'Requests':>10}{'Polls':>8}"
+          f"{'Faults':>8}  vs. history")
+    regressions = []
+    for record in records:
+        requests = record["requests"]
+        faults = sum(count for kind, count in requests.items() if kind.startswith("fault_"))
+        ratio = compare(record, history)
+        verdict = "-" if ratio is None else f"{ratio:.2f}x"
+        if ratio is not None and ratio > 1 + threshold:
+            verdict += "  REGRESSION"
+            regressions.append(record)
+        print(f"{record['scenario']:<28}{record['stacks']:>7}{record['wall_time']:>10.1f}s"
+              f"{record['wall_time'] / record['stacks']:>10.1f}s{sum(requests.values()):>10}"
+              f"{requests.get('lro_poll', 0):>8}{faults:>8}  {verdict}")
+    for record in records:
+        if "time_to_first_task" in record:
+            print(f"Time to first task in {record['scenario']} ({record['stacks']} stacks): "
+                  f"{record['time_to_first_task']:.2f}s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the provisioning and cluster/job flows against a local fake.")
+    parser.add_argument("--stacks", type=int, nargs="+", default=list(DEFAULT_STACK_COUNTS),
+                        help="stack counts to benchmark")
+    parser.add_argument("--latency-scale", type=float, default=DEFAULT_LATENCY_SCALE,
+                        help="multiply the fake's LRO latencies")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Retry-After the fake sends for operations in progress")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--scripts", action="store_true", help="also run the four scripts end to end")
+    parser.add_argument("--startup", action="store_true",
+                        help="also time how long CLI commands take to start (--help, --plan, a zone-group update)")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument("--no-record", action="store_true", help="compare with the history without appending")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="slowdown against the recorded median that counts as a regression")
+    args = parser.parse_args(argv)
+
+    fake_options = {
+        "latency_scale": args.latency_scale,
+        "poll_interval": args.poll_interval,
+        "fault_rates": {429: args.throttle_rate, 503: args.error_rate},
+        "seed": 0,
+    }
+    records = []
+    for index, stack_count in enumerate(args.stacks):
+        print(f"Benchmarking {stack_count} stacks...")
+        records += benchmark(stack_count, fake_options, include_scripts=args.scripts and index == 0,
+                             include_startup=args.startup and index == 0)
+
+    # JSON turns the fault_rates keys into strings; do the same before comparing with the history.
+    records = json.loads(json.dumps(records))
+    history = load_history(args.results)
+    regressions = print_records(records, history, args.threshold)
+    if not args.no_record:
+        commit, timestamp = git_commit(), time.time()
+        with open(args.results, "a") as f:
+            for record in records:
+                f.write(json.dumps({"timestamp": timestamp, "commit": commit, **record}) + "\n")
+        print(f"\nRecorded {len(records)} results in {args.results}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import copy
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+
+from ProvisioningTrace import current_span
+
+# Clusters carry the hash of the config they were created from, so a later run can find and reuse them.
+CONFIG_HASH_TAG = "iac-config-hash"
+# Node settings a pool supplies; a cluster on a pool must not set them itself.
+POOL_NODE_FIELDS = ("node_type_id", "driver_node_type_id", "instance_pool_id", "driver_instance_pool_id",
+                    "enable_elastic_disk", "azure_attributes")
+
+
+@dataclass
+class InstancePoolSpec:
+    """An instance pool that keeps min_idle_instances VMs warm for clusters and job clusters."""
+    instance_pool_name: str
+    node_type_id: str
+    min_idle_instances: int = 2
+    max_capacity: int = None
+    idle_instance_autotermination_minutes: int = 60
+    preloaded_spark_versions: list = field(default_factory=list)
+
+    def config(self):
+        config = {
+            "instance_pool_name": self.instance_pool_name,
+            "node_type_id": self.node_type_id,
+            "min_idle_instances": self.min_idle_instances,
+            "idle_instance_autotermination_minutes": self.idle_instance_autotermination_minutes,
+        }
+        if self.max_capacity is not None:
+            config["max_capacity"] = self.max_capacity
+        if self.preloaded_spark_versions:
+            config["preloaded_spark_versions"] = list(self.preloaded_spark_versions)
+        return config
+
+
+@dataclass
+class InstancePool:
+    """The pool a run uses, and how many idle instances it had when the run started."""
+    instance_pool_id: str
+    idle_count: int = 0
+    created: bool = False
+
+    @property
+    def warm(self):
+        return self.idle_count > 0
+
+
+def config_hash(config, tags_field="custom_tags"):
+    """Stable hash of a cluster config (or, with tags_field="tags", job settings), ignoring its hash tag."""
+    config = copy.deepcopy(config)
+    config.get(tags_field, {}).pop(CONFIG_HASH_TAG, None)
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def tag_config(config, tags_field="custom_tags"):
+    """A copy of the config carrying its own config_hash as a tag."""
+    tagged = copy.deepcopy(config)
+    tagged.setdefault(tags_field, {})[CONFIG_HASH_TAG] = config_hash(config, tags_field)
+    return tagged
+
+
+def attach_to_pool(config, instance_pool_id):
+    """A copy of a cluster (or job cluster) config whose driver and workers come from the pool."""
+    attached = {key: value for key, value in copy.deepcopy(config).items() if key not in POOL_NODE_FIELDS}
+    attached["instance_pool_id"] = instance_pool_id
+    attached["driver_instance_pool_id"] = instance_pool_id
+    return attached
+
+
+def ensure_instance_pool(client, spec):
+    """Create the pool, or reuse the one with the same name, raising its min idle count when it is lower."""
+    for pool in client.list_instance_pools():
+        if pool.get("instance_pool_name") != spec.instance_pool_name:
+            continue
+        idle_count = pool.get("stats", {}).get("idle_count", 0)
+        if pool.get("min_idle_instances", 0) < spec.min_idle_instances:
+            print(f"[pool {spec.instance_pool_name}] Raising min idle instances to {spec.min_idle_instances}...")
+            client.edit_instance_pool({**spec.config(), "instance_pool_id": pool["instance_pool_id"]})
+        print(f"[pool {spec.instance_pool_name}] Reusing pool {pool['instance_pool_id']} ({idle_count} idle).")
+        return InstancePool(pool["instance_pool_id"], idle_count)
+    print(f"[pool {spec.instance_pool_name}] Creating instance pool with {spec.min_idle_instances} idle instances...")
+    return InstancePool(client.create_instance_pool(spec.config()), created=True)
+
+
+class FirstTaskTimer:
+    """Time from launch until the first task starts, reported with whether warm capacity was used."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_task_at = None
+        self.warm = None
+
+    def task_started(self, transition):
+        """A watch_runs on_transition callback: notes when the first run reaches RUNNING."""
+        if self.first_task_at is None and transition.current.life_cycle_state == "RUNNING":
+            self.first_task_at = time.monotonic()
+
+    @property
+    def seconds(self):
+        return None if self.first_task_at is None else self.first_task_at - self.started
+
+    def report(self, source):
+        """Print and trace the time to first task; source says where the capacity came from."""
+        if self.seconds is None:
+            print("No task started.")
+            return
+        capacity = "warm" if self.warm else "cold"
+        print(f"Time to first task: {self.seconds:.1f}s ({capacity}: {source})")
+        span = current_span()
+        if span is not None:
+            span.set("cluster.time_to_first_task", round(self.seconds, 3))
+            span.set("cluster.warm", bool(self.warm))
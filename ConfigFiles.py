@@ -0,0 +1,13 @@
+import json
+
+
+def load_document(path):
+    """The contents of a YAML (.yaml/.yml) or JSON file; PyYAML is only needed for YAML."""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(f"PyYAML is required to read {path}: pip install pyyaml")
+            return yaml.safe_load(f)
+        return json.load(f)
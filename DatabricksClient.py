@@ -0,0 +1,274 @@
+import email.utils
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from AzureEndpoints import check_plain_http
+from ProvisioningTrace import content_length, record_http
+from TokenBroker import DATABRICKS_SCOPE
+
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+DEFAULT_BULK_CONCURRENCY = 8
+# Databricks throttles REST calls per workspace; pacing requests keeps bulk runs below it instead of living on 429s.
+DEFAULT_REQUESTS_PER_SECOND = 20
+RETRYABLE_STATUS_CODES = (429, 503)
+# A 429 was refused before anything ran, so any call may retry it; a 503 may come after the call took effect.
+THROTTLED_STATUS_CODES = (429,)
+# POSTs that leave the workspace in the same state however often they are replayed, so they retry 503s too.
+IDEMPOTENT_POSTS = frozenset({
+    "/api/2.0/clusters/edit",
+    "/api/2.0/clusters/start",
+    "/api/2.0/clusters/permanent-delete",
+    "/api/2.0/instance-pools/edit",
+    "/api/2.1/jobs/reset",
+    "/api/2.1/jobs/delete",
+})
+# clusters/list and jobs/list return at most this many objects per page.
+LIST_PAGE_SIZE = 100
+
+
+class DatabricksApiError(Exception):
+    """A Databricks REST call that failed, after retries where the status allows them."""
+
+    def __init__(self, method, path, status_code, text):
+        super().__init__(f"{method} {path} failed with {status_code}: {text}")
+        self.method = method
+        self.path = path
+        self.status_code = status_code
+        self.text = text
+
+
+@dataclass
+class BulkResult:
+    """Outcome of one item of a bulk operation."""
+    item: object
+    value: object = None
+    error: Exception = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class RequestRateLimiter:
+    """Thread-safe token bucket that spaces requests to one workspace."""
+
+    def __init__(self, requests_per_second, burst=None):
+        self.rate = float(requests_per_second)
+        self.capacity = burst or requests_per_second
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_after_seconds(response):
+    """Seconds the server asked us to wait, from retry-after-ms or a numeric or HTTP-date Retry-After header."""
+    milliseconds = response.headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return max(0.0, float(milliseconds) / 1000)
+        except ValueError:
+            pass
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class DatabricksClient:
+    """Databricks REST client over one pooled HTTP session.
+
+    Tokens come from the credential (a TokenBroker caches them), so a
+    long bulk run keeps working across token refreshes. Throttled (429)
+    and unavailable (503) responses are retried with exponential backoff
+    and full jitter, or after the server's Retry-After when it sends one.
+    """
+
+    def __init__(self, workspace_url, credential, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE, max_backoff=DEFAULT_MAX_BACKOFF,
+                 requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        self.workspace_url = workspace_url.rstrip("/")
+        # requests sends the bearer token over plain HTTP too; only a local fake may ask for that.
+        check_plain_http(self.workspace_url, "The Databricks workspace URL")
+        self.credential = credential
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.limiter = RequestRateLimiter(requests_per_second) if requests_per_second else None
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_connections))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _backoff(self, attempt, response):
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, path, body=None, params=None, idempotent=None):
+        """Send one API call and return the decoded JSON body.
+
+        429s are always retried; 503s only for GETs and calls that are safe
+        to replay (idempotent, by default IDEMPOTENT_POSTS), so a create
+        that went through is not repeated.
+        """
+        url = f"{self.workspace_url}{path}"
+        if idempotent is None:
+            idempotent = method == "GET" or path in IDEMPOTENT_POSTS
+        retryable = RETRYABLE_STATUS_CODES if idempotent else THROTTLED_STATUS_CODES
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            headers = {"Authorization": f"Bearer {self.credential.get_token(DATABRICKS_SCOPE).token}"}
+            response = self.session.request(method, url, headers=headers, json=body, params=params)
+            record_http(method, response.status_code, response.headers,
+                        content_length(response.request.body) if response.request is not None else 0,
+                        len(response.content or b""))
+            if response.status_code in retryable and attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, response))
+                continue
+            if not response.ok:
+                raise DatabricksApiError(method, path, response.status_code, response.text)
+            return response.json() if response.content else {}
+
+    def get(self, path, params=None):
+        return self.request("GET", path, params=params)
+
+    def post(self, path, body=None, idempotent=None):
+        return self.request("POST", path, body=body, idempotent=idempotent)
+
+    def _list_pages(self, path, key, params):
+        """Every item under key across the pages of a list call."""
+        items = []
+        while True:
+            page = self.get(path, params)
+            items += page.get(key, [])
+            if not page.get("next_page_token"):
+                return items
+            params = {**params, "page_token": page["next_page_token"]}
+
+    # Clusters and jobs
+    def create_cluster(self, config):
+        return self.post("/api/2.0/clusters/create", config)["cluster_id"]
+
+    def get_cluster(self, cluster_id):
+        return self.get("/api/2.0/clusters/get", {"cluster_id": cluster_id})
+
+    def list_clusters(self):
+        """Every cluster in the workspace, following next_page_token when the API pages the list."""
+        return self._list_pages("/api/2.0/clusters/list", "clusters", {"page_size": LIST_PAGE_SIZE})
+
+    def edit_cluster(self, config):
+        """Replace the config of config["cluster_id"]; a running cluster restarts with it."""
+        self.post("/api/2.0/clusters/edit", config)
+
+    def start_cluster(self, cluster_id):
+        self.post("/api/2.0/clusters/start", {"cluster_id": cluster_id})
+
+    def delete_cluster(self, cluster_id):
+        """Permanently delete the cluster, so it no longer shows up in clusters/list."""
+        self.post("/api/2.0/clusters/permanent-delete", {"cluster_id": cluster_id})
+
+    # Instance pools
+    def create_instance_pool(self, config):
+        return self.post("/api/2.0/instance-pools/create", config)["instance_pool_id"]
+
+    def edit_instance_pool(self, config):
+        self.post("/api/2.0/instance-pools/edit", config)
+
+    def get_instance_pool(self, instance_pool_id):
+        return self.get("/api/2.0/instance-pools/get", {"instance_pool_id": instance_pool_id})
+
+    def list_instance_pools(self):
+        return self.get("/api/2.0/instance-pools/list").get("instance_pools", [])
+
+    def create_job(self, settings):
+        return self.post("/api/2.1/jobs/create", settings)["job_id"]
+
+    def list_jobs(self):
+        """Every job in the workspace with its settings (tasks omitted), following next_page_token."""
+        return self._list_pages("/api/2.1/jobs/list", "jobs", {"limit": LIST_PAGE_SIZE})
+
+    def reset_job(self, job_id, settings):
+        """Replace every setting of the job; its ID, run history and permissions stay."""
+        self.post("/api/2.1/jobs/reset", {"job_id": job_id, "new_settings": settings})
+
+    def delete_job(self, job_id):
+        self.post("/api/2.1/jobs/delete", {"job_id": job_id})
+
+    def run_now(self, job_id, **parameters):
+        """Start a run; its idempotency_token makes a retried request return the run the first one started."""
+        body = {"job_id": job_id, "idempotency_token": str(uuid.uuid4()), **parameters}
+        return self.post("/api/2.1/jobs/run-now", body, idempotent=True)["run_id"]
+
+    def get_run(self, run_id):
+        return self.get("/api/2.1/jobs/runs/get", {"run_id": run_id})
+
+    def list_runs(self, job_id=None, active_only=False, offset=0, limit=25):
+        """One page of runs, newest first; returns (runs, has_more)."""
+        params = {"offset": offset, "limit": limit, "active_only": str(active_only).lower()}
+        if job_id is not None:
+            params["job_id"] = job_id
+        page = self.get("/api/2.1/jobs/runs/list", params)
+        return page.get("runs", []), page.get("has_more", False)
+
+    # Bulk operations
+    def bulk(self, operation, items, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """Apply operation to every item on a bounded thread pool; returns one BulkResult per item, in order."""
+        def run(item):
+            try:
+                return BulkResult(item, operation(item))
+            except Exception as e:
+                return BulkResult(item, error=e)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(items)))) as executor:
+            return list(executor.map(run, items))
+
+    def create_clusters(self, configs, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        return self.bulk(self.create_cluster, configs, max_concurrency)
+
+    def create_jobs(self, settings, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        return self.bulk(self.create_job, settings, max_concurrency)
+
+    def run_jobs(self, job_id, parameter_sets, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """run-now once per job parameter mapping, at most max_concurrency submissions in flight."""
+        def run(parameters):
+            return self.run_now(job_id, job_parameters={name: str(value) for name, value in parameters.items()})
+
+        return self.bulk(run, parameter_sets, max_concurrency)
@@ -0,0 +1,154 @@
+import threading
+from dataclasses import dataclass
+
+from ClusterPools import CONFIG_HASH_TAG, config_hash, tag_config
+from DatabricksClient import DEFAULT_BULK_CONCURRENCY
+
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+# A cluster in one of these states is already up, or on its way up.
+ACTIVE_CLUSTER_STATES = ("RUNNING", "PENDING", "RESIZING", "RESTARTING")
+STOPPED_CLUSTER_STATES = ("TERMINATING", "TERMINATED")
+
+
+@dataclass
+class ReconcileResult:
+    """What ensure_cluster or ensure_job did for one named object."""
+    kind: str
+    name: str
+    object_id: object = None
+    action: str = None
+    state: str = None
+    duplicates: int = 0
+    error: Exception = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+def _hash_tag(config, tags_field):
+    return (config.get(tags_field) or {}).get(CONFIG_HASH_TAG)
+
+
+class DatabricksReconciler:
+    """Creates clusters and jobs only when missing, and updates them in place when their config changed.
+
+    Clusters and jobs are listed once (every page) on first use and
+    indexed by name; each object carries the hash of the config it was
+    created from as a tag, so an unchanged object costs no API call, a
+    changed one a clusters/edit or jobs/reset, and only a new name a
+    create. On a converged workspace a run is just the two list calls.
+
+    Objects that share a name are duplicates left by earlier runs: the one
+    whose hash matches (a running one first) is kept, and the rest are
+    deleted only with prune_duplicates.
+    """
+
+    def __init__(self, client, prune_duplicates=False):
+        self.client = client
+        self.prune_duplicates = prune_duplicates
+        self._clusters = None
+        self._jobs = None
+        self._lock = threading.Lock()
+
+    def _index(self, items, name_of):
+        index = {}
+        for item in items:
+            index.setdefault(name_of(item), []).append(item)
+        return index
+
+    def clusters(self):
+        """{cluster_name: [cluster, ...]}, listed on first use."""
+        with self._lock:
+            if self._clusters is None:
+                self._clusters = self._index(self.client.list_clusters(), lambda cluster: cluster.get("cluster_name"))
+            return self._clusters
+
+    def jobs(self):
+        """{job name: [job, ...]}, listed on first use."""
+        with self._lock:
+            if self._jobs is None:
+                self._jobs = self._index(self.client.list_jobs(), lambda job: job.get("settings", {}).get("name"))
+            return self._jobs
+
+    def _pick(self, candidates, wanted, config_of, tags_field):
+        """The candidate to keep, preferring a matching hash, then an active cluster; and the others."""
+        def rank(item):
+            return (_hash_tag(config_of(item), tags_field) == wanted, item.get("state") in ACTIVE_CLUSTER_STATES)
+
+        ordered = sorted(candidates, key=rank, reverse=True)
+        return ordered[0], ordered[1:]
+
+    def _prune(self, kind, name, duplicates, delete):
+        if not duplicates:
+            return
+        if not self.prune_duplicates:
+            print(f"[{kind} {name}] {len(duplicates)} duplicates left in place; prune them with --prune-duplicates.")
+            return
+        print(f"[{kind} {name}] Deleting {len(duplicates)} duplicates...")
+        for item in duplicates:
+            delete(item)
+
+    def ensure_cluster(self, config):
+        """Create, edit or keep the cluster named config["cluster_name"]; a kept or edited one is started."""
+        name = config["cluster_name"]
+        wanted = config_hash(config)
+        candidates = self.clusters().get(name, [])
+        if not candidates:
+            cluster_id = self.client.create_cluster(tag_config(config))
+            self._clusters[name] = [{**tag_config(config), "cluster_id": cluster_id, "state": "PENDING"}]
+            return ReconcileResult("cluster", name, cluster_id, CREATED)
+        cluster, duplicates = self._pick(candidates, wanted, lambda item: item, "custom_tags")
+        self._prune("cluster", name, duplicates,
+                    lambda duplicate: self.client.delete_cluster(duplicate["cluster_id"]))
+        cluster_id, state = cluster["cluster_id"], cluster.get("state")
+        action = UNCHANGED
+        if _hash_tag(cluster, "custom_tags") != wanted:
+            print(f"[cluster {name}] Config changed; editing cluster {cluster_id}...")
+            self.client.edit_cluster({**tag_config(config), "cluster_id": cluster_id})
+            action = UPDATED
+        if state in STOPPED_CLUSTER_STATES:
+            print(f"[cluster {name}] Starting cluster {cluster_id}...")
+            self.client.start_cluster(cluster_id)
+        self._clusters[name] = [{**tag_config(config), "cluster_id": cluster_id, "state": state}]
+        return ReconcileResult("cluster", name, cluster_id, action, state, len(duplicates))
+
+    def ensure_job(self, settings):
+        """Create, reset or keep the job named settings["name"]; returns a ReconcileResult with its job ID."""
+        name = settings["name"]
+        wanted = config_hash(settings, "tags")
+        candidates = self.jobs().get(name, [])
+        if not candidates:
+            job_id = self.client.create_job(tag_config(settings, "tags"))
+            self._jobs[name] = [{"job_id": job_id, "settings": tag_config(settings, "tags")}]
+            return ReconcileResult("job", name, job_id, CREATED)
+        job, duplicates = self._pick(candidates, wanted, lambda item: item.get("settings", {}), "tags")
+        self._prune("job", name, duplicates, lambda duplicate: self.client.delete_job(duplicate["job_id"]))
+        action = UNCHANGED
+        if _hash_tag(job.get("settings", {}), "tags") != wanted:
+            print(f"[job {name}] Settings changed; resetting job {job['job_id']}...")
+            self.client.reset_job(job["job_id"], tag_config(settings, "tags"))
+            action = UPDATED
+        self._jobs[name] = [{"job_id": job["job_id"], "settings": tag_config(settings, "tags")}]
+        return ReconcileResult("job", name, job["job_id"], action, duplicates=len(duplicates))
+
+    def reconcile(self, clusters=(), jobs=(), max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """Ensure every cluster config and job settings on the client's bulk pool; returns ReconcileResults."""
+        def ensure(item):
+            kind, config = item
+            return self.ensure_cluster(config) if kind == "cluster" else self.ensure_job(config)
+
+        items = [("cluster", config) for config in clusters] + [("job", settings) for settings in jobs]
+        results = []
+        for outcome in self.client.bulk(ensure, items, max_concurrency):
+            kind, config = outcome.item
+            results.append(outcome.value if outcome.succeeded else
+                           ReconcileResult(kind, config.get("cluster_name") or config.get("name"), error=outcome.error))
+        counts = {}
+        for result in results:
+            counts[result.action or "failed"] = counts.get(result.action or "failed", 0) + 1
+        print(f"Reconciled {len(results)} clusters and jobs: "
+              f"{', '.join(f'{count} {action}' for action, count in sorted(counts.items()))}.")
+        return results
@@ -0,0 +1,654 @@
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from ArmTemplates import (
+    RESOURCE_GROUP_TYPE,
+    DEPLOYMENT_TYPE,
+    NSG_TYPE,
+    VNET_TYPE,
+    SUBNET_TYPE,
+    WORKSPACE_TYPE,
+    PRIVATE_ENDPOINT_TYPE,
+    PRIVATE_DNS_ZONE_TYPE,
+    VNET_LINK_TYPE,
+    DNS_ZONE_GROUP_TYPE,
+    ROLE_ASSIGNMENT_TYPE,
+    PRIVATE_ENDPOINT_CONNECTION_TYPE,
+)
+
+MANAGED_IDENTITY_TYPE = "Microsoft.ManagedIdentity/userAssignedIdentities"
+
+# Seconds each long-running PUT takes before it succeeds; scale them all with latency_scale.
+DEFAULT_LRO_LATENCIES = {
+    NSG_TYPE: 1.0,
+    VNET_TYPE: 2.0,
+    WORKSPACE_TYPE: 6.0,
+    PRIVATE_ENDPOINT_TYPE: 3.0,
+    PRIVATE_DNS_ZONE_TYPE: 1.0,
+    VNET_LINK_TYPE: 2.0,
+    DNS_ZONE_GROUP_TYPE: 1.0,
+    PRIVATE_ENDPOINT_CONNECTION_TYPE: 1.0,
+    DEPLOYMENT_TYPE: 2.0,
+}
+DEFAULT_LRO_LATENCY = 1.0
+DEFAULT_DELETE_LATENCY = 1.0
+# Delay the fake asks for with every accepted LRO, so SDK pollers do not wait their default 30 seconds.
+# It goes out as retry-after-ms, and as a Retry-After of at least one whole second for SDKs that read only that.
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_CLUSTER_START_LATENCY = 5.0
+# VM sizes the fake offers in every location, as (family, vCPUs), and the vCPU quota of each family and the region.
+VM_SIZES = {
+    "Standard_D4ds_v5": ("standardDDSv5Family", 4),
+    "Standard_D8ds_v5": ("standardDDSv5Family", 8),
+    "Standard_DS3_v2": ("standardDSv2Family", 4),
+}
+DEFAULT_CORE_QUOTA = 100
+# Sub-resources a premium workspace offers private endpoints for.
+WORKSPACE_GROUP_IDS = ("databricks_ui_api", "browser_authentication")
+# A cluster that takes its nodes from a pool's idle instances skips VM provisioning.
+DEFAULT_POOL_START_LATENCY = 1.0
+DEFAULT_RUN_LATENCY = 10.0
+
+
+def resource_type(path):
+    """ARM resource type of a resource path, e.g. Microsoft.Network/privateDnsZones/virtualNetworkLinks."""
+    segments = path.strip("/").split("/")
+    if "providers" not in segments:
+        return RESOURCE_GROUP_TYPE if len(segments) == 4 else "Microsoft.Resources/subscriptions"
+    index = len(segments) - 1 - segments[::-1].index("providers")
+    provider = segments[index + 1:]
+    return "/".join([provider[0]] + provider[1::2])
+
+
+def _is_collection(path):
+    # Resource paths alternate type and name after the provider namespace; collections end on a type.
+    segments = path.strip("/").split("/")
+    if "providers" not in segments:
+        return False
+    index = len(segments) - 1 - segments[::-1].index("providers")
+    return len(segments[index + 1:]) % 2 == 0
+
+
+def _resource_group_id(path):
+    segments = path.strip("/").split("/")
+    return "/" + "/".join(segments[:4])
+
+
+def _subnet_nsg_id(subnet):
+    """The NSG ID a subnet (flattened or with properties) is attached to, or ""."""
+    return (subnet.get("properties", subnet).get("networkSecurityGroup") or {}).get("id", "")
+
+
+def _arm_error(status, code, message):
+    return status, {}, {"error": {"code": code, "message": message}}
+
+
+class FakeAzure:
+    """In-memory ARM and Databricks REST stand-in.
+
+    Long-running PUTs and DELETEs answer 201/202 with an
+    Azure-AsyncOperation URL and complete after the configured latency;
+    ARM deployments materialize their template resources when they
+    finish. With fault_rates (e.g. {429: 0.05, 503: 0.01}) that share of
+    requests fails with that status, throttles carrying a Retry-After.
+    stats counts requests by kind so runs can be compared.
+    """
+
+    def __init__(self, lro_latencies=None, latency_scale=1.0, delete_latency=DEFAULT_DELETE_LATENCY,
+                 poll_interval=DEFAULT_POLL_INTERVAL, cluster_start_latency=DEFAULT_CLUSTER_START_LATENCY,
+                 run_latency=DEFAULT_RUN_LATENCY, pool_start_latency=DEFAULT_POOL_START_LATENCY, fault_rates=None,
+                 seed=None):
+        self.lro_latencies = {**DEFAULT_LRO_LATENCIES, **(lro_latencies or {})}
+        self.latency_scale = latency_scale
+        self.delete_latency = delete_latency
+        self.poll_interval = poll_interval
+        self.cluster_start_latency = cluster_start_latency
+        self.run_latency = run_latency
+        self.pool_start_latency = pool_start_latency
+        self.fault_rates = dict(fault_rates or {})
+        self.stats = Counter()
+        # time.monotonic() of the first request since the last reset_stats(), for startup timings.
+        self.first_request_at = None
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._resources = {}
+        self._operations = {}
+        self._clusters = {}
+        self._pools = {}
+        self._jobs = {}
+        self._runs = {}
+        # run-now idempotency tokens and the runs they started.
+        self._run_tokens = {}
+        self._ids = itertools.count(1000)
+
+    # Configuration
+    def set_latency(self, resource_type, seconds):
+        with self._lock:
+            self.lro_latencies[resource_type] = seconds
+
+    def set_fault_rate(self, status, rate):
+        with self._lock:
+            self.fault_rates[status] = rate
+
+    def seed(self, resource_id, body=None):
+        """Store a pre-existing resource, such as a storage account the flows only read."""
+        with self._lock:
+            self._store(resource_id, dict(body or {}), "Succeeded")
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+            self.first_request_at = None
+
+    # Request handling
+    def handle(self, method, url, body):
+        """Answer one request; returns (status, headers, JSON body or None)."""
+        parts = urlsplit(url)
+        path = unquote(parts.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        with self._lock:
+            if self.first_request_at is None:
+                self.first_request_at = time.monotonic()
+            self._advance()
+            fault = self._fault()
+            if fault is not None:
+                return fault
+            if path.startswith("/api/"):
+                self.stats["databricks"] += 1
+                return self._databricks(method, path, query, body)
+            if path.startswith("/operations/"):
+                self.stats["lro_poll"] += 1
+                return self._operation(path.split("/")[-1])
+            self.stats["arm_read" if method == "GET" else "arm_write"] += 1
+            return self._arm(method, path, query, body)
+
+    def _fault(self):
+        for status, rate in self.fault_rates.items():
+            if rate and self._random.random() < rate:
+                self.stats[f"fault_{status}"] += 1
+                headers = self._retry_after() if status == 429 else {}
+                return status, headers, {"error": {"code": "InjectedFault", "message": f"Injected {status}"}}
+        return None
+
+    def _retry_after(self):
+        # SDKs parse Retry-After as whole seconds; azure-core and DatabricksClient prefer retry-after-ms when sent.
+        return {"Retry-After": str(max(1, round(self.poll_interval))),
+                "retry-after-ms": str(round(self.poll_interval * 1000))}
+
+    # Long-running operations
+    def _latency(self, resource_type):
+        return self.lro_latencies.get(resource_type, DEFAULT_LRO_LATENCY) * self.latency_scale
+
+    def _start_operation(self, latency, on_complete):
+        operation_id = uuid.uuid4().hex
+        self._operations[operation_id] = {"due": time.monotonic() + latency, "status": "InProgress",
+                                          "on_complete": on_complete}
+        return operation_id
+
+    def _advance(self):
+        now = time.monotonic()
+        for operation in self._operations.values():
+            if operation["status"] == "InProgress" and operation["due"] <= now:
+                try:
+                    operation["on_complete"]()
+                    operation["status"] = "Succeeded"
+                except Exception as e:
+                    operation["status"] = "Failed"
+                    operation["error"] = str(e)
+
+    def _operation(self, operation_id):
+        operation = self._operations.get(operation_id)
+        if operation is None:
+            return _arm_error(404, "OperationNotFound", operation_id)
+        body = {"status": operation["status"]}
+        if operation["status"] == "Failed":
+            body["error"] = {"code": "DeploymentFailed", "message": operation["error"]}
+        headers = self._retry_after() if operation["status"] == "InProgress" else {}
+        return 200, headers, body
+
+    def _accepted(self, status, body, operation_id):
+        headers = {"Azure-AsyncOperation": f"{self.base_url}/operations/{operation_id}", **self._retry_after()}
+        return status, headers, body
+
+    # ARM
+    def _store(self, resource_id, body, state):
+        segments = resource_id.strip("/").split("/")
+        resource = {**body, "id": resource_id, "name": segments[-1], "type": resource_type(resource_id)}
+        properties = resource.setdefault("properties", {})
+        properties["provisioningState"] = state
+        self._resources[resource_id.lower()] = resource
+        return resource
+
+    def _get(self, resource_id):
+        return self._resources.get(resource_id.lower())
+
+    def _arm(self, method, path, query, body):
+        kind = resource_type(path)
+        if kind == "Microsoft.Authorization/roleDefinitions" and method == "GET":
+            return self._role_definitions(path, query)
+        if method == "GET" and kind in self._READ_ONLY:
+            return self._READ_ONLY[kind](self, path)
+        if method == "GET" and _is_collection(path):
+            return 200, {}, {"value": self._list(path, kind)}
+        if method == "GET" and kind == NSG_TYPE:
+            return self._nsg(path)
+        if method == "GET":
+            resource = self._get(path)
+            if resource is None:
+                return _arm_error(404, "ResourceNotFound", f"The resource '{path}' was not found.")
+            return 200, {}, resource
+        if method == "PUT":
+            if kind == RESOURCE_GROUP_TYPE:
+                existed = self._get(path) is not None
+                return (200 if existed else 201), {}, self._store(path, body or {}, "Succeeded")
+            if kind == ROLE_ASSIGNMENT_TYPE:
+                return 201, {}, self._store(path, body or {}, "Succeeded")
+            return self._put(path, kind, body or {})
+        if method == "DELETE":
+            return self._delete(path, kind)
+        return _arm_error(405, "MethodNotAllowed", f"{method} {path}")
+
+    def _put(self, path, kind, body):
+        existing = self._get(path)
+        resource = self._store(path, body, "Updating" if existing else "Creating")
+        if kind == VNET_TYPE:
+            for subnet in resource["properties"].get("subnets", []):
+                subnet["id"] = f"{path}/subnets/{subnet['name']}"
+        if kind == WORKSPACE_TYPE:
+            self._assign_workspace_url(resource, existing)
+        if kind == PRIVATE_ENDPOINT_TYPE:
+            self._connect_private_endpoint(path, resource)
+
+        def complete():
+            resource["properties"]["provisioningState"] = "Succeeded"
+            if kind == WORKSPACE_TYPE:
+                self._create_managed_identity(resource)
+            if kind == PRIVATE_ENDPOINT_CONNECTION_TYPE:
+                self._update_private_endpoint_state(resource)
+            if kind == DEPLOYMENT_TYPE:
+                self._deploy(path, resource)
+
+        operation_id = self._start_operation(self._latency(kind), complete)
+        return self._accepted(200 if existing else 201, resource, operation_id)
+
+    def _delete(self, path, kind):
+        if kind == SUBNET_TYPE:
+            return self._delete_subnet(path)
+        if self._get(path) is None:
+            return 204, {}, None
+
+        def complete():
+            prefix = path.lower()
+            for key in [key for key in self._resources if key == prefix or key.startswith(prefix + "/")]:
+                del self._resources[key]
+
+        operation_id = self._start_operation(self.delete_latency * self.latency_scale, complete)
+        return self._accepted(202, None, operation_id)
+
+    def _delete_subnet(self, path):
+        # Subnets live inside their VNet's body rather than as resources of their own.
+        vnet = self._get(path.rsplit("/subnets/", 1)[0])
+        if vnet is None or not any(subnet["id"].lower() == path.lower() for subnet in vnet["properties"]["subnets"]):
+            return 204, {}, None
+
+        def complete():
+            vnet["properties"]["subnets"] = [subnet for subnet in vnet["properties"]["subnets"]
+                                             if subnet["id"].lower() != path.lower()]
+
+        operation_id = self._start_operation(self.delete_latency * self.latency_scale, complete)
+        return self._accepted(202, None, operation_id)
+
+    def _nsg(self, path):
+        nsg = self._get(path)
+        if nsg is None:
+            return _arm_error(404, "ResourceNotFound", f"The resource '{path}' was not found.")
+        # ARM lists the subnets an NSG is attached to on the NSG.
+        nsg["properties"]["subnets"] = [
+            {"id": subnet["id"]} for resource in self._resources.values() if resource["type"] == VNET_TYPE
+            for subnet in resource["properties"].get("subnets", [])
+            if _subnet_nsg_id(subnet).lower() == path.lower()
+        ]
+        return 200, {}, nsg
+
+    def _list(self, path, kind):
+        collection = path.rstrip("/").lower()
+        if collection.count("/providers/") == 1 and len(kind.split("/")) == 2:
+            # A top-level type lists everything of that type in the subscription or resource group.
+            scope = collection.split("/providers/")[0] + "/"
+            return [resource for key, resource in self._resources.items()
+                    if resource["type"] == kind and key.startswith(scope)]
+        return [resource for key, resource in self._resources.items()
+                if resource["type"] == kind and key.rsplit("/", 1)[0] == collection]
+
+    def _assign_workspace_url(self, workspace, existing):
+        if existing is not None and "workspaceUrl" in existing["properties"]:
+            workspace["properties"]["workspaceId"] = existing["properties"]["workspaceId"]
+            workspace["properties"]["workspaceUrl"] = existing["properties"]["workspaceUrl"]
+            return
+        workspace_id = str(next(self._ids))
+        workspace["properties"]["workspaceId"] = workspace_id
+        workspace["properties"]["workspaceUrl"] = f"adb-{workspace_id}.{workspace_id[-2:]}.azuredatabricks.net"
+
+    def _create_managed_identity(self, workspace):
+        managed_group = workspace["properties"].get("managedResourceGroupId")
+        if not managed_group:
+            return
+        self._store(managed_group, {"location": workspace.get("location")}, "Succeeded")
+        self._store(f"{managed_group}/providers/{MANAGED_IDENTITY_TYPE}/dbmanagedidentity",
+                    {"properties": {"clientId": str(uuid.uuid4()), "principalId": str(uuid.uuid4())}}, "Succeeded")
+
+    def _connect_private_endpoint(self, path, endpoint):
+        # Automatic connections are approved at once; manual ones wait, Pending, on the target's side.
+        connection_name = f"{endpoint['name']}.{uuid.uuid5(uuid.NAMESPACE_URL, path.lower())}"
+        for key, status in (("privateLinkServiceConnections", "Approved"),
+                            ("manualPrivateLinkServiceConnections", "Pending")):
+            for connection in endpoint["properties"].get(key) or []:
+                target = connection.setdefault("properties", {}).get("privateLinkServiceId", "")
+                provider_id = f"{target}/privateEndpointConnections/{connection_name}"
+                provider_side = self._get(provider_id)
+                if provider_side is not None:
+                    state = dict(provider_side["properties"]["privateLinkServiceConnectionState"])
+                else:
+                    state = {"status": status, "description": connection["properties"].get("requestMessage", "")}
+                    if self._get(target) is not None:
+                        self._store(provider_id, {"properties": {"privateEndpoint": {"id": path},
+                                                                 "privateLinkServiceConnectionState": dict(state)}},
+                                    "Succeeded")
+                connection["properties"]["privateLinkServiceConnectionState"] = state
+
+    def _update_private_endpoint_state(self, provider_side):
+        endpoint = self._get(provider_side["properties"].get("privateEndpoint", {}).get("id", ""))
+        if endpoint is None:
+            return
+        state = provider_side["properties"]["privateLinkServiceConnectionState"]
+        for key in ("privateLinkServiceConnections", "manualPrivateLinkServiceConnections"):
+            for connection in endpoint["properties"].get(key) or []:
+                connection.setdefault("properties", {})["privateLinkServiceConnectionState"] = dict(state)
+
+    def _role_definitions(self, path, query):
+        match = re.search(r"roleName eq '([^']+)'", query.get("$filter", ""))
+        if match is None:
+            return 200, {}, {"value": []}
+        role_name = match.group(1)
+        name = str(uuid.uuid5(uuid.NAMESPACE_URL, role_name))
+        return 200, {}, {"value": [{
+            "id": f"{path}/{name}",
+            "name": name,
+            "type": "Microsoft.Authorization/roleDefinitions",
+            "properties": {"roleName": role_name, "type": "BuiltInRole"},
+        }]}
+
+    # Read-only endpoints the pre-flight checks call
+    def _permissions(self, path):
+        # The caller is an owner of every scope, so the permission check always passes.
+        return 200, {}, {"value": [{"actions": ["*"], "notActions": []}]}
+
+    def _private_link_resources(self, path):
+        workspace_id = path.rsplit("/", 1)[0]
+        if self._get(workspace_id) is None:
+            return _arm_error(404, "ResourceNotFound", f"The resource '{workspace_id}' was not found.")
+        return 200, {}, {"value": [{"id": f"{workspace_id}/privateLinkResources/{group_id}", "name": group_id,
+                                    "properties": {"groupId": group_id, "requiredMembers": [group_id]}}
+                                   for group_id in WORKSPACE_GROUP_IDS]}
+
+    def _vm_skus(self, path):
+        return 200, {}, {"value": [{"resourceType": "virtualMachines", "name": name, "family": family,
+                                    "capabilities": [{"name": "vCPUs", "value": str(vcpus)}], "restrictions": []}
+                                   for name, (family, vcpus) in VM_SIZES.items()]}
+
+    def _usages(self, path):
+        families = sorted({family for family, _ in VM_SIZES.values()})
+        return 200, {}, {"value": [{"name": {"value": name, "localizedValue": name}, "currentValue": 0,
+                                    "limit": DEFAULT_CORE_QUOTA, "unit": "Count"}
+                                   for name in ["cores"] + families]}
+
+    _READ_ONLY = {
+        "Microsoft.Authorization/permissions": _permissions,
+        "Microsoft.Databricks/workspaces/privateLinkResources": _private_link_resources,
+        "Microsoft.Compute/skus": _vm_skus,
+        "Microsoft.Compute/locations/usages": _usages,
+    }
+
+    # Deployments
+    def _template_resource_id(self, group_id, template_resource):
+        kind, name = template_resource["type"], template_resource["name"]
+        if name.startswith("["):
+            name = str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+        types = kind.split("/")
+        names = name.split("/")
+        path = f"{group_id}/providers/{types[0]}"
+        for type_segment, name_segment in zip(types[1:], names):
+            path += f"/{type_segment}/{name_segment}"
+        return path
+
+    def _evaluate(self, group_id, expression):
+        match = re.fullmatch(r"\[(reference\()?resourceId\('([^']+)', (.+?)\)\)?(?:\.(\w+))?\]", expression)
+        if match is None:
+            return expression
+        names = re.findall(r"'([^']+)'", match.group(3))
+        resource_id = self._template_resource_id(group_id, {"type": match.group(2), "name": "/".join(names)})
+        if match.group(1):
+            return self._get(resource_id)["properties"].get(match.group(4))
+        return resource_id
+
+    def _deploy(self, path, deployment):
+        group_id = _resource_group_id(path)
+        template = deployment["properties"].get("template", {})
+        for template_resource in template.get("resources", []):
+            if template_resource["type"] == DEPLOYMENT_TYPE:
+                # A nested deployment, possibly into another resource group of the subscription.
+                nested_group = group_id.rsplit("/", 1)[0] + "/" + template_resource.get("resourceGroup",
+                                                                                         group_id.split("/")[-1])
+                self._deploy(f"{nested_group}/providers/{DEPLOYMENT_TYPE}/{template_resource['name']}",
+                             {"properties": dict(template_resource["properties"])})
+                continue
+            body = {key: value for key, value in template_resource.items()
+                    if key not in ("type", "apiVersion", "name", "dependsOn", "scope")}
+            resource_id = self._template_resource_id(group_id, template_resource)
+            resource = self._store(resource_id, body, "Succeeded")
+            if template_resource["type"] == WORKSPACE_TYPE:
+                self._assign_workspace_url(resource, None)
+                self._create_managed_identity(resource)
+        deployment["properties"]["outputs"] = {
+            name: {"type": output["type"], "value": self._evaluate(group_id, output["value"])}
+            for name, output in template.get("outputs", {}).items()
+        }
+
+    # Databricks REST
+    def _databricks(self, method, path, query, body):
+        now = time.monotonic()
+        body = body or {}
+        if method == "POST" and path == "/api/2.0/clusters/create":
+            cluster_id = f"{next(self._ids):04d}-000000-fake"
+            latency = self.cluster_start_latency
+            pool = self._pools.get(body.get("instance_pool_id"))
+            if pool is not None and self._pool_idle(pool, now) > 0:
+                pool["in_use"] += 1
+                latency = self.pool_start_latency
+            self._clusters[cluster_id] = {"created": now, "spec": body, "start_latency": latency}
+            return 200, {}, {"cluster_id": cluster_id}
+        if method == "GET" and path == "/api/2.0/clusters/get":
+            if query.get("cluster_id") not in self._clusters:
+                return 400, {}, {"error_code": "INVALID_PARAMETER_VALUE", "message": "Cluster does not exist"}
+            return 200, {}, self._cluster(query["cluster_id"], now)
+        if method == "GET" and path == "/api/2.0/clusters/list":
+            return 200, {}, self._page("clusters", [self._cluster(cluster_id, now) for cluster_id in self._clusters],
+                                       query, "page_size")
+        if method == "POST" and path in ("/api/2.0/clusters/edit", "/api/2.0/clusters/start",
+                                         "/api/2.0/clusters/permanent-delete"):
+            cluster = self._clusters.get(body.get("cluster_id"))
+            if cluster is None:
+                return 400, {}, {"error_code": "INVALID_PARAMETER_VALUE", "message": "Cluster does not exist"}
+            if path.endswith("/permanent-delete"):
+                del self._clusters[body["cluster_id"]]
+            elif path.endswith("/edit"):
+                cluster["spec"] = {key: value for key, value in body.items() if key != "cluster_id"}
+            return 200, {}, {}
+        if method == "POST" and path == "/api/2.0/instance-pools/create":
+            pool_id = f"{next(self._ids):04d}-000000-pool"
+            self._pools[pool_id] = {"created": now, "spec": body, "in_use": 0}
+            return 200, {}, {"instance_pool_id": pool_id}
+        if method == "POST" and path == "/api/2.0/instance-pools/edit":
+            pool = self._pools.get(body.get("instance_pool_id"))
+            if pool is None:
+                return 400, {}, {"error_code": "RESOURCE_DOES_NOT_EXIST", "message": "Instance pool does not exist"}
+            pool["spec"] = {key: value for key, value in body.items() if key != "instance_pool_id"}
+            return 200, {}, {}
+        if method == "GET" and path == "/api/2.0/instance-pools/get":
+            if query.get("instance_pool_id") not in self._pools:
+                return 400, {}, {"error_code": "RESOURCE_DOES_NOT_EXIST", "message": "Instance pool does not exist"}
+            return 200, {}, self._pool(query["instance_pool_id"], now)
+        if method == "GET" and path == "/api/2.0/instance-pools/list":
+            return 200, {}, {"instance_pools": [self._pool(pool_id, now) for pool_id in self._pools]}
+        if method == "POST" and path == "/api/2.1/jobs/create":
+            job_id = next(self._ids)
+            self._jobs[job_id] = body
+            return 200, {}, {"job_id": job_id}
+        if method == "GET" and path == "/api/2.1/jobs/list":
+            jobs = [{"job_id": job_id, "settings": {key: value for key, value in settings.items()
+                                                    if key not in ("tasks", "job_clusters")}}
+                    for job_id, settings in self._jobs.items()]
+            return 200, {}, self._page("jobs", jobs, query, "limit")
+        if method == "POST" and path in ("/api/2.1/jobs/reset", "/api/2.1/jobs/delete"):
+            if body.get("job_id") not in self._jobs:
+                return 400, {}, {"error_code": "INVALID_PARAMETER_VALUE", "message": "Job does not exist"}
+            if path.endswith("/delete"):
+                del self._jobs[body["job_id"]]
+            else:
+                self._jobs[body["job_id"]] = body["new_settings"]
+            return 200, {}, {}
+        if method == "POST" and path == "/api/2.1/jobs/run-now":
+            if body.get("job_id") not in self._jobs:
+                return 400, {}, {"error_code": "INVALID_PARAMETER_VALUE", "message": "Job does not exist"}
+            token = body.get("idempotency_token")
+            if token in self._run_tokens:
+                return 200, {}, {"run_id": self._run_tokens[token]}
+            run_id = next(self._ids)
+            self._runs[run_id] = {"job_id": body["job_id"], "created": now}
+            if token is not None:
+                self._run_tokens[token] = run_id
+            return 200, {}, {"run_id": run_id}
+        if method == "GET" and path == "/api/2.1/jobs/runs/get":
+            run_id = int(query.get("run_id", 0))
+            if run_id not in self._runs:
+                return 400, {}, {"error_code": "INVALID_PARAMETER_VALUE", "message": "Run does not exist"}
+            return 200, {}, self._run(run_id, now)
+        if method == "GET" and path == "/api/2.1/jobs/runs/list":
+            job_id = int(query["job_id"]) if "job_id" in query else None
+            run_ids = sorted((run_id for run_id, run in self._runs.items()
+                              if job_id is None or run["job_id"] == job_id), reverse=True)
+            offset, limit = int(query.get("offset", 0)), int(query.get("limit", 25))
+            page = run_ids[offset:offset + limit]
+            return 200, {}, {"runs": [self._run(run_id, now) for run_id in page],
+                             "has_more": offset + limit < len(run_ids)}
+        return 404, {}, {"error_code": "ENDPOINT_NOT_FOUND", "message": f"No API found for '{method} {path}'"}
+
+    def _page(self, key, items, query, size_param):
+        """One page of a list call, with next_page_token (an offset) while more items remain."""
+        offset, size = int(query.get("page_token", 0)), int(query.get(size_param, 100))
+        page = {key: items[offset:offset + size], "has_more": offset + size < len(items)}
+        if page["has_more"]:
+            page["next_page_token"] = str(offset + size)
+        return page
+
+    def _cluster(self, cluster_id, now):
+        cluster = self._clusters[cluster_id]
+        started = now - cluster["created"] >= cluster["start_latency"] * self.latency_scale
+        return {**cluster["spec"], "cluster_id": cluster_id, "state": "RUNNING" if started else "PENDING"}
+
+    def _pool_idle(self, pool, now):
+        """Idle instances: the pool's min idle count once its VMs are up, less those clusters took."""
+        if now - pool["created"] < self.cluster_start_latency * self.latency_scale:
+            return 0
+        return max(pool["spec"].get("min_idle_instances", 0) - pool["in_use"], 0)
+
+    def _pool(self, pool_id, now):
+        pool = self._pools[pool_id]
+        return {**pool["spec"], "instance_pool_id": pool_id, "state": "ACTIVE",
+                "stats": {"idle_count": self._pool_idle(pool, now), "used_count": pool["in_use"]}}
+
+    def _run(self, run_id, now):
+        run = self._runs[run_id]
+        elapsed = (now - run["created"]) / (self.run_latency * self.latency_scale or 1)
+        if elapsed >= 1:
+            state = {"life_cycle_state": "TERMINATED", "result_state": "SUCCESS", "state_message": ""}
+        else:
+            state = {"life_cycle_state": "PENDING" if elapsed < 0.1 else "RUNNING", "state_message": ""}
+        return {"run_id": run_id, "job_id": run["job_id"], "state": state}
+
+    # Serving
+    def serve(self, host="127.0.0.1", port=0):
+        """Start serving on a background thread; returns the base URL."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                status, headers, body = fake.handle(self.command, self.path, json.loads(raw) if raw else None)
+                payload = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("x-ms-request-id", str(uuid.uuid4()))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_PUT = do_POST = do_DELETE = do_PATCH = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.serve()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local ARM and Databricks REST stand-in.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every LRO latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args(argv)
+
+    fake = FakeAzure(latency_scale=args.latency_scale, fault_rates={429: args.throttle_rate, 503: args.error_rate})
+    base_url = fake.serve(port=args.port)
+    print(f"Serving ARM and Databricks APIs on {base_url}")
+    print(f"  export AZURE_ARM_ENDPOINT={base_url} AZURE_CREDENTIAL_TYPE=static AZURE_ACCESS_TOKEN=fake "
+          f"DATABRICKS_WORKSPACE_URL={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import sys
+import time
+from dataclasses import fields
+
+from AsyncProvisioning import (
+    AsyncAzureClients,
+    check_workspaces,
+    provision_workspaces,
+    plan_workspaces,
+    teardown_workspaces,
+)
+from ConfigFiles import load_document
+from Preflight import PreflightFailed
+from ProvisioningJournal import ProvisioningJournal, DEFAULT_JOURNAL_PATH
+from ProvisioningSpecs import WorkspaceStack
+from ProvisioningTrace import start_tracing, finish_tracing
+
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_PER_SUBSCRIPTION_LIMIT = 8
+# Azure Resource Manager allows 1200 writes per hour per subscription.
+DEFAULT_WRITES_PER_HOUR = 1200
+
+
+def load_manifest(path):
+    """Load WorkspaceStacks from a YAML or JSON manifest.
+
+    The manifest holds a "defaults" mapping applied to every entry in
+    "stacks"; each entry may override any WorkspaceStack field.
+    """
+    manifest = load_document(path)
+    defaults = manifest.get("defaults", {})
+    known_fields = {f.name for f in fields(WorkspaceStack)}
+    stacks = []
+    seen = set()
+    for index, entry in enumerate(manifest.get("stacks", [])):
+        values = {**defaults, **entry}
+        unknown = set(values) - known_fields
+        if unknown:
+            raise ValueError(f"Stack #{index} has unknown fields: {', '.join(sorted(unknown))}")
+        try:
+            stack = WorkspaceStack(**values)
+        except TypeError as e:
+            raise ValueError(f"Stack #{index} is incomplete: {e}")
+        key = (stack.subscription_id, stack.resource_group, stack.workspace_name)
+        if key in seen:
+            raise ValueError(f"Stack #{index} duplicates workspace {stack.workspace_name} in {stack.resource_group}")
+        seen.add(key)
+        stacks.append(stack)
+    return stacks
+
+
+def failed_step(result):
+    if isinstance(result.error, PreflightFailed):
+        return "preflight"
+    if result.report is None:
+        return ""
+    return ", ".join(t.name for t in result.report.timings.values() if t.status == "failed")
+
+
+def print_fleet_results(stacks, results, elapsed):
+    """Print one row per stack, then the fleet throughput."""
+    print(f"\n{'Workspace':<28}{'Subscription':<38}{'Resource Group':<28}{'Status':<11}{'Time':>9}  Failed step / error")
+    for stack, result in zip(stacks, results):
+        wall_time = f"{result.report.wall_time:.0f}s" if result.report is not None else "-"
+        status = "succeeded" if result.succeeded else "failed"
+        detail = "" if result.succeeded else f"{failed_step(result)}: {result.error}"
+        print(f"{stack.workspace_name:<28}{stack.subscription_id:<38}{stack.resource_group:<28}{status:<11}{wall_time:>9}  {detail}")
+
+    completed = sum(1 for result in results if result.succeeded)
+    per_hour = completed / elapsed * 3600 if elapsed > 0 else 0.0
+    print(f"\nStacks completed: {completed}/{len(results)} in {elapsed:.0f}s "
+          f"-> {per_hour:.1f} stacks/hour")
+
+
+async def run_fleet(stacks, max_concurrency=DEFAULT_MAX_CONCURRENCY, per_subscription_limit=DEFAULT_PER_SUBSCRIPTION_LIMIT,
+                    writes_per_hour=DEFAULT_WRITES_PER_HOUR, rollback_on_failure=False, single_deployment=False,
+                    journal=None, resume=False, polls_per_second=None, preflight=True):
+    """Provision every stack on one event loop and return (results, elapsed seconds)."""
+    start = time.monotonic()
+    async with AsyncAzureClients(max_connections=max_concurrency * 4, writes_per_hour=writes_per_hour,
+                                 max_polls_per_second=polls_per_second) as clients:
+        results = await provision_workspaces(stacks, max_concurrency, rollback_on_failure, clients, per_subscription_limit,
+                                             single_deployment=single_deployment, journal=journal, resume=resume,
+                                             preflight=preflight)
+    return results, time.monotonic() - start
+
+
+async def teardown_fleet(stacks, max_concurrency=DEFAULT_MAX_CONCURRENCY, per_subscription_limit=DEFAULT_PER_SUBSCRIPTION_LIMIT,
+                         writes_per_hour=DEFAULT_WRITES_PER_HOUR, keep_resource_group=False, no_wait=False,
+                         polls_per_second=None, journal=None):
+    """Delete every stack on one event loop and return (results, elapsed seconds).
+
+    Private DNS zones are only deleted when the journal records them being created.
+    """
+    start = time.monotonic()
+    async with AsyncAzureClients(max_connections=max_concurrency * 4, writes_per_hour=writes_per_hour,
+                                 max_polls_per_second=polls_per_second) as clients:
+        results = await teardown_workspaces(stacks, max_concurrency, clients, per_subscription_limit,
+                                            keep_resource_group, no_wait, journal)
+    return results, time.monotonic() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provision many Databricks workspace stacks from a manifest.")
+    parser.add_argument("manifest", help="YAML or JSON manifest of workspace stacks")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="stacks provisioned at the same time across all subscriptions")
+    parser.add_argument("--per-subscription", type=int, default=DEFAULT_PER_SUBSCRIPTION_LIMIT,
+                        help="stacks provisioned at the same time in one subscription")
+    parser.add_argument("--writes-per-hour", type=int, default=DEFAULT_WRITES_PER_HOUR,
+                        help="ARM write budget per subscription")
+    parser.add_argument("--polls-per-second", type=float,
+                        help="cap on LRO status polls across all stacks, to spare the ARM read quota")
+    parser.add_argument("--rollback", action="store_true", help="delete the resources failed stacks created in this run")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH, help="checkpoint journal of completed steps")
+    parser.add_argument("--resume", action="store_true", help="skip steps the journal records as completed")
+    parser.add_argument("--plan", action="store_true", help="print the changes needed for each stack without applying them")
+    parser.add_argument("--preflight", action="store_true",
+                        help="run the pre-flight checks on every stack, print the problems found and exit")
+    parser.add_argument("--skip-preflight", action="store_true",
+                        help="provision without running the pre-flight checks")
+    parser.add_argument("--single-deployment", action="store_true", help="deploy each stack as one ARM template")
+    parser.add_argument("--teardown", action="store_true", help="delete the stacks instead of provisioning them")
+    parser.add_argument("--keep-resource-group", action="store_true",
+                        help="with --teardown, delete each stack's resources but keep its resource group")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="with --teardown, exit once the final deletes are accepted")
+    args = parser.parse_args(argv)
+
+    stacks = load_manifest(args.manifest)
+    start_tracing("FleetProvisioning")
+    if args.teardown:
+        print(f"Tearing down {len(stacks)} stacks from {args.manifest}...")
+        results, elapsed = asyncio.run(teardown_fleet(stacks, args.max_concurrency, args.per_subscription,
+                                                      args.writes_per_hour, args.keep_resource_group, args.no_wait,
+                                                      args.polls_per_second, ProvisioningJournal(args.journal)))
+        print_fleet_results(stacks, results, elapsed)
+        return finish_tracing(0 if all(result.succeeded for result in results) else 1)
+
+    if args.plan:
+        for plan in asyncio.run(plan_workspaces(stacks, args.max_concurrency)):
+            plan.print_plan()
+        return finish_tracing(0)
+
+    if args.preflight:
+        reports = asyncio.run(check_workspaces(stacks, args.max_concurrency))
+        for report in reports:
+            report.print_report()
+        print(f"\n{sum(1 for report in reports if report.passed)}/{len(reports)} stacks passed pre-flight.")
+        return finish_tracing(0 if all(report.passed for report in reports) else 1)
+
+    print(f"Provisioning {len(stacks)} stacks from {args.manifest}...")
+    results, elapsed = asyncio.run(run_fleet(stacks, args.max_concurrency, args.per_subscription,
+                                             args.writes_per_hour, args.rollback, args.single_deployment,
+                                             ProvisioningJournal(args.journal), args.resume, args.polls_per_second,
+                                             not args.skip_preflight))
+    print_fleet_results(stacks, results, elapsed)
+    return finish_tracing(0 if all(result.succeeded for result in results) else 1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
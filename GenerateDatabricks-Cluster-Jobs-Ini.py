@@ -1,99 +1,59 @@
-import requests
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.databricks import AzureDatabricksManagementClient
-from azure.mgmt.resource import ResourceManagementClient
+import argparse
+import asyncio
+
+from ClusterPools import FirstTaskTimer, InstancePoolSpec, attach_to_pool, ensure_instance_pool
+from DatabricksClient import DEFAULT_BULK_CONCURRENCY, DatabricksClient, DatabricksApiError
+from DatabricksReconciler import ACTIVE_CLUSTER_STATES, CREATED, UNCHANGED, DatabricksReconciler
+from JobSpecs import (
+    QUEUE_RUNS,
+    SHARED_CLUSTER_KEY,
+    JarTask,
+    JobGraph,
+    load_job_graph,
+    load_parameter_sets,
+    parameter_defaults,
+)
+from ProvisioningTrace import start_tracing, finish_tracing
+from RunWatcher import wait_for_cluster, watch_runs
+from TokenBroker import TokenBroker
+from WorkspaceMetadata import WorkspaceMetadataCache, resolve_workspace_url
 
 # Constants
 SUBSCRIPTION_ID = "<>"
 RESOURCE_GROUP = "adqueryvnettestrg"
 LOCATION = "uksouth"
 WORKSPACE_NAME = "adbworkspacedev01"
-DATABRICKS_WORKSPACE_URL = "https://adb-<>.<>.azuredatabricks.net"
 JAR_STORAGE_ACCOUNT = "adlsstoragedev01"
 TENANT_ID = "<>"
+NODE_TYPE_ID = "Standard_D4ds_v5"
+SPARK_VERSION = "16.1.x-scala2.12"
+JAR_PATH = "abfss://jarcontainer@adlsstoragedev01.dfs.core.windows.net/jardir/default_artifact.jar"
+MAIN_CLASS_NAME = "org.proj.deltamain"
 
-# Azure Clients
-credential = DefaultAzureCredential()
-resource_client = ResourceManagementClient(credential, SUBSCRIPTION_ID)
-databricks_client = AzureDatabricksManagementClient(credential, SUBSCRIPTION_ID)
-
-# Obtain an Azure AD Token for Databricks
-def get_databricks_aad_token():
-    aad_token = credential.get_token("2ff814a6-3304-4ab8-85cb-cd0e6f879c1d").token
-    return aad_token
-
-
-def get_databricks_managed_identity_client_id():
-    """Retrieve the Managed Identity Client ID for the Databricks Workspace."""
-    print("Retrieving Databricks Managed Identity Client ID...")
-    
-    # Fetch the Databricks Workspace details
-    workspace = databricks_client.workspaces.get(RESOURCE_GROUP, WORKSPACE_NAME)
-    
-    # Construct the Managed Resource Group name
-    managed_resource_group = workspace.managed_resource_group_id.split("/")[-1]
-    print("Printing", managed_resource_group)
-    
-    # Construct the Managed Identity Resource ID
-    managed_identity_resource_id = (
-        f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{managed_resource_group}/providers/Microsoft.ManagedIdentity/userAssignedIdentities/dbmanagedidentity"
-    )
-    
-    # Fetch the Managed Identity details
-    managed_identity = resource_client.resources.get_by_id(
-        managed_identity_resource_id, 
-        api_version="2023-01-31"
-    )
-
-    # Extract and return the client ID
-    try:
-        return managed_identity.properties["clientId"]
-    except Exception as e:
-        raise ValueError("Failed to retrieve the Managed Identity Client ID.")
-
-MSI_CLIENT_ID = get_databricks_managed_identity_client_id()
+# Azure Credential
+# Tokens are cached (and refreshed ahead of expiry) by the broker; set AZURE_CREDENTIAL_TYPE to skip chain probing.
+credential = TokenBroker()
 
-# Create Cluster
-def create_cluster(databricks_token):
-    print("Creating Databricks cluster...")
-    cluster_config = {
+# Cluster and Job Definitions
+def cluster_config(msi_client_id):
+    return {
         "cluster_name": "StandardCluster",
-        "spark_version": "16.1.x-scala2.12",  # Replace with desired Databricks Runtime version
-        "node_type_id": "Standard_D4ds_v5",
+        "spark_version": SPARK_VERSION,  # Replace with desired Databricks Runtime version
+        "node_type_id": NODE_TYPE_ID,
         "num_workers": 2,
         "autotermination_minutes": 30,  # Auto-terminate after 30 minutes of inactivity
         "spark_conf": {
-        "spark.hadoop.fs.azure.account.oauth2.client.id": MSI_CLIENT_ID,
-        f"spark.hadoop.fs.azure.account.oauth.provider.type.{JAR_STORAGE_ACCOUNT}.dfs.core.windows.net": "org.apache.hadoop.fs.azurebfs.oauth2.MsiTokenProvider",
-        "spark.hadoop.fs.azure.account.oauth2.msi.tenant": TENANT_ID,
-        f"spark.hadoop.fs.azure.account.auth.type.{JAR_STORAGE_ACCOUNT}.dfs.core.windows.net": "OAuth"
-    }
+            "spark.hadoop.fs.azure.account.oauth2.client.id": msi_client_id,
+            f"spark.hadoop.fs.azure.account.oauth.provider.type.{JAR_STORAGE_ACCOUNT}.dfs.core.windows.net": "org.apache.hadoop.fs.azurebfs.oauth2.MsiTokenProvider",
+            "spark.hadoop.fs.azure.account.oauth2.msi.tenant": TENANT_ID,
+            f"spark.hadoop.fs.azure.account.auth.type.{JAR_STORAGE_ACCOUNT}.dfs.core.windows.net": "OAuth"
+        }
     }
-    headers = {
-        "Authorization": f"Bearer {databricks_token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.post(f"{DATABRICKS_WORKSPACE_URL}/api/2.0/clusters/create", headers=headers, json=cluster_config)
-    if response.status_code == 200:
-        print("Cluster created successfully!")
-        cluster_id = response.json().get("cluster_id")
-        print(f"Cluster ID: {cluster_id}")
-        return cluster_id
-    else:
-        print("Failed to create cluster.")
-        print(f"Status Code: {response.status_code}")
-        print(f"Response: {response.text}")
-        return
 
-#createJob
-def create_job(databricks_token, cluster_id):
-    """
-    Create a Databricks job mapped to an existing cluster.
-    """
-    print("Creating Databricks job...")
-    
-    # Job Configuration
-    job_config = {
+
+def job_config(cluster_id, parameters=None, max_concurrent_runs=1):
+    """The job on the existing cluster; runs past max_concurrent_runs queue, as they do on a JobGraph job."""
+    config = {
         "name": "SparkJarJob",
         "tasks": [
             {
@@ -101,73 +61,182 @@ def create_job(databricks_token, cluster_id):
                 "description": "A Spark JAR task running on an existing cluster",
                 "existing_cluster_id": cluster_id,  # Use existing cluster
                 "spark_jar_task": {
-                    "main_class_name": "org.proj.deltamain"  # Main class to execute
+                    "main_class_name": MAIN_CLASS_NAME  # Main class to execute
                 },
                 "libraries": [
                     {
-                        "jar": "abfss://jarcontainer@adlsstoragedev01.dfs.core.windows.net/jardir/default_artifact.jar"
+                        "jar": JAR_PATH
                     }
                 ]
             }
-        ]
+        ],
+        "max_concurrent_runs": max_concurrent_runs,
+        "queue": {"enabled": QUEUE_RUNS},
     }
-    # API Headers
-    headers = {
-        "Authorization": f"Bearer {databricks_token}",
-        "Content-Type": "application/json"
-    }
-    
-    # API Call to Create Job
-    response = requests.post(f"{DATABRICKS_WORKSPACE_URL}/api/2.1/jobs/create", headers=headers, json=job_config)
-    # Handle Response
-    if response.status_code == 200:
-        print("Job created successfully!")
-        job_id = response.json().get("job_id")
-        print(f"Job ID: {job_id}")
-        return job_id
+    if parameters:
+        config["parameters"] = [{"name": name, "default": str(default)} for name, default in parameters.items()]
+    return config
+
+
+def job_graph(new_cluster, tasks_path=None, max_concurrent_runs=1, parameters=None):
+    """A multi-task job from the task file, or the single JAR task, on one shared job cluster.
+
+    parameters are added to the job's own, whose defaults win.
+    """
+    if tasks_path:
+        graph = load_job_graph(tasks_path, "SparkJarJob", new_cluster)
     else:
+        graph = JobGraph("SparkJarJob", {SHARED_CLUSTER_KEY: new_cluster}, jars=[JAR_PATH])
+        graph.add(JarTask("Task", MAIN_CLASS_NAME))
+    graph.parameters = {**(parameters or {}), **graph.parameters}
+    graph.max_concurrent_runs = max_concurrent_runs
+    return graph
+
+
+# Create Cluster
+def create_cluster(reconciler, config):
+    """Create the cluster, or keep or edit the one with its name; returns (cluster_id, warm)."""
+    print("Creating Databricks cluster...")
+    try:
+        result = reconciler.ensure_cluster(config)
+    except DatabricksApiError as e:
+        print("Failed to create cluster.")
+        print(f"Status Code: {e.status_code}")
+        print(f"Response: {e.text}")
+        return None, False
+    if result.action == CREATED:
+        print("Cluster created successfully!")
+    else:
+        print(f"Cluster {result.action} ({result.state}).")
+    print(f"Cluster ID: {result.object_id}")
+    return result.object_id, result.action == UNCHANGED and result.state in ACTIVE_CLUSTER_STATES
+
+#createJob
+def create_job(reconciler, config):
+    """
+    Create a Databricks job mapped to an existing cluster or a job cluster, or keep or reset the one with its name.
+    """
+    print("Creating Databricks job...")
+    try:
+        result = reconciler.ensure_job(config)
+    except DatabricksApiError as e:
         print("Failed to create job.")
-        print(f"Status Code: {response.status_code}")
-        print(f"Response: {response.text}")
+        print(f"Status Code: {e.status_code}")
+        print(f"Response: {e.text}")
         return None
+    if result.action == CREATED:
+        print("Job created successfully!")
+    else:
+        print(f"Job {result.action}.")
+    print(f"Job ID: {result.object_id}")
+    return result.object_id
 
 # Run Job
-def run_job(databricks_token, job_id):
+def run_job(client, job_id):
     print("Running Databricks job...")
-    headers = {
-        "Authorization": f"Bearer {databricks_token}",
-        "Content-Type": "application/json"
-    }
-    run_config = {
-        "job_id": job_id
-    }
-    response = requests.post(f"{DATABRICKS_WORKSPACE_URL}/api/2.1/jobs/run-now", headers=headers, json=run_config)
-    if response.status_code == 200:
-        print("Job run started successfully!")
-        run_id = response.json().get("run_id")
-        print(f"Run ID: {run_id}")
-        return run_id
-    else:
+    try:
+        run_id = client.run_now(job_id)
+    except DatabricksApiError as e:
         print("Failed to start job run.")
-        print(f"Status Code: {response.status_code}")
-        print(f"Response: {response.text}")
+        print(f"Status Code: {e.status_code}")
+        print(f"Response: {e.text}")
         return None
-    
+    print("Job run started successfully!")
+    print(f"Run ID: {run_id}")
+    return run_id
+
+
+def run_jobs(client, job_id, parameter_sets, max_concurrency):
+    """Start one run per parameter set, with at most max_concurrency run-now calls in flight."""
+    print(f"Starting {len(parameter_sets)} runs of job {job_id}...")
+    results = client.run_jobs(job_id, parameter_sets, max_concurrency)
+    for result in results:
+        if not result.succeeded:
+            print(f"Failed to start a run with {result.item}: {result.error}")
+    run_ids = [result.value for result in results if result.succeeded]
+    print(f"Started {len(run_ids)} of {len(parameter_sets)} runs.")
+    return run_ids
+
+
+parser = argparse.ArgumentParser(description="Create a cluster and a Spark JAR job on it, then run the job once.")
+parser.add_argument("--instance-pool", metavar="NAME",
+                    help="take the cluster's nodes from this instance pool, created if it does not exist")
+parser.add_argument("--min-idle", type=int, default=2, help="idle instances the pool keeps warm")
+parser.add_argument("--job-cluster", action="store_true",
+                    help="run the job on a job cluster created for the run instead of an all-purpose cluster")
+parser.add_argument("--tasks", metavar="FILE",
+                    help="YAML or JSON task graph to submit as one multi-task job on a shared job cluster")
+parser.add_argument("--parameter-sets", metavar="FILE",
+                    help="YAML or JSON list of job parameter mappings; the job is run once per mapping")
+parser.add_argument("--max-concurrency", type=int, default=DEFAULT_BULK_CONCURRENCY,
+                    help="run-now calls in flight at once, and runs of the job allowed at once")
+parser.add_argument("--prune-duplicates", action="store_true",
+                    help="delete clusters and jobs that share a name with the ones this script manages")
+args = parser.parse_args()
+parameter_sets = load_parameter_sets(args.parameter_sets) if args.parameter_sets else None
+# Every name a parameter set uses must be a job parameter, or run-now rejects the run.
+job_parameters = parameter_defaults(parameter_sets) if parameter_sets else {}
+use_job_cluster = args.job_cluster or bool(args.tasks)
 
 # Main Execution
+# One pooled session for every call; 429/503 responses are retried with backoff.
+tracer = start_tracing("GenerateDatabricks-Cluster-Jobs-Ini")
 try:
-    # Step 1: Get Databricks AAD Token
-    databricks_token = get_databricks_aad_token()
-    # Step 2: Use the token to create a cluster
-    cluster_id = create_cluster(databricks_token)
-    print(f"Cluster Created With ClusterId {cluster_id}")
-    if cluster_id:
-        job_id = create_job(databricks_token, cluster_id)
-        print(f"Job Created With JobId {job_id}")
-    # Step 4: Run the Job (Commented for now)
-    if job_id:
-        run_id = run_job(databricks_token, job_id)
-        print(f"Run Created With RunId {run_id}")
+    # The workspace URL and MSI client ID come from ARM once, then from the workspace metadata cache.
+    with tracer.span("workspace metadata", kind="step"):
+        workspace = WorkspaceMetadataCache().lookup(credential, SUBSCRIPTION_ID, RESOURCE_GROUP, WORKSPACE_NAME)
+    with DatabricksClient(resolve_workspace_url(workspace), credential) as client:
+        job_id = None
+        # Existing clusters and jobs are listed once; re-runs edit or keep them instead of creating duplicates.
+        reconciler = DatabricksReconciler(client, prune_duplicates=args.prune_duplicates)
+        timer = FirstTaskTimer()
+        config = cluster_config(workspace.msi_client_id)
+        capacity = "new VMs"
+        # Step 0: Create or reuse the instance pool; idle instances let the cluster skip VM provisioning
+        if args.instance_pool:
+            with tracer.span("instance pool", kind="step"):
+                pool = ensure_instance_pool(client, InstancePoolSpec(args.instance_pool, NODE_TYPE_ID, args.min_idle,
+                                                                     preloaded_spark_versions=[SPARK_VERSION]))
+            config = attach_to_pool(config, pool.instance_pool_id)
+            timer.warm = pool.warm
+            capacity = f"pool {args.instance_pool}, {pool.idle_count} idle"
+        if use_job_cluster:
+            # Step 1-2: Create a job whose tasks share a job cluster started for each run
+            with tracer.span("create job", kind="step"):
+                job_id = create_job(reconciler, job_graph(config, args.tasks, args.max_concurrency,
+                                                              job_parameters).settings())
+            print(f"Job Created With JobId {job_id}")
+        else:
+            # Step 1: Create a cluster, or reuse the one with its name, editing it if its config changed
+            # (the client acquires and refreshes the Databricks AAD token)
+            with tracer.span("create cluster", kind="step"):
+                cluster_id, warm = create_cluster(reconciler, config)
+            print(f"Cluster Created With ClusterId {cluster_id}")
+            if warm:
+                timer.warm = True
+                capacity = f"running cluster {cluster_id}"
+            # Step 2: Create a job on the cluster
+            if cluster_id:
+                with tracer.span("create job", kind="step"):
+                    job_id = create_job(reconciler, job_config(cluster_id, job_parameters, args.max_concurrency))
+                print(f"Job Created With JobId {job_id}")
+        # Step 3: Run the Job once the cluster is up, then follow the runs to completion
+        if job_id:
+            with tracer.span("run job", kind="step"):
+                if not use_job_cluster:
+                    wait_for_cluster(client, cluster_id)
+                if parameter_sets is not None:
+                    run_ids = run_jobs(client, job_id, parameter_sets, args.max_concurrency)
+                else:
+                    run_id = run_job(client, job_id)
+                    print(f"Run Created With RunId {run_id}")
+                    run_ids = [run_id] if run_id else []
+                if run_ids:
+                    final_states = asyncio.run(watch_runs(client, run_ids, job_id, on_transition=timer.task_started))
+                    for run_id, final_state in final_states.items():
+                        print(f"Run {run_id} finished with {final_state.result_state or final_state.life_cycle_state}")
+                    timer.report(capacity)
 
 except Exception as e:
     print(f"Error: {e}")
+finish_tracing()
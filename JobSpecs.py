@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field, fields
+
+from ConfigFiles import load_document
+
+DEFAULT_JAR = "abfss://jarcontainer@adlsstoragedev01.dfs.core.windows.net/jardir/default_artifact.jar"
+SHARED_CLUSTER_KEY = "shared"
+# Runs beyond max_concurrent_runs wait in the job's queue instead of being skipped.
+QUEUE_RUNS = True
+
+
+@dataclass
+class JarTask:
+    """One Spark JAR task of a job graph; depends_on names other tasks of the same graph."""
+    task_key: str
+    main_class_name: str
+    parameters: list = field(default_factory=list)
+    depends_on: list = field(default_factory=list)
+    job_cluster_key: str = SHARED_CLUSTER_KEY
+    jars: list = field(default_factory=list)
+    max_retries: int = 0
+    timeout_seconds: int = 0
+
+
+@dataclass
+class JobGraph:
+    """A DAG of JAR tasks submitted as one Jobs 2.1 multi-task job.
+
+    Tasks run on job clusters the job shares (job_clusters maps a key to
+    a new_cluster config), so dependent tasks start without waiting for
+    a cluster each and bill jobs DBUs. The graph's jars are declared with
+    identical specs on every task: Databricks installs a library once per
+    cluster, so each shared cluster reads the abfss:// artifact once and
+    every later task on it uses the installed copy.
+    """
+    name: str
+    job_clusters: dict
+    tasks: list = field(default_factory=list)
+    jars: list = field(default_factory=lambda: [DEFAULT_JAR])
+    parameters: dict = field(default_factory=dict)
+    max_concurrent_runs: int = 1
+
+    def add(self, task):
+        if any(existing.task_key == task.task_key for existing in self.tasks):
+            raise ValueError(f"Duplicate task key: {task.task_key}")
+        self.tasks.append(task)
+        return self
+
+    def task_order(self):
+        """The tasks with every task after the ones it depends on; raises ValueError on a bad graph."""
+        tasks = {task.task_key: task for task in self.tasks}
+        for task in self.tasks:
+            for dep in task.depends_on:
+                if dep not in tasks:
+                    raise ValueError(f"Task '{task.task_key}' depends on unknown task '{dep}'")
+            if task.job_cluster_key not in self.job_clusters:
+                raise ValueError(f"Task '{task.task_key}' uses unknown job cluster '{task.job_cluster_key}'")
+        ordered, done = [], set()
+        while len(ordered) < len(tasks):
+            ready = [task for key, task in tasks.items()
+                     if key not in done and all(dep in done for dep in task.depends_on)]
+            if not ready:
+                cycle = sorted(key for key in tasks if key not in done)
+                raise ValueError(f"Tasks depend on each other in a cycle: {', '.join(cycle)}")
+            ordered += ready
+            done.update(task.task_key for task in ready)
+        return ordered
+
+    def settings(self):
+        """The jobs/create (or jobs/reset new_settings) body."""
+        libraries = [{"jar": jar} for jar in self.jars]
+        tasks = []
+        for task in self.task_order():
+            spec = {
+                "task_key": task.task_key,
+                "job_cluster_key": task.job_cluster_key,
+                "spark_jar_task": {"main_class_name": task.main_class_name, "parameters": list(task.parameters)},
+                "libraries": libraries + [{"jar": jar} for jar in task.jars if jar not in self.jars],
+            }
+            if task.depends_on:
+                spec["depends_on"] = [{"task_key": dep} for dep in task.depends_on]
+            if task.max_retries:
+                spec["max_retries"] = task.max_retries
+            if task.timeout_seconds:
+                spec["timeout_seconds"] = task.timeout_seconds
+            tasks.append(spec)
+        settings = {
+            "name": self.name,
+            "job_clusters": [{"job_cluster_key": key, "new_cluster": config}
+                             for key, config in self.job_clusters.items()],
+            "tasks": tasks,
+            "max_concurrent_runs": self.max_concurrent_runs,
+            "queue": {"enabled": QUEUE_RUNS},
+        }
+        if self.parameters:
+            settings["parameters"] = [{"name": name, "default": str(default)}
+                                      for name, default in self.parameters.items()]
+        return settings
+
+
+def load_job_graph(path, name, job_cluster):
+    """Load a JobGraph from a YAML or JSON file, with every task on one shared job cluster by default.
+
+    The file holds a "tasks" list of JarTask fields, and optionally "jars"
+    and job "parameters" (name: default); a task parameter such as
+    "{{job.parameters.date}}" takes the value a run was started with.
+    """
+    document = load_document(path)
+    known_fields = {f.name for f in fields(JarTask)}
+    graph = JobGraph(name, {SHARED_CLUSTER_KEY: job_cluster}, jars=document.get("jars", [DEFAULT_JAR]),
+                     parameters=document.get("parameters", {}))
+    for index, entry in enumerate(document.get("tasks", [])):
+        unknown = set(entry) - known_fields
+        if unknown:
+            raise ValueError(f"Task #{index} has unknown fields: {', '.join(sorted(unknown))}")
+        graph.add(JarTask(**entry))
+    graph.task_order()
+    return graph
+
+
+def parameter_defaults(parameter_sets):
+    """Job parameters, each defaulting to "", for every name the parameter sets use; run-now rejects others."""
+    defaults = {}
+    for parameters in parameter_sets:
+        for name in parameters:
+            defaults.setdefault(name, "")
+    return defaults
+
+
+def load_parameter_sets(path):
+    """A list of job parameter mappings, one per run, from a YAML or JSON file."""
+    parameter_sets = load_document(path)
+    if not isinstance(parameter_sets, list) or not all(isinstance(entry, dict) for entry in parameter_sets):
+        raise ValueError(f"{path} must hold a list of parameter mappings")
+    return parameter_sets
@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import statistics
+import time
+from dataclasses import dataclass, replace
+
+from azure.mgmt.core.polling.async_arm_polling import AsyncARMPolling
+
+from ArmTemplates import (
+    RESOURCE_GROUP_TYPE,
+    DEPLOYMENT_TYPE,
+    NSG_TYPE,
+    VNET_TYPE,
+    WORKSPACE_TYPE,
+    PRIVATE_ENDPOINT_TYPE,
+    PRIVATE_DNS_ZONE_TYPE,
+    VNET_LINK_TYPE,
+    DNS_ZONE_GROUP_TYPE,
+    PRIVATE_ENDPOINT_CONNECTION_TYPE,
+)
+from ProvisioningTrace import current_span
+
+DEFAULT_HISTORY_PATH = "lro-history.json"
+HISTORY_PATH_ENV = "LRO_HISTORY_PATH"
+# JSON file of per-resource-type overrides, e.g. {"Microsoft.Databricks/workspaces": {"initial_delay": 300}}.
+POLLING_CONFIG_ENV = "LRO_POLLING_CONFIG"
+HISTORY_SIZE = 20
+MIN_HISTORY_SAMPLES = 3
+# With history, this many polls are spread between the 20th and 80th percentile durations.
+POLLS_PER_SPREAD = 4
+MIN_POLL_INTERVAL = 0.1
+# Wake-ups of concurrent pollers are rounded up to ticks of this many seconds and sent together.
+DEFAULT_TICK = 0.25
+# azure-mgmt-core waits this long between polls when the service sends no Retry-After.
+SDK_DEFAULT_INTERVAL = 30
+
+
+@dataclass(frozen=True)
+class PollingPolicy:
+    """When to poll a long-running operation: after initial_delay, then backing off from min_interval."""
+    initial_delay: float
+    min_interval: float
+    max_interval: float
+    backoff: float = 1.5
+
+    def delay(self, poll):
+        """Seconds to wait before the given poll; poll 0 follows the status check made right after the begin call."""
+        if poll == 0:
+            return self.initial_delay
+        return min(self.max_interval, self.min_interval * self.backoff ** (poll - 1))
+
+    def tuned(self, durations):
+        """The policy fitted to recent durations: first poll as the fastest fifth finish, then polls across the typical spread."""
+        if len(durations) < MIN_HISTORY_SAMPLES:
+            return self
+        quintiles = statistics.quantiles(durations, n=5)
+        low, high = quintiles[0], quintiles[-1]
+        interval = min(self.max_interval, max(MIN_POLL_INTERVAL, (high - low) / POLLS_PER_SPREAD))
+        return replace(self, initial_delay=low, min_interval=interval)
+
+
+DEFAULT_POLICY = PollingPolicy(initial_delay=2.0, min_interval=2.0, max_interval=30.0)
+# Typical create times: NSGs and zone groups finish in about a second, workspaces take 5-15 minutes.
+DEFAULT_POLICIES = {
+    NSG_TYPE: PollingPolicy(initial_delay=0.5, min_interval=1.0, max_interval=5.0),
+    VNET_TYPE: PollingPolicy(initial_delay=1.0, min_interval=1.0, max_interval=10.0),
+    WORKSPACE_TYPE: PollingPolicy(initial_delay=120.0, min_interval=15.0, max_interval=60.0),
+    PRIVATE_ENDPOINT_TYPE: PollingPolicy(initial_delay=5.0, min_interval=2.0, max_interval=15.0),
+    PRIVATE_DNS_ZONE_TYPE: PollingPolicy(initial_delay=5.0, min_interval=2.0, max_interval=15.0),
+    VNET_LINK_TYPE: PollingPolicy(initial_delay=5.0, min_interval=2.0, max_interval=15.0),
+    DNS_ZONE_GROUP_TYPE: PollingPolicy(initial_delay=0.5, min_interval=1.0, max_interval=5.0),
+    PRIVATE_ENDPOINT_CONNECTION_TYPE: PollingPolicy(initial_delay=2.0, min_interval=2.0, max_interval=10.0),
+    DEPLOYMENT_TYPE: PollingPolicy(initial_delay=2.0, min_interval=2.0, max_interval=15.0),
+    RESOURCE_GROUP_TYPE: PollingPolicy(initial_delay=10.0, min_interval=5.0, max_interval=30.0),
+}
+OPERATIONS_RESOURCE_TYPES = {
+    "NetworkSecurityGroupsOperations": NSG_TYPE,
+    "VirtualNetworksOperations": VNET_TYPE,
+    "WorkspacesOperations": WORKSPACE_TYPE,
+    "PrivateEndpointsOperations": PRIVATE_ENDPOINT_TYPE,
+    "PrivateDnsZoneGroupsOperations": DNS_ZONE_GROUP_TYPE,
+    "PrivateZonesOperations": PRIVATE_DNS_ZONE_TYPE,
+    "VirtualNetworkLinksOperations": VNET_LINK_TYPE,
+    "DeploymentsOperations": DEPLOYMENT_TYPE,
+    "ResourceGroupsOperations": RESOURCE_GROUP_TYPE,
+}
+
+
+def load_policies(path=None):
+    """DEFAULT_POLICIES with the overrides from the LRO_POLLING_CONFIG file applied."""
+    policies = dict(DEFAULT_POLICIES)
+    path = path or os.environ.get(POLLING_CONFIG_ENV)
+    if path:
+        with open(path) as f:
+            for resource_type, overrides in json.load(f).items():
+                policies[resource_type] = replace(policies.get(resource_type, DEFAULT_POLICY), **overrides)
+    return policies
+
+
+def operation_resource_type(begin_operation):
+    """The resource type a bound begin_* method of an azure.mgmt operations group works on."""
+    owner = getattr(begin_operation, "__self__", None)
+    return OPERATIONS_RESOURCE_TYPES.get(type(owner).__name__)
+
+
+def deployment_resource_type(template):
+    """A template that deploys one kind of resource is polled like that resource; others like a deployment."""
+    types = {resource["type"] for resource in template.get("resources", [])}
+    return types.pop() if len(types) == 1 else DEPLOYMENT_TYPE
+
+
+def history_key(resource_type, operation):
+    return f"{resource_type} {operation}"
+
+
+class PollingHistory:
+    """The last HISTORY_SIZE successful durations of each resource type and operation, kept between runs."""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(HISTORY_PATH_ENV, DEFAULT_HISTORY_PATH)
+        self.durations = {}
+        self._changed = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.durations = json.load(f)
+
+    def get(self, key):
+        return self.durations.get(key, [])
+
+    def record(self, key, duration):
+        self.durations[key] = (self.get(key) + [round(duration, 3)])[-HISTORY_SIZE:]
+        self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.durations, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self._changed = False
+
+
+class PollScheduler:
+    """One loop that wakes every waiting LRO poller on the event loop.
+
+    Wake-ups are rounded up to shared ticks, so concurrent operations poll
+    together rather than on one timer each, and when max_polls_per_second
+    is set, polls beyond that rate wait for a later tick to spare the
+    subscription's read quota.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, max_polls_per_second=None):
+        self.tick = tick
+        self.max_polls_per_second = max_polls_per_second
+        self.ticks = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    async def sleep(self, delay):
+        loop = asyncio.get_running_loop()
+        due = math.ceil((loop.time() + delay) / self.tick) * self.tick
+        future = loop.create_future()
+        heapq.heappush(self._waiting, (due, next(self._counter), future))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        else:
+            self._wakeup.set()
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        budget = max(1, int(self.max_polls_per_second * self.tick)) if self.max_polls_per_second else math.inf
+        while self._waiting:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, self._waiting[0][0] - loop.time()))
+                continue  # An earlier wake-up was added.
+            except asyncio.TimeoutError:
+                pass
+            released = 0
+            while self._waiting and self._waiting[0][0] <= loop.time() and released < budget:
+                future = heapq.heappop(self._waiting)[2]
+                if not future.done():
+                    future.set_result(None)
+                    released += 1
+            self.ticks += 1
+            if released >= budget:
+                await asyncio.sleep(self.tick)
+
+
+class TunedPolling(AsyncARMPolling):
+    """ARM polling on a PollingPolicy schedule instead of the service's Retry-After.
+
+    Waits go through a shared PollScheduler. The Retry-After the SDK would
+    have honoured is still read, so each operation can report how many
+    polls the default cadence would have made. Throttled polls are retried
+    by the client pipeline as before.
+    """
+
+    def __init__(self, policy, scheduler=None, on_finished=None, **kwargs):
+        super().__init__(timeout=SDK_DEFAULT_INTERVAL, **kwargs)
+        self.policy = policy
+        self.scheduler = scheduler
+        self.on_finished = on_finished
+        self.polls = 0
+        self.default_delays = []
+        self.duration = None
+        self._started = None
+
+    def initialize(self, client, initial_response, deserialization_callback):
+        self._started = time.monotonic()
+        super().initialize(client, initial_response, deserialization_callback)
+
+    async def _delay(self):
+        self.default_delays.append(self._extract_delay())
+        delay = self.policy.delay(self.polls)
+        self.polls += 1
+        if self.scheduler is not None:
+            await self.scheduler.sleep(delay)
+        else:
+            await asyncio.sleep(delay)
+
+    @property
+    def default_polls(self):
+        """Polls the SDK's own cadence would have made over the same duration."""
+        if not self.polls or not self.duration:
+            return self.polls
+        return max(1, math.ceil(self.duration / statistics.mean(self.default_delays)))
+
+    @property
+    def default_duration(self):
+        """When the SDK's own cadence would have seen the operation finish."""
+        if not self.polls or not self.duration:
+            return self.duration
+        return self.default_polls * statistics.mean(self.default_delays)
+
+    async def run(self):
+        try:
+            await super().run()
+        finally:
+            self.duration = time.monotonic() - self._started
+            span = current_span()
+            if span is not None:
+                span.add("lro.scheduled_polls", self.polls)
+                span.add("lro.default_polls", self.default_polls)
+                span.add("lro.seconds_saved", round(self.default_duration - self.duration, 3))
+            if self.on_finished is not None:
+                self.on_finished(self)
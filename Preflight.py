@@ -0,0 +1,354 @@
+import asyncio
+import fnmatch
+import inspect
+import ipaddress
+from dataclasses import dataclass, field
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+from ProvisioningSpecs import DATABRICKS_SERVICE_NAME
+from ProvisioningTrace import get_tracer
+
+ERROR = "error"
+WARNING = "warning"
+# The private endpoint targets this sub-resource; workspaces without it (e.g. standard SKU) cannot take one.
+UI_API_GROUP_ID = "databricks_ui_api"
+PRIVATE_LINK_SKUS = ("premium",)
+# Nodes a cluster needs at least: the driver and one worker.
+MIN_CLUSTER_NODES = 2
+TOTAL_CORES_USAGE = "cores"
+# What a run of the workspace stack writes; the caller needs every one on the resource group.
+REQUIRED_ACTIONS = (
+    "Microsoft.Network/networkSecurityGroups/write",
+    "Microsoft.Network/virtualNetworks/write",
+    "Microsoft.Network/virtualNetworks/subnets/join/action",
+    "Microsoft.Network/privateEndpoints/write",
+    "Microsoft.Network/privateDnsZones/write",
+    "Microsoft.Network/privateDnsZones/virtualNetworkLinks/write",
+    "Microsoft.Databricks/workspaces/write",
+    "Microsoft.Resources/deployments/write",
+)
+
+
+@dataclass
+class PreflightProblem:
+    check: str
+    severity: str
+    message: str
+
+
+@dataclass
+class PreflightReport:
+    """Every problem the pre-flight checks found for one stack; it may be provisioned when there are no errors."""
+    name: str
+    checks: list = field(default_factory=list)
+    problems: list = field(default_factory=list)
+
+    @property
+    def errors(self):
+        return [problem for problem in self.problems if problem.severity == ERROR]
+
+    @property
+    def passed(self):
+        return not self.errors
+
+    def add(self, check, severity, message):
+        self.problems.append(PreflightProblem(check, severity, message))
+
+    def print_report(self):
+        status = "passed" if self.passed else "FAILED"
+        print(f"\nPre-flight for {self.name}: {status} ({len(self.checks)} checks, {len(self.errors)} errors, "
+              f"{len(self.problems) - len(self.errors)} warnings)")
+        for problem in sorted(self.problems, key=lambda problem: self.checks.index(problem.check)):
+            print(f"  {problem.severity.upper():<8}{problem.check:<22}{problem.message}")
+
+
+class PreflightFailed(Exception):
+    """Raised (or returned as a flow's error) when a stack fails its pre-flight checks."""
+
+    def __init__(self, report):
+        super().__init__(f"Pre-flight failed for {report.name}: " + "; ".join(p.message for p in report.errors))
+        self.report = report
+
+
+async def _fetch(getter, *args, **kwargs):
+    try:
+        return await getter(*args, **kwargs)
+    except ResourceNotFoundError:
+        return None
+
+
+def _overlaps(prefix, prefixes):
+    network = ipaddress.ip_network(prefix)
+    return [other for other in prefixes if network.overlaps(ipaddress.ip_network(other))]
+
+
+def _subnet(vnet, name):
+    return next((subnet for subnet in (vnet.subnets if vnet else None) or [] if subnet.name == name), None)
+
+
+# Checks: each returns a list of (severity, message) and reads only what it needs.
+def check_address_plan(stack, vnet):
+    """The stack's subnets fit its address space and do not overlap each other or the VNet's other subnets."""
+    problems = []
+    ours = {
+        stack.public_subnet_name: stack.public_subnet_prefix,
+        stack.private_subnet_name: stack.private_subnet_prefix,
+        stack.private_link_subnet_name: stack.private_link_subnet_prefix,
+    }
+    if stack.default_subnet_prefix is not None:
+        ours["default"] = stack.default_subnet_prefix
+    space = [stack.address_space] + list(vnet.address_space.address_prefixes or [] if vnet else [])
+    for name, prefix in ours.items():
+        if not any(ipaddress.ip_network(prefix).subnet_of(ipaddress.ip_network(block)) for block in space):
+            problems.append((ERROR, f"Subnet {name} ({prefix}) is outside the address space {', '.join(space)}"))
+    names = list(ours)
+    for index, name in enumerate(names):
+        for other in names[index + 1:]:
+            if _overlaps(ours[name], [ours[other]]):
+                problems.append((ERROR, f"Subnets {name} ({ours[name]}) and {other} ({ours[other]}) overlap"))
+    for subnet in (vnet.subnets if vnet else None) or []:
+        if subnet.name in ours or not subnet.address_prefix:
+            continue
+        for name, prefix in ours.items():
+            if _overlaps(prefix, [subnet.address_prefix]):
+                problems.append((ERROR, f"Subnet {name} ({prefix}) overlaps existing subnet "
+                                        f"{subnet.name} ({subnet.address_prefix})"))
+    for name, prefix in ours.items():
+        existing = _subnet(vnet, name)
+        if existing is not None and existing.address_prefix and existing.address_prefix != prefix \
+                and (existing.ip_configurations or existing.private_endpoints):
+            problems.append((ERROR, f"Subnet {name} is in use with {existing.address_prefix}; "
+                                    f"it cannot be moved to {prefix}"))
+    return problems
+
+
+async def check_peered_address_space(clients, stack, vnet):
+    """The stack's address space does not overlap the address space of any VNet peered with its VNet."""
+    if vnet is None:
+        return []
+    problems = []
+    peerings = clients.network(stack.subscription_id).virtual_network_peerings
+    async for peering in peerings.list(stack.resource_group, stack.vnet_name):
+        remote = peering.remote_address_space.address_prefixes if peering.remote_address_space else []
+        overlapping = _overlaps(stack.address_space, remote or [])
+        if overlapping:
+            problems.append((ERROR, f"Address space {stack.address_space} overlaps {', '.join(overlapping)} of "
+                                    f"peered VNet {peering.remote_virtual_network.id.split('/')[-1]}"))
+    return problems
+
+
+def check_subnet_delegations(stack, vnet):
+    """Workspace subnets are (or can be) delegated to Databricks, and the PrivateLink subnet is not delegated."""
+    problems = []
+    for name in (stack.public_subnet_name, stack.private_subnet_name):
+        subnet = _subnet(vnet, name)
+        if subnet is None:
+            continue
+        services = [delegation.service_name for delegation in subnet.delegations or []]
+        others = [service for service in services if service != DATABRICKS_SERVICE_NAME]
+        if others:
+            problems.append((ERROR, f"Subnet {name} is delegated to {', '.join(others)}, "
+                                    f"not {DATABRICKS_SERVICE_NAME}"))
+        elif not services and (subnet.ip_configurations or subnet.private_endpoints):
+            problems.append((ERROR, f"Subnet {name} is in use and has no {DATABRICKS_SERVICE_NAME} delegation; "
+                                    f"an in-use subnet cannot be delegated"))
+        elif not services:
+            problems.append((WARNING, f"Subnet {name} has no delegation yet; it will be delegated to Databricks"))
+    subnet = _subnet(vnet, stack.private_link_subnet_name)
+    if subnet is not None and subnet.delegations:
+        services = ", ".join(delegation.service_name for delegation in subnet.delegations)
+        problems.append((ERROR, f"PrivateLink subnet {stack.private_link_subnet_name} is delegated to {services}; "
+                                f"private endpoints need an undelegated subnet"))
+    return problems
+
+
+def check_workspace_name(stack, workspace, managed_group):
+    """The workspace name is free, or taken by this stack's own workspace on the same VNet."""
+    problems = []
+    if workspace is not None:
+        parameter = workspace.parameters.custom_virtual_network_id if workspace.parameters else None
+        vnet_id = parameter.value if parameter else None
+        if vnet_id is None or vnet_id.lower() != stack.vnet_id.lower():
+            problems.append((ERROR, f"Workspace {stack.workspace_name} already exists in {stack.resource_group} "
+                                    f"on {vnet_id.split('/')[-1] if vnet_id else 'a managed VNet'}, "
+                                    f"not {stack.vnet_name}"))
+        if workspace.managed_resource_group_id.lower() != stack.managed_resource_group_id.lower():
+            problems.append((ERROR, f"Workspace {stack.workspace_name} already exists with managed resource group "
+                                    f"{workspace.managed_resource_group_id.split('/')[-1]}"))
+    if managed_group is not None and (managed_group.managed_by or "").lower() != stack.workspace_id.lower():
+        owner = managed_group.managed_by.split("/")[-1] if managed_group.managed_by else "nothing"
+        problems.append((ERROR, f"Managed resource group {managed_group.name} already exists, managed by {owner}"))
+    return problems
+
+
+async def check_private_endpoint(clients, stack, workspace):
+    """The workspace can take a databricks_ui_api private endpoint, and the endpoint name is free or ours."""
+    problems = []
+    sub, rg = stack.subscription_id, stack.resource_group
+    if workspace is None:
+        if stack.sku.lower() not in PRIVATE_LINK_SKUS:
+            problems.append((ERROR, f"Private endpoints need a premium workspace; the stack asks for {stack.sku}"))
+    else:
+        group_ids = [resource.properties.group_id async for resource in
+                     clients.databricks(sub).private_link_resources.list(rg, stack.workspace_name)]
+        if UI_API_GROUP_ID not in group_ids:
+            problems.append((ERROR, f"Workspace {stack.workspace_name} has no {UI_API_GROUP_ID} sub-resource "
+                                    f"(it offers {', '.join(group_ids) or 'none'})"))
+    endpoint = await _fetch(clients.network(sub).private_endpoints.get, rg, stack.private_endpoint_name)
+    if endpoint is not None:
+        connections = (endpoint.private_link_service_connections
+                       or endpoint.manual_private_link_service_connections or [])
+        targets = [connection.private_link_service_id for connection in connections]
+        if not any(target.lower() == stack.workspace_id.lower() for target in targets):
+            problems.append((ERROR, f"Private endpoint {stack.private_endpoint_name} already exists for "
+                                    f"{', '.join(target.split('/')[-1] for target in targets) or 'another resource'}"))
+    return problems
+
+
+async def check_dns_zone(clients, stack):
+    """The VNet is not already linked to another zone of the same name, which would block the new link."""
+    sub = stack.subscription_id
+    await clients.dns_zones.discover(sub)
+    reused = clients.dns_zones.find(sub, stack.private_dns_zone_name)
+    if reused is None:
+        return []
+    problems = []
+    dns = clients.private_dns(sub)
+    async for zone in dns.private_zones.list():
+        if zone.name.lower() != stack.private_dns_zone_name.lower() or zone.id.lower() == reused.zone_id.lower():
+            continue
+        async for link in dns.virtual_network_links.list(zone.id.split("/")[4], zone.name):
+            if link.virtual_network.id.lower() == stack.vnet_id.lower():
+                problems.append((ERROR, f"{stack.vnet_name} is linked to {zone.name} in {zone.id.split('/')[4]}, "
+                                        f"but the stack uses the zone in {reused.resource_group}; "
+                                        f"a VNet can link only one zone of a name"))
+    return problems
+
+
+async def check_core_quota(clients, stack, node_type_id, skus_by_location):
+    """The subscription has regional and family vCPU quota left for a cluster of node_type_id."""
+    if node_type_id is None:
+        return []
+    compute = clients.compute(stack.subscription_id)
+    key = (stack.subscription_id, stack.location.lower())
+    if key not in skus_by_location:
+        skus_by_location[key] = asyncio.ensure_future(_vm_skus(compute, stack.location))
+    skus, usages = await asyncio.gather(skus_by_location[key], _usages(compute, stack.location))
+    sku = skus.get(node_type_id.lower())
+    if sku is None:
+        return [(ERROR, f"Node type {node_type_id} is not offered in {stack.location}")]
+    family, vcpus, restricted = sku
+    if restricted:
+        return [(ERROR, f"Node type {node_type_id} is restricted for this subscription in {stack.location}")]
+    nodes = max(stack.max_cluster_nodes or 0, MIN_CLUSTER_NODES)
+    needed = vcpus * nodes
+    problems = []
+    for usage_name, label in ((family, f"{family} vCPUs"), (TOTAL_CORES_USAGE, "regional vCPUs")):
+        usage = usages.get(usage_name.lower())
+        if usage is None:
+            problems.append((WARNING, f"No {label} quota reported in {stack.location}"))
+        elif usage[1] - usage[0] < needed:
+            problems.append((ERROR, f"{nodes} x {node_type_id} need {needed} {label}; "
+                                    f"{usage[1] - usage[0]} of {usage[1]} are free in {stack.location}"))
+    return problems
+
+
+async def _vm_skus(compute, location):
+    """{VM size (lower-cased): (family, vCPUs, restricted)} in the location."""
+    skus = {}
+    async for sku in compute.resource_skus.list(filter=f"location eq '{location}'"):
+        if sku.resource_type != "virtualMachines":
+            continue
+        capabilities = {capability.name: capability.value for capability in sku.capabilities or []}
+        skus[sku.name.lower()] = (sku.family, int(capabilities.get("vCPUs", 0)), bool(sku.restrictions))
+    return skus
+
+
+async def _usages(compute, location):
+    return {usage.name.value.lower(): (usage.current_value, usage.limit)
+            async for usage in compute.usage.list(location)}
+
+
+def _permits(actions, not_actions, action):
+    return (any(fnmatch.fnmatchcase(action, pattern) for pattern in actions)
+            and not any(fnmatch.fnmatchcase(action, pattern) for pattern in not_actions))
+
+
+async def check_permissions(clients, stack, group):
+    """The caller may perform every write the stack needs on its resource group."""
+    if group is None:
+        return [(WARNING, f"Resource group {stack.resource_group} does not exist yet; "
+                          f"permissions are only checked on an existing group")]
+    # A permission's not_actions only carve actions out of its own actions, so each one is evaluated alone.
+    permissions = []
+    async for permission in clients.authorization(stack.subscription_id).permissions.list_for_resource_group(
+            stack.resource_group):
+        permissions.append(([action.lower() for action in permission.actions or []],
+                            [action.lower() for action in permission.not_actions or []]))
+    missing = [action for action in REQUIRED_ACTIONS
+               if not any(_permits(actions, not_actions, action.lower()) for actions, not_actions in permissions)]
+    return [(ERROR, f"Missing permission on {stack.resource_group}: {action}") for action in missing]
+
+
+async def preflight_workspace_stack(clients, stack, skus_by_location=None):
+    """Run every pre-flight check of the stack concurrently; returns a PreflightReport of all problems.
+
+    The current resources are read once and shared by the checks. A check
+    that cannot run (a read is denied, say) is reported as a warning.
+    """
+    sub, rg = stack.subscription_id, stack.resource_group
+    skus_by_location = skus_by_location if skus_by_location is not None else {}
+    report = PreflightReport(stack.name)
+    with get_tracer().span(f"preflight {stack.name}", kind="step") as span:
+        group, vnet, workspace, managed_group = await asyncio.gather(
+            _fetch(clients.resource(sub).resource_groups.get, rg),
+            _fetch(clients.network(sub).virtual_networks.get, rg, stack.vnet_name),
+            _fetch(clients.databricks(sub).workspaces.get, rg, stack.workspace_name),
+            _fetch(clients.resource(sub).resource_groups.get, stack.managed_resource_group_id.split("/")[-1]),
+        )
+
+        async def run(check, work):
+            report.checks.append(check)
+            try:
+                problems = await work if inspect.isawaitable(work) else work
+            except HttpResponseError as e:
+                problems = [(WARNING, f"Check could not run: {e.message or e}")]
+            for severity, message in problems:
+                report.add(check, severity, message)
+
+        await asyncio.gather(
+            run("workspace_name", check_workspace_name(stack, workspace, managed_group)),
+            run("address_plan", check_address_plan(stack, vnet)),
+            run("peered_address_space", check_peered_address_space(clients, stack, vnet)),
+            run("subnet_delegations", check_subnet_delegations(stack, vnet)),
+            run("private_endpoint", check_private_endpoint(clients, stack, workspace)),
+            run("dns_zone", check_dns_zone(clients, stack)),
+            run("core_quota", check_core_quota(clients, stack, stack.node_type_id, skus_by_location)),
+            run("permissions", check_permissions(clients, stack, group)),
+        )
+        span.set("preflight.errors", len(report.errors))
+        span.set("preflight.problems", len(report.problems))
+    return report
+
+
+async def preflight_workspaces(clients, stacks, max_concurrency):
+    """A PreflightReport per stack, in order; stacks in one location share the VM size lookup.
+
+    A stack whose checks raise gets a report with that error instead of
+    failing the others.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    skus_by_location = {}
+
+    async def check_one(stack):
+        async with semaphore:
+            try:
+                return await preflight_workspace_stack(clients, stack, skus_by_location)
+            except Exception as e:
+                # The shared reads failed (a denied GET, say); only this stack fails its pre-flight.
+                report = PreflightReport(stack.name, checks=["preflight"])
+                report.add("preflight", ERROR, f"Pre-flight could not run: {getattr(e, 'message', None) or e}")
+                return report
+
+    return await asyncio.gather(*(check_one(stack) for stack in stacks))
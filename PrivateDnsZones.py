@@ -0,0 +1,163 @@
+import asyncio
+from dataclasses import dataclass, field
+
+from AzureSdk import models
+from ProvisioningSpecs import network_resource_id
+
+# Only zones with this prefix are discovered; they are the ones private endpoints register in.
+PRIVATE_LINK_ZONE_PREFIX = "privatelink."
+
+
+@dataclass
+class PrivateDnsZoneRecord:
+    """A private DNS zone and the VNets linked to it, by lower-cased VNet ID."""
+    zone_id: str
+    links: dict = field(default_factory=dict)
+    # False while the zone is only claimed by a plan; ensure_zone() creates it.
+    exists: bool = True
+    # Link names handed out to VNets that are not linked yet, by lower-cased VNet ID.
+    reserved_links: dict = field(default_factory=dict)
+
+    @property
+    def name(self):
+        return self.zone_id.split("/")[-1]
+
+    @property
+    def resource_group(self):
+        return self.zone_id.split("/")[4]
+
+
+@dataclass
+class PrivateDnsZonePlacement:
+    """Where the registry puts a zone, and the name of the VNet's link to it."""
+    zone_id: str
+    link_name: str
+    zone_exists: bool
+    linked: bool
+
+    @property
+    def zone_name(self):
+        return self.zone_id.split("/")[-1]
+
+    @property
+    def resource_group(self):
+        return self.zone_id.split("/")[4]
+
+    @property
+    def link_id(self):
+        return f"{self.zone_id}/virtualNetworkLinks/{self.link_name}"
+
+
+def vnet_link_name(zone_name, vnet_id, taken):
+    """The zone's usual "<zone>-link" name, or "<vnet>-link" when another VNet already has it."""
+    name = f"{zone_name}-link"
+    if name.lower() in taken:
+        name = f"{vnet_id.split('/')[-1]}-link"
+    return name
+
+
+class PrivateDnsZoneRegistry:
+    """Private DNS zones discovered once per subscription and shared by every flow on the clients.
+
+    The first lookup in a subscription lists its privatelink zones and
+    their VNet links concurrently. ensure_zone() then reuses a zone found
+    anywhere in the subscription and only creates what is missing: the
+    zone, when there is none, and the link, when the VNet is not linked.
+    Changes for one zone are serialized, so parallel flows never create it
+    or its link twice.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self._zones = {}
+        self._discovery = {}
+
+    async def discover(self, subscription_id):
+        if subscription_id not in self._discovery:
+            self._discovery[subscription_id] = asyncio.ensure_future(self._discover(subscription_id))
+        await self._discovery[subscription_id]
+
+    async def _discover(self, subscription_id):
+        dns = self.clients.private_dns(subscription_id)
+        zones = [zone async for zone in dns.private_zones.list() if zone.name.startswith(PRIVATE_LINK_ZONE_PREFIX)]
+
+        async def load(zone):
+            record = PrivateDnsZoneRecord(zone.id)
+            async for link in dns.virtual_network_links.list(record.resource_group, record.name):
+                record.links[link.virtual_network.id.lower()] = link.name
+            return record
+
+        for record in await asyncio.gather(*(load(zone) for zone in zones)):
+            # With the same zone in several resource groups, the first one listed is reused.
+            self._zones.setdefault((subscription_id, record.name.lower()), record)
+        print(f"Discovered {len(zones)} private DNS zones in subscription {subscription_id}.")
+
+    def find(self, subscription_id, zone_name):
+        return self._zones.get((subscription_id, zone_name.lower()))
+
+    def _claim(self, subscription_id, resource_group, zone_name, vnet_id):
+        record = self.find(subscription_id, zone_name)
+        if record is None:
+            zone_id = network_resource_id(subscription_id, resource_group, "privateDnsZones", zone_name)
+            record = self._zones[(subscription_id, zone_name.lower())] = PrivateDnsZoneRecord(zone_id, exists=False)
+        vnet = vnet_id.lower()
+        if vnet not in record.links and vnet not in record.reserved_links:
+            taken = {name.lower() for name in [*record.links.values(), *record.reserved_links.values()]}
+            record.reserved_links[vnet] = vnet_link_name(zone_name, vnet_id, taken)
+        return record
+
+    async def placement(self, subscription_id, resource_group, zone_name, vnet_id):
+        """The zone ensure_zone() would use for the VNet and the link name it would give it, without writing.
+
+        A missing zone is claimed for resource_group and a missing link's
+        name is reserved, so parallel stacks agree on one zone and never
+        pick the same link name for different VNets.
+        """
+        await self.discover(subscription_id)
+        record = self._claim(subscription_id, resource_group, zone_name, vnet_id)
+        linked = vnet_id.lower() in record.links
+        link_name = record.links[vnet_id.lower()] if linked else record.reserved_links[vnet_id.lower()]
+        return PrivateDnsZonePlacement(record.zone_id, link_name, record.exists, linked)
+
+    def record_link(self, subscription_id, placement, vnet_id):
+        """Note that something other than ensure_zone(), such as an ARM template, deployed a placement."""
+        record = self.find(subscription_id, placement.zone_name)
+        record.exists = True
+        record.reserved_links.pop(vnet_id.lower(), None)
+        record.links[vnet_id.lower()] = placement.link_name
+
+    async def ensure_zone(self, subscription_id, resource_group, zone_name, vnet_id, label, link=True):
+        """Return the ID of a zone named zone_name linked to the VNet, creating only what is missing.
+
+        With link=False only the zone is ensured, for a template that
+        deploys the link under the name placement() reserved.
+        """
+        await self.discover(subscription_id)
+        dns = self.clients.private_dns(subscription_id)
+        dns_models = models("private_dns")
+        async with self.clients.lock(f"{subscription_id}/privateDnsZones/{zone_name.lower()}"):
+            record = self._claim(subscription_id, resource_group, zone_name, vnet_id)
+            if not record.exists:
+                print(f"[{label}] Creating Private DNS Zone: {zone_name}...")
+                await self.clients.run_lro(subscription_id, dns.private_zones.begin_create_or_update,
+                                           record.resource_group, zone_name, dns_models.PrivateZone(location="global"))
+                record.exists = True
+            elif record.resource_group.lower() != resource_group.lower():
+                print(f"[{label}] Reusing Private DNS Zone {zone_name} in resource group {record.resource_group}.")
+
+            if not link:
+                return record.zone_id
+            if vnet_id.lower() in record.links:
+                print(f"[{label}] Private DNS Zone {zone_name} is already linked to {vnet_id.split('/')[-1]}.")
+                return record.zone_id
+            link_name = record.reserved_links.pop(vnet_id.lower())
+            print(f"[{label}] Linking Private DNS Zone {zone_name} to {vnet_id.split('/')[-1]}...")
+            await self.clients.run_lro(
+                subscription_id, dns.virtual_network_links.begin_create_or_update,
+                record.resource_group, zone_name, link_name,
+                dns_models.VirtualNetworkLink(location="global",
+                                              virtual_network=dns_models.SubResource(id=vnet_id),
+                                              registration_enabled=False)
+            )
+            record.links[vnet_id.lower()] = link_name
+            return record.zone_id
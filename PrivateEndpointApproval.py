@@ -0,0 +1,98 @@
+import time
+
+from ArmTemplates import PRIVATE_ENDPOINT_CONNECTION_TYPE
+from AzureSdk import models
+from LroPolling import PollingPolicy
+from ProvisioningTrace import get_tracer
+
+APPROVED = "Approved"
+PENDING = "Pending"
+# The provider turned the connection down; waiting longer will not change that.
+REJECTED_STATES = ("Rejected", "Disconnected")
+DEFAULT_APPROVAL_TIMEOUT = 15 * 60
+# Automatic approvals land within seconds; a manual one may take a person's reply.
+APPROVAL_POLICY = PollingPolicy(initial_delay=2.0, min_interval=5.0, max_interval=60.0)
+APPROVAL_DESCRIPTION = "Approved by the requesting subscription's owner"
+
+
+class PrivateEndpointNotApproved(Exception):
+    """Raised when a private endpoint's connection is rejected or still not approved at the deadline."""
+
+    def __init__(self, private_endpoint_name, status, description=None):
+        message = f"Private endpoint {private_endpoint_name} connection is {status}"
+        super().__init__(f"{message}: {description}" if description else message)
+        self.private_endpoint_name = private_endpoint_name
+        self.status = status
+        self.description = description
+
+
+def connection_state(private_endpoint):
+    """The private_link_service_connection_state of the endpoint's (automatic or manual) connection."""
+    connections = (private_endpoint.private_link_service_connections
+                   or private_endpoint.manual_private_link_service_connections or [])
+    return connections[0].private_link_service_connection_state if connections else None
+
+
+def _workspace_parts(workspace_id):
+    segments = workspace_id.strip("/").split("/")
+    return segments[1], segments[3], segments[-1]
+
+
+async def approve_connection(clients, remote_workspace_id, private_endpoint_id, label):
+    """Approve the endpoint's pending connection on the workspace's side; needs rights on that subscription."""
+    subscription_id, resource_group, workspace_name = _workspace_parts(remote_workspace_id)
+    connections = clients.databricks(subscription_id).private_endpoint_connections
+    async for connection in connections.list(resource_group, workspace_name):
+        endpoint = connection.properties.private_endpoint
+        if endpoint is not None and endpoint.id.lower() == private_endpoint_id.lower():
+            break
+    else:
+        raise ValueError(f"No connection from {private_endpoint_id} on workspace {remote_workspace_id}")
+    if connection.properties.private_link_service_connection_state.status == APPROVED:
+        return connection.id
+    print(f"[{label}] Approving the connection on workspace {workspace_name}...")
+    databricks = models("databricks")
+    approved = await clients.run_lro(
+        subscription_id,
+        connections.begin_create,
+        resource_group,
+        workspace_name,
+        connection.name,
+        databricks.PrivateEndpointConnection(properties=databricks.PrivateEndpointConnectionProperties(
+            private_endpoint=connection.properties.private_endpoint,
+            private_link_service_connection_state=databricks.PrivateLinkServiceConnectionState(
+                status=APPROVED, description=APPROVAL_DESCRIPTION)
+        )),
+        resource_type=PRIVATE_ENDPOINT_CONNECTION_TYPE,
+    )
+    return approved.id
+
+
+async def wait_for_approval(clients, subscription_id, resource_group, private_endpoint_name, label,
+                            timeout=DEFAULT_APPROVAL_TIMEOUT, policy=APPROVAL_POLICY):
+    """Poll the endpoint until its connection is Approved; raises PrivateEndpointNotApproved otherwise.
+
+    Polls wait in the clients' shared PollScheduler, on the same ticks as
+    the long-running operations.
+    """
+    network = clients.network(subscription_id)
+    deadline = time.monotonic() + timeout
+    with get_tracer().span(f"approval {private_endpoint_name}", kind="lro", subscription_id=subscription_id) as span:
+        poll = 0
+        while True:
+            state = connection_state(await network.private_endpoints.get(resource_group, private_endpoint_name))
+            status = state.status if state is not None else PENDING
+            if status == APPROVED:
+                span.set("approval.polls", poll)
+                print(f"[{label}] Private Endpoint connection approved.")
+                return status
+            if status in REJECTED_STATES:
+                raise PrivateEndpointNotApproved(private_endpoint_name, status, state.description)
+            delay = policy.delay(poll)
+            if time.monotonic() + delay > deadline:
+                raise PrivateEndpointNotApproved(private_endpoint_name, status,
+                                                 state.description if state is not None else None)
+            if poll == 0:
+                print(f"[{label}] Waiting for the Private Endpoint connection to be approved ({status})...")
+            poll += 1
+            await clients.poll_scheduler.sleep(delay)
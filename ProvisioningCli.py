@@ -0,0 +1,71 @@
+import argparse
+import os
+import runpy
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommand: (script it runs, help). The scripts parse their own options, so "<command> --help" lists them.
+SCRIPT_COMMANDS = {
+    "workspace": ("AzureDatabricksVNETProvisioning.py", "provision, plan or tear down the workspace stack"),
+    "fleet": ("FleetProvisioning.py", "provision, plan or tear down every stack in a manifest"),
+    "rollout": ("RegionalRollout.py", "provision a manifest region by region, canary first"),
+    "storage": ("ConnectStorageAccountToADB.py", "connect ADLS accounts to the workspace VNet"),
+    "source-endpoint": ("SourcePrivateEndpointRequest.py", "connect the query VNet to remote workspaces"),
+    "cluster-jobs": ("GenerateDatabricks-Cluster-Jobs-Ini.py", "create a cluster and a job, then run it"),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ProvisioningCli.py",
+                                     description="Azure Databricks VNet provisioning: one entry point for every script.")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for command, (script, help_text) in SCRIPT_COMMANDS.items():
+        commands.add_parser(command, help=help_text, add_help=False)
+
+    zone_group = commands.add_parser("zone-group", help="point a private endpoint's DNS zone group at a zone")
+    zone_group.add_argument("--subscription-id", required=True)
+    zone_group.add_argument("--resource-group", required=True)
+    zone_group.add_argument("--private-endpoint", required=True, help="name of the private endpoint")
+    zone_group.add_argument("--zone-id", required=True, help="resource ID of the private DNS zone")
+    zone_group.add_argument("--config-name", default="dnsZoneConfig")
+    return parser
+
+
+def run_script(script, argv):
+    """Run a script as __main__ with argv, as if it were started on its own."""
+    sys.argv = [script, *argv]
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    runpy.run_path(os.path.join(REPO_DIR, script), run_name="__main__")
+
+
+def update_zone_group(args):
+    # Imported only for this command, so --help and the script commands never load it first.
+    import asyncio
+
+    from AsyncProvisioning import update_private_dns_zone_group
+    from ProvisioningTrace import start_tracing, finish_tracing
+
+    start_tracing("zone-group")
+    try:
+        asyncio.run(update_private_dns_zone_group(args.subscription_id, args.resource_group, args.private_endpoint,
+                                                  args.zone_id, args.config_name))
+    except Exception as e:
+        print(f"Error: {e}")
+        return finish_tracing(1)
+    return finish_tracing(0)
+
+
+def main(argv=None):
+    args, rest = build_parser().parse_known_args(argv)
+    if args.command == "zone-group":
+        if rest:
+            build_parser().error(f"unrecognized arguments: {' '.join(rest)}")
+        return update_zone_group(args)
+    run_script(SCRIPT_COMMANDS[args.command][0], rest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
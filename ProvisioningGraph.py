@@ -0,0 +1,186 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from ProvisioningTrace import get_tracer
+
+
+@dataclass
+class ProvisioningStep:
+    """A single node in the provisioning graph."""
+    name: str
+    action: object
+    depends_on: tuple = ()
+
+
+@dataclass
+class StepTiming:
+    """Wall-clock timing of a step, relative to the start of the graph run."""
+    name: str
+    start: float
+    end: float
+    status: str = "succeeded"
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+@dataclass
+class ProvisioningReport:
+    """Timings and outputs of a graph run."""
+    name: str
+    steps: dict
+    timings: dict = field(default_factory=dict)
+    results: dict = field(default_factory=dict)
+    wall_time: float = 0.0
+
+    @property
+    def sequential_time(self):
+        """Time the same steps would have taken back-to-back."""
+        return sum(t.duration for t in self.timings.values())
+
+    @property
+    def critical_path(self):
+        """Chain of steps that determined the end time of the run."""
+        if not self.timings:
+            return []
+        path = []
+        current = max(self.timings.values(), key=lambda t: t.end).name
+        while current:
+            path.append(current)
+            deps = [self.timings[d] for d in self.steps[current].depends_on if d in self.timings]
+            current = max(deps, key=lambda t: t.end).name if deps else None
+        return list(reversed(path))
+
+    @property
+    def critical_path_time(self):
+        return sum(self.timings[name].duration for name in self.critical_path)
+
+    def print_summary(self):
+        print(f"\nProvisioning summary: {self.name}")
+        print(f"{'Step':<28}{'Status':<12}{'Start':>10}{'Duration':>12}")
+        for timing in sorted(self.timings.values(), key=lambda t: t.start):
+            print(f"{timing.name:<28}{timing.status:<12}{timing.start:>9.1f}s{timing.duration:>11.1f}s")
+        saved = self.sequential_time - self.wall_time
+        print(f"Wall time: {self.wall_time:.1f}s | Sequential time: {self.sequential_time:.1f}s | Saved: {saved:.1f}s")
+        print(f"Critical path ({self.critical_path_time:.1f}s): {' -> '.join(self.critical_path)}")
+
+
+class ProvisioningGraphError(Exception):
+    """Raised when a step fails; carries the report of everything that ran."""
+
+    def __init__(self, step_name, error, report):
+        super().__init__(f"Step '{step_name}' failed: {error}")
+        self.step_name = step_name
+        self.error = error
+        self.report = report
+
+
+class ProvisioningGraph:
+    """Runs provisioning steps as soon as the steps they depend on have finished.
+
+    Each action is called with a dict of the outputs of its dependencies and
+    waits on its own long-running operation, so independent LRO pollers run
+    side by side on the event loop.
+
+    With a journal, every step start and outcome is recorded, and steps the
+    journal already holds as succeeded are not run again: their recorded
+    output is handed to the steps that depend on them.
+
+    Each run is traced as a "graph" span with one "step" span per step.
+    """
+
+    def __init__(self, name, plan=None):
+        self.name = name
+        self.plan = plan
+        self.steps = {}
+
+    def add_step(self, name, action, depends_on=()):
+        if name in self.steps:
+            raise ValueError(f"Duplicate step name: {name}")
+        for dep in depends_on:
+            if dep not in self.steps:
+                raise ValueError(f"Step '{name}' depends on unknown step '{dep}'")
+        self.steps[name] = ProvisioningStep(name, action, tuple(depends_on))
+        return self
+
+    def _start_ready(self, pending, report, t0, journal, resumed, launch):
+        """Launch every step whose dependencies are done, resolving resumed steps in place."""
+        while True:
+            ready = [s for s in pending.values() if all(d in report.results for d in s.depends_on)]
+            if not ready:
+                return
+            for step in ready:
+                del pending[step.name]
+                now = time.monotonic() - t0
+                if step.name in resumed:
+                    report.results[step.name] = resumed[step.name]
+                    report.timings[step.name] = StepTiming(step.name, now, now, "resumed")
+                    continue
+                if journal is not None:
+                    journal.record_step(step.name, "started")
+                report.timings[step.name] = StepTiming(step.name, now, 0.0, "running")
+                launch(step, {d: report.results[d] for d in step.depends_on})
+
+    async def run_async(self, journal=None):
+        """Run every step as an asyncio task; actions must be coroutine functions."""
+        report = ProvisioningReport(self.name, self.steps)
+        pending = dict(self.steps)
+        running = {}
+        failure = None
+        resumed = self._begin(journal)
+        t0 = time.monotonic()
+
+        tracer = get_tracer()
+
+        def launch(step, deps):
+            async def traced():
+                with tracer.span(step.name, kind="step"):
+                    return await step.action(deps)
+            running[asyncio.ensure_future(traced())] = step
+
+        with tracer.span(self.name, kind="graph"):
+            try:
+                while True:
+                    if failure is None:
+                        self._start_ready(pending, report, t0, journal, resumed, launch)
+                    if not running:
+                        break
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        failure = self._finish(report, running.pop(task), task, t0, failure, journal)
+            finally:
+                for task in running:
+                    task.cancel()
+
+        return self._complete(report, failure, t0)
+
+    def _begin(self, journal):
+        if journal is None:
+            return {}
+        if self.plan is not None:
+            journal.record_plan(self.plan)
+        return journal.completed_steps()
+
+    def _finish(self, report, step, future, t0, failure, journal):
+        timing = report.timings[step.name]
+        timing.end = time.monotonic() - t0
+        try:
+            report.results[step.name] = future.result()
+            timing.status = "succeeded"
+            if journal is not None:
+                journal.record_step(step.name, "succeeded", output=report.results[step.name])
+        except Exception as e:
+            timing.status = "failed"
+            if journal is not None:
+                journal.record_step(step.name, "failed", error=e)
+            if failure is None:
+                failure = (step.name, e)
+        return failure
+
+    def _complete(self, report, failure, t0):
+        report.wall_time = time.monotonic() - t0
+        if failure is not None:
+            raise ProvisioningGraphError(failure[0], failure[1], report) from failure[1]
+        return report
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+DEFAULT_JOURNAL_PATH = "provisioning-journal.jsonl"
+
+
+def flow_key(item):
+    """Stable journal key for a provisioning spec."""
+    return f"{type(item).__name__}:/subscriptions/{item.subscription_id}/resourceGroups/{item.resource_group}/{item.name}"
+
+
+class ProvisioningJournal:
+    """Append-only JSON lines record of planned changes and completed steps.
+
+    Every entry carries the run ID, so a later run can resume from the
+    steps that already succeeded and a rollback can be limited to what
+    this run created. With path=None the journal is kept in memory only.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, run_id=None):
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._entries = []
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._entries = [json.loads(line) for line in f if line.strip()]
+
+    def append(self, entry):
+        entry = {"run_id": self.run_id, "timestamp": time.time(), **entry}
+        with self._lock:
+            self._entries.append(entry)
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(entry, default=str) + "\n")
+
+    def entries(self, flow=None):
+        """The entries of one flow, or of every flow when flow is None."""
+        with self._lock:
+            return [entry for entry in self._entries if flow is None or entry["flow"] == flow]
+
+    def flow(self, flow, resume=False):
+        return FlowJournal(self, flow, resume)
+
+    def created_resource_ids(self):
+        """Lower-cased IDs of every resource a run in the journal planned to create and started creating."""
+        entries = self.entries()
+        started = {(entry["run_id"], entry["flow"], entry["step"]) for entry in entries if entry["kind"] == "step"}
+        return {entry["resource_id"].lower() for entry in entries
+                if entry["kind"] == "plan" and entry["action"] == "create"
+                and (entry["run_id"], entry["flow"], entry["step"]) in started}
+
+
+class FlowJournal:
+    """The journal of one flow (one stack, storage connection or endpoint request)."""
+
+    def __init__(self, journal, flow, resume):
+        self.journal = journal
+        self.flow = flow
+        self._completed = {}
+        if resume:
+            for entry in journal.entries(flow):
+                if entry["kind"] != "step":
+                    continue
+                if entry["status"] == "succeeded":
+                    self._completed[entry["step"]] = entry.get("output")
+                else:
+                    self._completed.pop(entry["step"], None)
+
+    def completed_steps(self):
+        """Outputs of the steps that already succeeded, when resuming."""
+        return dict(self._completed)
+
+    def record_step(self, step, status, output=None, error=None):
+        entry = {"flow": self.flow, "kind": "step", "step": step, "status": status}
+        if output is not None:
+            entry["output"] = output
+        if error is not None:
+            entry["error"] = str(error)
+        self.journal.append(entry)
+
+    def record_plan(self, plan):
+        for change in plan.changes.values():
+            self.journal.append({
+                "flow": self.flow,
+                "kind": "plan",
+                "step": change.applied_by,
+                "resource_type": change.resource_type,
+                "resource_id": change.resource_id,
+                "action": change.action,
+            })
+
+    def created_resources(self):
+        """Resources this run planned to create and actually started creating, in plan order."""
+        this_run = [entry for entry in self.journal.entries(self.flow) if entry["run_id"] == self.journal.run_id]
+        started = {entry["step"] for entry in this_run if entry["kind"] == "step"}
+        return [entry for entry in this_run
+                if entry["kind"] == "plan" and entry["action"] == "create" and entry["step"] in started]
+
+    def other_flows_resources(self):
+        """Lower-cased IDs of every resource another flow in the journal planned, in this run or an earlier one."""
+        return {entry["resource_id"].lower() for entry in self.journal.entries()
+                if entry["kind"] == "plan" and entry["flow"] != self.flow}
+
@@ -0,0 +1,211 @@
+import asyncio
+from dataclasses import dataclass, field
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from ProvisioningSpecs import (
+    network_security_group_model,
+    virtual_network_model,
+    workspace_model,
+    private_endpoint_model,
+)
+
+PRIVATE_DNS_API_VERSION = "2020-06-01"
+
+CREATE = "create"
+UPDATE = "update"
+NO_OP = "no-op"
+SYMBOLS = {CREATE: "+", UPDATE: "~", NO_OP: "="}
+
+
+@dataclass
+class ResourceChange:
+    """What applying a step would do to one resource."""
+    step: str
+    resource_type: str
+    resource_id: str
+    action: str
+    differences: list = field(default_factory=list)
+    applied_by: str = None
+
+    def __post_init__(self):
+        # The graph step that applies the change; differs from step when
+        # several resources are applied together (e.g. one ARM deployment).
+        if self.applied_by is None:
+            self.applied_by = self.step
+
+    @property
+    def name(self):
+        return self.resource_id.split("/")[-1]
+
+
+@dataclass
+class ProvisioningPlan:
+    """The changes needed to converge one stack, keyed by graph step name."""
+    name: str
+    changes: dict = field(default_factory=dict)
+
+    def is_converged(self, step):
+        change = self.changes.get(step)
+        return change is not None and change.action == NO_OP
+
+    def count(self, action):
+        return sum(1 for change in self.changes.values() if change.action == action)
+
+    def print_plan(self):
+        print(f"\nPlan for {self.name}:")
+        for change in self.changes.values():
+            label = "no changes" if change.action == NO_OP else change.action
+            print(f"  {SYMBOLS[change.action]} {change.step:<18}{change.name:<40}({label})")
+            for path, current, desired in change.differences:
+                print(f"      {path}: {current!r} -> {desired!r}")
+        print(f"Plan: {self.count(CREATE)} to create, {self.count(UPDATE)} to update, "
+              f"{self.count(NO_OP)} unchanged.")
+
+
+def _id(value):
+    # ARM resource IDs are case-insensitive.
+    return value.lower() if isinstance(value, str) else value
+
+
+def _diff(current, desired):
+    """Compare two flat state dicts on the keys the desired state specifies."""
+    differences = []
+    for key in sorted(desired):
+        if current.get(key) != desired.get(key):
+            differences.append((key, current.get(key), desired.get(key)))
+    return differences
+
+
+def _nsg_state(nsg):
+    return {"location": nsg.location}
+
+
+def _vnet_state(vnet):
+    state = {
+        "location": vnet.location,
+        "address_space": sorted(vnet.address_space.address_prefixes or []),
+        "subnets": sorted(subnet.name for subnet in vnet.subnets or []),
+    }
+    for subnet in vnet.subnets or []:
+        prefix = f"subnets[{subnet.name}]"
+        state[f"{prefix}.address_prefix"] = subnet.address_prefix
+        state[f"{prefix}.nsg"] = _id(subnet.network_security_group.id) if subnet.network_security_group else None
+        state[f"{prefix}.delegations"] = sorted(d.service_name for d in subnet.delegations or [])
+        if subnet.private_endpoint_network_policies is not None:
+            state[f"{prefix}.private_endpoint_network_policies"] = subnet.private_endpoint_network_policies
+        if subnet.private_link_service_network_policies is not None:
+            state[f"{prefix}.private_link_service_network_policies"] = subnet.private_link_service_network_policies
+    return state
+
+
+def _workspace_state(workspace):
+    parameters = workspace.parameters
+    return {
+        "location": workspace.location,
+        "sku": workspace.sku.name,
+        "managed_resource_group_id": _id(workspace.managed_resource_group_id),
+        "enable_no_public_ip": parameters.enable_no_public_ip.value if parameters.enable_no_public_ip else None,
+        "custom_virtual_network_id": _id(parameters.custom_virtual_network_id.value) if parameters.custom_virtual_network_id else None,
+        "custom_public_subnet_name": parameters.custom_public_subnet_name.value if parameters.custom_public_subnet_name else None,
+        "custom_private_subnet_name": parameters.custom_private_subnet_name.value if parameters.custom_private_subnet_name else None,
+        "tags": dict(workspace.tags or {}),
+    }
+
+
+def _workspace_body_state(body):
+    parameters = body["properties"]["parameters"]
+    return {
+        "location": body["location"],
+        "sku": body["sku"]["name"],
+        "managed_resource_group_id": _id(body["properties"]["managedResourceGroupId"]),
+        "enable_no_public_ip": parameters["enableNoPublicIp"]["value"],
+        "custom_virtual_network_id": _id(parameters["customVirtualNetworkId"]["value"]),
+        "custom_public_subnet_name": parameters["customPublicSubnetName"]["value"],
+        "custom_private_subnet_name": parameters["customPrivateSubnetName"]["value"],
+        "tags": dict(body["tags"]),
+    }
+
+
+def _private_endpoint_state(private_endpoint):
+    connections = (private_endpoint.private_link_service_connections
+                   or private_endpoint.manual_private_link_service_connections or [])
+    return {
+        "location": private_endpoint.location,
+        "subnet": _id(private_endpoint.subnet.id),
+        "targets": sorted((_id(c.private_link_service_id), tuple(sorted(c.group_ids or []))) for c in connections),
+    }
+
+
+def _vnet_link_state(link):
+    return {
+        "virtual_network": _id(link.properties["virtualNetwork"]["id"]),
+        "registration_enabled": link.properties.get("registrationEnabled", False),
+    }
+
+
+def _zone_group_state(zone_group):
+    return {"zones": sorted(_id(c.private_dns_zone_id) for c in zone_group.private_dns_zone_configs or [])}
+
+
+async def _fetch(getter, *args, **kwargs):
+    try:
+        return await getter(*args, **kwargs)
+    except ResourceNotFoundError:
+        return None
+
+
+def _change(step, resource_type, resource_id, current_state, desired_state):
+    if current_state is None:
+        return ResourceChange(step, resource_type, resource_id, CREATE)
+    differences = _diff(current_state, desired_state)
+    return ResourceChange(step, resource_type, resource_id, UPDATE if differences else NO_OP, differences)
+
+
+async def plan_workspace_stack(clients, stack):
+    """Read the current state of a workspace stack with GETs and diff it against the desired models.
+
+    The DNS zone and the VNet's link are the ones the zone registry would
+    use, which may be a zone in another resource group.
+    """
+    sub, rg = stack.subscription_id, stack.resource_group
+    network = clients.network(sub)
+    resources = clients.resource(sub).resources
+    dns_zone = await clients.dns_zones.placement(sub, rg, stack.private_dns_zone_name, stack.vnet_id)
+
+    (group, nsg, vnet, workspace, private_endpoint, zone, link, zone_group) = await asyncio.gather(
+        _fetch(clients.resource(sub).resource_groups.get, rg),
+        _fetch(network.network_security_groups.get, rg, stack.nsg_name),
+        _fetch(network.virtual_networks.get, rg, stack.vnet_name),
+        _fetch(clients.databricks(sub).workspaces.get, rg, stack.workspace_name),
+        _fetch(network.private_endpoints.get, rg, stack.private_endpoint_name),
+        _fetch(resources.get_by_id, dns_zone.zone_id, api_version=PRIVATE_DNS_API_VERSION),
+        _fetch(resources.get_by_id, dns_zone.link_id, api_version=PRIVATE_DNS_API_VERSION),
+        _fetch(network.private_dns_zone_groups.get, rg, stack.private_endpoint_name, "default"),
+    )
+
+    desired_endpoint = private_endpoint_model(stack.location, stack.private_link_subnet_id, stack.private_endpoint_name,
+                                              stack.workspace_id, "databricks_ui_api")
+    plan = ProvisioningPlan(stack.name)
+    for change in [
+        _change("resource_group", "Microsoft.Resources/resourceGroups", f"/subscriptions/{sub}/resourceGroups/{rg}",
+                {"location": group.location} if group else None, {"location": stack.location}),
+        _change("nsg", "Microsoft.Network/networkSecurityGroups", stack.nsg_id,
+                _nsg_state(nsg) if nsg else None, _nsg_state(network_security_group_model(stack))),
+        _change("vnet", "Microsoft.Network/virtualNetworks", stack.vnet_id,
+                _vnet_state(vnet) if vnet else None, _vnet_state(virtual_network_model(stack, vnet))),
+        _change("workspace", "Microsoft.Databricks/workspaces", stack.workspace_id,
+                _workspace_state(workspace) if workspace else None, _workspace_body_state(workspace_model(stack))),
+        _change("dns_zone", "Microsoft.Network/privateDnsZones", dns_zone.zone_id,
+                _vnet_link_state(link) if zone and link else ({} if zone else None),
+                {"virtual_network": _id(stack.vnet_id), "registration_enabled": False}),
+        _change("private_endpoint", "Microsoft.Network/privateEndpoints", stack.private_endpoint_id,
+                _private_endpoint_state(private_endpoint) if private_endpoint else None,
+                _private_endpoint_state(desired_endpoint)),
+        _change("dns_zone_group", "Microsoft.Network/privateEndpoints/privateDnsZoneGroups",
+                f"{stack.private_endpoint_id}/privateDnsZoneGroups/default",
+                _zone_group_state(zone_group) if zone_group else None,
+                {"zones": [_id(dns_zone.zone_id)]}),
+    ]:
+        plan.changes[change.step] = change
+    return plan
@@ -0,0 +1,284 @@
+from dataclasses import dataclass, field, replace
+
+from AzureSdk import models
+
+DATABRICKS_SERVICE_NAME = "Microsoft.Databricks/workspaces"
+DEFAULT_PUBLIC_SUBNET_NAME = "databricks-source-public-subnet"
+DEFAULT_PRIVATE_SUBNET_NAME = "databricks-source-private-subnet"
+
+
+def resource_group_id(subscription_id, resource_group):
+    return f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+
+
+def network_resource_id(subscription_id, resource_group, resource_type, name):
+    return f"{resource_group_id(subscription_id, resource_group)}/providers/Microsoft.Network/{resource_type}/{name}"
+
+
+@dataclass
+class WorkspaceStack:
+    """Everything needed to stand up one VNet-injected workspace with a private endpoint."""
+    subscription_id: str
+    resource_group: str
+    location: str
+    workspace_name: str
+    vnet_name: str
+    public_subnet_name: str = DEFAULT_PUBLIC_SUBNET_NAME
+    private_subnet_name: str = DEFAULT_PRIVATE_SUBNET_NAME
+    private_link_subnet_name: str = "PrivateLink"
+    private_endpoint_name: str = None
+    nsg_name: str = "databricksnsg"
+    private_dns_zone_name: str = "privatelink.azuredatabricks.net"
+    address_space: str = "10.0.0.0/16"
+    default_subnet_prefix: str = "10.0.0.0/22"
+    public_subnet_prefix: str = "10.0.4.0/22"
+    private_subnet_prefix: str = "10.0.8.0/22"
+    private_link_subnet_prefix: str = "10.0.12.0/22"
+    # When set, SubnetAllocator sizes and places the subnets in the VNet's free space instead of the prefixes above.
+    max_cluster_nodes: int = None
+    # When set, pre-flight checks the vCPU quota for a cluster of max_cluster_nodes (at least two) of this size.
+    node_type_id: str = None
+    sku: str = "premium"
+    tags: dict = field(default_factory=lambda: {"environment": "development", "project": "databricks"})
+
+    def __post_init__(self):
+        if self.private_endpoint_name is None:
+            self.private_endpoint_name = f"{self.workspace_name}PE"
+
+    @property
+    def name(self):
+        return self.workspace_name
+
+    @property
+    def nsg_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "networkSecurityGroups", self.nsg_name)
+
+    @property
+    def vnet_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "virtualNetworks", self.vnet_name)
+
+    @property
+    def private_link_subnet_id(self):
+        return f"{self.vnet_id}/subnets/{self.private_link_subnet_name}"
+
+    @property
+    def private_endpoint_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "privateEndpoints", self.private_endpoint_name)
+
+    @property
+    def private_dns_zone_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "privateDnsZones", self.private_dns_zone_name)
+
+    @property
+    def workspace_id(self):
+        return (f"{resource_group_id(self.subscription_id, self.resource_group)}"
+                f"/providers/Microsoft.Databricks/workspaces/{self.workspace_name}")
+
+    @property
+    def managed_resource_group_id(self):
+        return resource_group_id(self.subscription_id, f"databricks-rg-{self.workspace_name}")
+
+
+@dataclass
+class StorageConnection:
+    """An ADLS Gen2 account to reach from a workspace VNet over a private endpoint."""
+    subscription_id: str
+    resource_group: str
+    location: str
+    storage_account_name: str
+    vnet_name: str
+    workspace_name: str
+    private_link_subnet_name: str = "PrivateLink"
+    private_endpoint_name: str = "adls-private-endpoint"
+    private_dns_zone_name: str = "privatelink.dfs.core.windows.net"
+    group_id: str = "dfs"
+    role_definition_name: str = "Storage Blob Data Contributor"
+
+    @property
+    def name(self):
+        return self.storage_account_name
+
+    @property
+    def vnet_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "virtualNetworks", self.vnet_name)
+
+    @property
+    def private_dns_zone_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "privateDnsZones", self.private_dns_zone_name)
+
+
+# Private DNS zone of each storage sub-resource a private endpoint can target.
+STORAGE_PRIVATE_DNS_ZONES = {
+    "dfs": "privatelink.dfs.core.windows.net",
+    "blob": "privatelink.blob.core.windows.net",
+    "file": "privatelink.file.core.windows.net",
+    "queue": "privatelink.queue.core.windows.net",
+    "table": "privatelink.table.core.windows.net",
+    "web": "privatelink.web.core.windows.net",
+}
+
+
+@dataclass
+class StorageAccountSet:
+    """Many storage accounts to reach from one workspace VNet, each over one private endpoint per sub-resource.
+
+    The accounts may live in any resource group of the subscription;
+    private endpoints, DNS zones and zone groups go in resource_group.
+    """
+    subscription_id: str
+    resource_group: str
+    location: str
+    vnet_name: str
+    workspace_name: str
+    storage_account_names: list
+    sub_resources: list = field(default_factory=lambda: ["dfs"])
+    private_link_subnet_name: str = "PrivateLink"
+    role_definition_name: str = "Storage Blob Data Contributor"
+
+    @property
+    def name(self):
+        return f"{self.workspace_name}-storage"
+
+    @property
+    def vnet_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "virtualNetworks", self.vnet_name)
+
+    def private_endpoint_name(self, storage_account_name, sub_resource):
+        return f"{storage_account_name}-{sub_resource}-private-endpoint"
+
+    def private_dns_zone_name(self, sub_resource):
+        return STORAGE_PRIVATE_DNS_ZONES[sub_resource]
+
+
+@dataclass
+class SourcePrivateEndpoint:
+    """A private endpoint from a query VNet to a workspace in another subscription."""
+    subscription_id: str
+    resource_group: str
+    location: str
+    vnet_name: str
+    remote_workspace_id: str
+    private_endpoint_name: str
+    private_link_subnet_name: str = "PrivateLink"
+    private_dns_zone_name: str = "privatelink.azuredatabricks.net"
+    # Without rights on the workspace's subscription, the connection waits for its owner's approval.
+    manual_approval: bool = False
+    request_message: str = None
+
+    @property
+    def name(self):
+        return self.private_endpoint_name
+
+    @property
+    def remote_subscription_id(self):
+        return self.remote_workspace_id.split("/")[2]
+
+    @property
+    def vnet_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "virtualNetworks", self.vnet_name)
+
+    @property
+    def private_link_subnet_id(self):
+        return f"{self.vnet_id}/subnets/{self.private_link_subnet_name}"
+
+    @property
+    def private_dns_zone_id(self):
+        return network_resource_id(self.subscription_id, self.resource_group, "privateDnsZones", self.private_dns_zone_name)
+
+
+def source_private_endpoints(request, remote_workspace_ids):
+    """One copy of request per remote workspace, each endpoint named after its workspace.
+
+    Workspaces that share a name in different resource groups get the
+    resource group in their endpoint name too.
+    """
+    names = [workspace_id.rstrip("/").split("/")[-1] for workspace_id in remote_workspace_ids]
+    requests = []
+    for workspace_id, workspace_name in zip(remote_workspace_ids, names):
+        suffix = workspace_name
+        if names.count(workspace_name) > 1:
+            suffix = f"{workspace_id.split('/')[4]}-{workspace_name}"
+        requests.append(replace(request, remote_workspace_id=workspace_id,
+                                private_endpoint_name=f"{request.private_endpoint_name}-{suffix}"))
+    return requests
+
+
+# Desired resource models
+def databricks_delegation():
+    network = models("network")
+    return [network.Delegation(name="databricksDelegation", service_name=DATABRICKS_SERVICE_NAME)]
+
+
+def network_security_group_model(stack):
+    network = models("network")
+    return network.NetworkSecurityGroup(location=stack.location)
+
+
+def virtual_network_model(stack, current=None):
+    """The stack's VNet. Given the current VNet, its other address prefixes and subnets are kept, so stacks can share it."""
+    network = models("network")
+    #  subnets with 1024 IP addresses by default
+    nsg = network.NetworkSecurityGroup(id=stack.nsg_id)
+    subnets = [network.Subnet(name="default", address_prefix=stack.default_subnet_prefix,
+                              network_security_group=nsg)]
+    if stack.default_subnet_prefix is None:
+        subnets = []
+    address_prefixes = [stack.address_space]
+    if current is not None:
+        address_prefixes = list(current.address_space.address_prefixes or [])
+        address_prefixes += [stack.address_space] if stack.address_space not in address_prefixes else []
+    vnet = network.VirtualNetwork(
+        location=stack.location,
+        address_space=network.AddressSpace(address_prefixes=address_prefixes),
+        subnets=subnets + [
+            network.Subnet(name=stack.public_subnet_name, address_prefix=stack.public_subnet_prefix,
+                           network_security_group=nsg, delegations=databricks_delegation()),
+            network.Subnet(name=stack.private_subnet_name, address_prefix=stack.private_subnet_prefix,
+                           network_security_group=nsg, delegations=databricks_delegation()),
+            network.Subnet(
+                name=stack.private_link_subnet_name,
+                address_prefix=stack.private_link_subnet_prefix,
+                network_security_group=nsg,
+                private_endpoint_network_policies="Disabled",
+                private_link_service_network_policies="Enabled"
+            ),
+        ]
+    )
+    if current is not None:
+        names = {subnet.name for subnet in vnet.subnets}
+        vnet.subnets += [subnet for subnet in current.subnets or [] if subnet.name not in names]
+    return vnet
+
+
+def workspace_model(stack):
+    return {
+        "location": stack.location,
+        "sku": {"name": stack.sku},
+        "properties": {
+            "managedResourceGroupId": stack.managed_resource_group_id,
+            "parameters": {
+                "enableNoPublicIp": {"value": True},
+                "customVirtualNetworkId": {"value": stack.vnet_id},
+                "customPublicSubnetName": {"value": stack.public_subnet_name},
+                "customPrivateSubnetName": {"value": stack.private_subnet_name},
+            }
+        },
+        "tags": dict(stack.tags)
+    }
+
+
+def private_endpoint_model(location, subnet_id, connection_name, target_id, group_id, manual_approval=False,
+                           request_message=None):
+    """A private endpoint to target_id; with manual_approval, the target's owner has to approve the connection."""
+    network = models("network")
+    connection = network.PrivateLinkServiceConnection(
+        name=connection_name,
+        private_link_service_id=target_id,
+        group_ids=[group_id],
+        request_message=request_message if manual_approval else None
+    )
+    if manual_approval:
+        return network.PrivateEndpoint(location=location, subnet=network.Subnet(id=subnet_id),
+                                       manual_private_link_service_connections=[connection])
+    return network.PrivateEndpoint(location=location, subnet=network.Subnet(id=subnet_id),
+                                   private_link_service_connections=[connection])
@@ -0,0 +1,278 @@
+from dataclasses import dataclass
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from ArmTemplates import (
+    RESOURCE_GROUP_TYPE,
+    NSG_TYPE,
+    VNET_TYPE,
+    SUBNET_TYPE,
+    WORKSPACE_TYPE,
+    PRIVATE_ENDPOINT_TYPE,
+    PRIVATE_DNS_ZONE_TYPE,
+    VNET_LINK_TYPE,
+    DNS_ZONE_GROUP_TYPE,
+    RESOURCE_API_VERSIONS,
+    default_dns_zone,
+)
+from ProvisioningGraph import ProvisioningGraph
+from ProvisioningSpecs import resource_group_id
+from ProvisioningTrace import get_tracer
+from SubnetAllocator import stack_subnet_names
+
+# A resource of the key type is only deleted once every target of the listed types is gone:
+# the reverse of the order the resources are provisioned in.
+DELETE_AFTER = {
+    PRIVATE_ENDPOINT_TYPE: [DNS_ZONE_GROUP_TYPE],
+    WORKSPACE_TYPE: [PRIVATE_ENDPOINT_TYPE],
+    PRIVATE_DNS_ZONE_TYPE: [VNET_LINK_TYPE, DNS_ZONE_GROUP_TYPE],
+    SUBNET_TYPE: [WORKSPACE_TYPE, PRIVATE_ENDPOINT_TYPE],
+    VNET_TYPE: [WORKSPACE_TYPE, PRIVATE_ENDPOINT_TYPE, VNET_LINK_TYPE, SUBNET_TYPE],
+    NSG_TYPE: [VNET_TYPE, SUBNET_TYPE],
+}
+CHILD_TYPES = (VNET_LINK_TYPE, DNS_ZONE_GROUP_TYPE, SUBNET_TYPE)
+# Step that finds which shared targets other stacks still use, before any of them is deleted.
+USAGE_STEP = "shared_usage"
+
+
+@dataclass
+class TeardownTarget:
+    """A resource to delete.
+
+    A shared target may be used by other stacks and is deleted only when
+    nothing outside the teardown still uses it; a target with keep_with
+    set is kept whenever the target with that ID is.
+    """
+    resource_type: str
+    resource_id: str
+    shared: bool = False
+    keep_with: str = None
+
+    @property
+    def name(self):
+        segments = self.resource_id.split("/")
+        if self.resource_type in CHILD_TYPES:
+            return f"{segments[-3]}/{segments[-1]}"
+        return segments[-1]
+
+    @property
+    def step(self):
+        return f"{self.resource_type.split('/')[-1]}:{self.name}"
+
+
+@dataclass
+class TeardownRequest:
+    """The resources to delete for one stack."""
+    name: str
+    subscription_id: str
+    resource_group: str
+    targets: list
+
+
+def shared_resource_ids(stack, others):
+    """Lower-cased IDs of the resource group, NSG, VNet and private DNS zone stack has in common with the others."""
+    shared = set()
+    for other in others:
+        if other.subscription_id.lower() != stack.subscription_id.lower():
+            continue
+        # The registry reuses one zone of a name per subscription, wherever it lives.
+        if other.private_dns_zone_name.lower() == stack.private_dns_zone_name.lower():
+            shared.add(stack.private_dns_zone_id.lower())
+        if other.resource_group.lower() != stack.resource_group.lower():
+            continue
+        shared.add(resource_group_id(stack.subscription_id, stack.resource_group).lower())
+        for resource_id in (stack.nsg_id, stack.vnet_id):
+            if resource_id.lower() in (other.nsg_id.lower(), other.vnet_id.lower()):
+                shared.add(resource_id.lower())
+    return shared
+
+
+def workspace_stack_teardown(stack, keep_resource_group=False, dns_zone=None, created=()):
+    """Everything a WorkspaceStack deploys, with its resource group unless keep_resource_group is set.
+
+    The stack owns its workspace, private endpoint and workspace subnets.
+    The VNet, NSG and DNS zone may serve other stacks, so they are shared
+    targets, and the PrivateLink and default subnets and the VNet's zone
+    link go only with the VNet. dns_zone is the registry's placement of
+    the zone; without one, the zone is taken to be in the stack's group.
+    The zone is only a target when its lower-cased ID is in created, the
+    resources the journal records this tool creating: a zone that was
+    already there, such as a central one, is left alone.
+    """
+    dns_zone = dns_zone or default_dns_zone(stack.private_dns_zone_id)
+    subnets = [f"{stack.vnet_id}/subnets/{name}" for name in stack_subnet_names(stack).values()]
+    vnet_subnets = [f"{stack.vnet_id}/subnets/{stack.private_link_subnet_name}"]
+    if stack.max_cluster_nodes is None and stack.default_subnet_prefix is not None:
+        vnet_subnets.append(f"{stack.vnet_id}/subnets/default")
+    targets = [
+        TeardownTarget(DNS_ZONE_GROUP_TYPE, f"{stack.private_endpoint_id}/privateDnsZoneGroups/default"),
+        TeardownTarget(PRIVATE_ENDPOINT_TYPE, stack.private_endpoint_id),
+        TeardownTarget(WORKSPACE_TYPE, stack.workspace_id),
+        *[TeardownTarget(SUBNET_TYPE, subnet_id) for subnet_id in subnets],
+        *[TeardownTarget(SUBNET_TYPE, subnet_id, keep_with=stack.vnet_id) for subnet_id in vnet_subnets],
+        TeardownTarget(VNET_LINK_TYPE, dns_zone.link_id, keep_with=stack.vnet_id),
+        TeardownTarget(VNET_TYPE, stack.vnet_id, shared=True),
+        TeardownTarget(NSG_TYPE, stack.nsg_id, shared=True),
+    ]
+    if dns_zone.zone_id.lower() in created:
+        targets.append(TeardownTarget(PRIVATE_DNS_ZONE_TYPE, dns_zone.zone_id, shared=True))
+    if not keep_resource_group:
+        targets.append(TeardownTarget(RESOURCE_GROUP_TYPE, resource_group_id(stack.subscription_id, stack.resource_group)))
+    return TeardownRequest(stack.name, stack.subscription_id, stack.resource_group, targets)
+
+
+async def externally_linked_zones(clients, subscription_id, resource_group):
+    """Names of the private DNS zones in the resource group that VNets in other resource groups link to.
+
+    Deleting the group would take those zones away from the other VNets.
+    """
+    dns = clients.private_dns(subscription_id)
+    group_id = resource_group_id(subscription_id, resource_group)
+    try:
+        zones = [zone async for zone in dns.private_zones.list_by_resource_group(resource_group)]
+    except ResourceNotFoundError:
+        return []
+    linked = []
+    for zone in zones:
+        async for link in dns.virtual_network_links.list(resource_group, zone.name):
+            if not _inside(link.virtual_network.id, group_id):
+                linked.append(zone.name)
+                break
+    return linked
+
+
+def _inside(resource_id, group_id):
+    return resource_id.lower().startswith(group_id.lower() + "/")
+
+
+def prune_targets(targets):
+    """Drop targets that a resource group delete in the same teardown removes anyway."""
+    groups = [t.resource_id for t in targets if t.resource_type == RESOURCE_GROUP_TYPE]
+    return [t for t in targets if not any(_inside(t.resource_id, group) for group in groups)]
+
+
+def deleted_resources(request, report):
+    """Lower-cased IDs of the targets a teardown run removed, directly or with their resource group."""
+    deleted = {t.resource_id.lower() for t in request.targets
+               if report.timings.get(t.step) is not None and report.timings[t.step].status == "succeeded"
+               and report.results.get(t.step) is not None}
+    groups = [resource_id for resource_id in deleted if "/providers/" not in resource_id]
+    return deleted | {t.resource_id.lower() for t in request.targets
+                      if any(_inside(t.resource_id, group) for group in groups)}
+
+
+async def _get_by_id(clients, subscription_id, target):
+    try:
+        return await clients.resource(subscription_id).resources.get_by_id(
+            target.resource_id, RESOURCE_API_VERSIONS[target.resource_type])
+    except ResourceNotFoundError:
+        return None
+
+
+async def shared_in_use(clients, request, targets):
+    """Lower-cased IDs of the targets to keep: shared ones something outside the teardown uses, and their keep_with.
+
+    VNets are kept while they have subnets the teardown does not delete,
+    DNS zones while they have links it does not delete, and NSGs while a
+    subnet it does not delete is attached to them.
+    """
+    sub = request.subscription_id
+    keep = set()
+
+    def deleting():
+        return {t.resource_id.lower() for t in targets if t.resource_id.lower() not in keep}
+
+    def keep_dependents():
+        keep.update(t.resource_id.lower() for t in targets if t.keep_with and t.keep_with.lower() in keep)
+
+    for target in [t for t in targets if t.shared and t.resource_type == VNET_TYPE]:
+        vnet = await _get_by_id(clients, sub, target)
+        subnets = [f"{target.resource_id}/subnets/{subnet['name']}".lower()
+                   for subnet in (vnet.properties.get("subnets") or [] if vnet is not None else [])]
+        if any(subnet not in deleting() for subnet in subnets):
+            keep.add(target.resource_id.lower())
+    keep_dependents()
+    dns = None
+    for target in [t for t in targets if t.shared and t.resource_type == PRIVATE_DNS_ZONE_TYPE]:
+        dns = dns or clients.private_dns(sub)
+        segments = target.resource_id.split("/")
+        try:
+            links = [link.id.lower() async for link in dns.virtual_network_links.list(segments[4], segments[-1])]
+        except ResourceNotFoundError:
+            links = []
+        if any(link not in deleting() for link in links):
+            keep.add(target.resource_id.lower())
+    for target in [t for t in targets if t.shared and t.resource_type == NSG_TYPE]:
+        nsg = await _get_by_id(clients, sub, target)
+        subnets = [subnet["id"].lower() for subnet in (nsg.properties.get("subnets") or [] if nsg is not None else [])]
+        if any(subnet not in deleting() for subnet in subnets):
+            keep.add(target.resource_id.lower())
+    keep_dependents()
+    return keep
+
+
+def build_teardown_graph(clients, request, no_wait=False):
+    """Declare one delete per target, ordered by DELETE_AFTER, so independent deletes run side by side.
+
+    With no_wait, deletes that no other delete waits on are only started
+    and their pollers are returned as the step outputs; deletes that
+    others depend on are still awaited. Shared targets still in use are
+    kept, and their steps return None.
+    """
+    sub = request.subscription_id
+    resources = clients.resource(sub)
+    targets = prune_targets(request.targets)
+    conditional = any(target.shared or target.keep_with for target in targets)
+    depends_on = {
+        target.step: [other.step for other in targets
+                      if other.resource_type in DELETE_AFTER.get(target.resource_type, [])]
+                     + ([USAGE_STEP] if target.shared or target.keep_with else [])
+        for target in targets
+    }
+    waited_on = {dep for deps in depends_on.values() for dep in deps}
+
+    async def find_shared_in_use(deps):
+        return await shared_in_use(clients, request, targets)
+
+    async def begin_delete(target, polling):
+        if target.resource_type == RESOURCE_GROUP_TYPE:
+            return await resources.resource_groups.begin_delete(target.name, polling=polling)
+        return await resources.resources.begin_delete_by_id(
+            target.resource_id, RESOURCE_API_VERSIONS[target.resource_type], polling=polling)
+
+    def delete(target):
+        async def run(deps):
+            if target.resource_id.lower() in deps.get(USAGE_STEP, ()):
+                print(f"[{request.name}] Keeping {target.resource_type}: {target.name}, still used by other stacks")
+                return None
+            print(f"[{request.name}] Deleting {target.resource_type}: {target.name}")
+            await clients.throttle(sub)
+            with get_tracer().span(f"delete {target.name}", kind="lro", resource_type=target.resource_type):
+                try:
+                    polling = clients.polling(target.resource_type, "begin_delete")
+                    if target.resource_type == SUBNET_TYPE:
+                        # Stacks sharing the VNet merge their subnets into it under this lock.
+                        async with clients.lock(target.resource_id.rsplit("/subnets/", 1)[0].lower()):
+                            await (await begin_delete(target, polling)).result()
+                    else:
+                        poller = await begin_delete(target, polling)
+                        if no_wait and target.step not in waited_on:
+                            return poller
+                        await poller.result()
+                except ResourceNotFoundError:
+                    pass
+            print(f"[{request.name}] Deleted {target.resource_type}: {target.name}")
+            return target.resource_id
+        return run
+
+    graph = ProvisioningGraph(f"{request.name} teardown")
+    if conditional:
+        graph.add_step(USAGE_STEP, find_shared_in_use)
+    # Declare steps in dependency order; DELETE_AFTER is acyclic, so every pass adds at least one.
+    remaining = {target.step: target for target in targets}
+    while remaining:
+        for step, target in list(remaining.items()):
+            if all(dep in graph.steps for dep in depends_on[step]):
+                graph.add_step(step, delete(target), depends_on=depends_on[step])
+                del remaining[step]
+    return graph
@@ -0,0 +1,252 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+
+TRACE_SCHEMA = "provisioning-trace/1"
+# Write the trace as JSON to this path when a script finishes.
+TRACE_FILE_ENV = "PROVISIONING_TRACE_FILE"
+# The standard OpenTelemetry variable; when set, spans are also exported over OTLP/HTTP.
+OTLP_ENDPOINT_ENV = "OTEL_EXPORTER_OTLP_ENDPOINT"
+RETRIED_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+CORRELATION_HEADERS = ("x-ms-correlation-request-id", "x-request-id")
+
+_current_span = contextvars.ContextVar("provisioning_span", default=None)
+
+
+@dataclass
+class Span:
+    """A timed unit of work: a script, a graph, a step, a long-running operation or a wait."""
+    name: str
+    kind: str
+    span_id: str
+    parent_id: str = None
+    start: float = 0.0
+    end: float = None
+    status: str = "ok"
+    error: str = None
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def add(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+class Tracer:
+    """Collects the spans of one script run.
+
+    Spans nest through a context variable, so steps running as asyncio
+    tasks or on worker threads attach to the span that started them, and
+    HTTP activity is attributed to whichever span is current.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, kind="internal", **attributes):
+        parent = _current_span.get()
+        span = Span(name, kind, uuid.uuid4().hex[:16], parent.span_id if parent else None, time.time(),
+                    attributes=dict(attributes))
+        with self._lock:
+            self.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = str(e) or type(e).__name__
+            raise
+        finally:
+            span.end = time.time()
+            _current_span.reset(token)
+
+    def to_dict(self):
+        return {
+            "schema": TRACE_SCHEMA,
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+    def export_otlp(self, endpoint):
+        """Replay the spans into the OpenTelemetry SDK and export them over OTLP/HTTP."""
+        try:
+            from opentelemetry import trace
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        except ImportError:
+            raise ImportError("OTLP export needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http")
+
+        provider = TracerProvider(resource=Resource.create({"service.name": self.name}))
+        provider.add_span_processor(SimpleSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces")))
+        otel_tracer = provider.get_tracer("provisioning")
+        exported = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            parent = exported.get(span.parent_id)
+            context = trace.set_span_in_context(parent) if parent is not None else None
+            otel_span = otel_tracer.start_span(span.name, context=context, start_time=int(span.start * 1e9),
+                                               attributes={"provisioning.kind": span.kind, **_otel_attributes(span)})
+            if span.status == "error":
+                otel_span.set_status(trace.Status(trace.StatusCode.ERROR, span.error))
+            exported[span.span_id] = otel_span
+        # End children before parents so every parent is still open when its children are exported.
+        for span in sorted(self.spans, key=lambda s: s.end or s.start):
+            exported[span.span_id].end(end_time=int((span.end or time.time()) * 1e9))
+        provider.shutdown()
+
+    def print_summary(self):
+        """One row per graph, step, LRO and wait span, plus totals."""
+        rows = [span for span in self.spans if span.kind != "script"]
+        if not rows:
+            return
+        t0 = min(span.start for span in self.spans)
+        print(f"\nTrace summary: {self.name} ({self.trace_id})")
+        print(f"{'Span':<44}{'Kind':<8}{'Start':>8}{'Duration':>10}{'Requests':>10}{'Polls':>7}"
+              f"{'Retries':>9}{'Bytes':>10}  Status")
+        for span in rows:
+            depth = self._depth(span)
+            attributes = span.attributes
+            label = ("  " * depth + span.name)[:43]
+            print(f"{label:<44}{span.kind:<8}{span.start - t0:>7.1f}s{span.duration:>9.1f}s"
+                  f"{attributes.get('http.requests', 0):>10}{attributes.get('lro.polls', 0):>7}"
+                  f"{attributes.get('http.retries', 0):>9}"
+                  f"{attributes.get('http.bytes_sent', 0) + attributes.get('http.bytes_received', 0):>10}"
+                  f"  {span.status}")
+        totals = {key: sum(span.attributes.get(key, 0) for span in self.spans)
+                  for key in ("http.requests", "lro.polls", "http.throttled", "http.retries",
+                              "lro.scheduled_polls", "lro.default_polls", "lro.seconds_saved")}
+        print(f"Requests: {totals['http.requests']} | Polls: {totals['lro.polls']} | "
+              f"Throttled: {totals['http.throttled']} | Retries: {totals['http.retries']}")
+        if totals["lro.default_polls"]:
+            saved = totals["lro.default_polls"] - totals["lro.scheduled_polls"]
+            print(f"LRO polls: {totals['lro.scheduled_polls']} vs. ~{totals['lro.default_polls']} at the SDK's default "
+                  f"cadence ({saved} saved), finishing {totals['lro.seconds_saved']:.1f}s sooner in total")
+
+    def _depth(self, span):
+        by_id = {s.span_id: s for s in self.spans}
+        depth = 0
+        while span.parent_id in by_id and by_id[span.parent_id].kind != "script":
+            span = by_id[span.parent_id]
+            depth += 1
+        return depth
+
+
+def _otel_attributes(span):
+    attributes = {}
+    for key, value in span.attributes.items():
+        attributes[key] = list(value) if isinstance(value, (list, set, tuple)) else value
+    return attributes
+
+
+_tracer = Tracer("provisioning")
+_script_span = None
+
+
+def get_tracer():
+    return _tracer
+
+
+def current_span():
+    return _current_span.get()
+
+
+def lro_span_name(begin_operation, args):
+    """e.g. "VirtualNetworks.begin_create_or_update vnet01" for a bound operations method and its arguments."""
+    owner = getattr(begin_operation, "__self__", None)
+    group = type(owner).__name__.replace("Operations", "") if owner is not None else ""
+    name = f"{group}.{begin_operation.__name__}" if group else begin_operation.__name__
+    resource = next((arg for arg in reversed(args[:2]) if isinstance(arg, str)), None)
+    return f"{name} {resource.split('/')[-1]}" if resource else name
+
+
+def start_tracing(name):
+    """Start a fresh trace for a script; every span until finish_tracing() nests under it."""
+    global _tracer, _script_span
+    _tracer = Tracer(name)
+    _script_span = _tracer.span(name, kind="script")
+    _script_span.__enter__()
+    return _tracer
+
+
+def finish_tracing(exit_code=0):
+    """Close the script span, print the summary and export to the configured JSON file and OTLP endpoint."""
+    global _script_span
+    if _script_span is not None:
+        root = _current_span.get()
+        if root is not None and exit_code:
+            root.status = "error"
+        _script_span.__exit__(None, None, None)
+        _script_span = None
+    _tracer.print_summary()
+    trace_file = os.environ.get(TRACE_FILE_ENV)
+    if trace_file:
+        _tracer.write_json(trace_file)
+        print(f"Trace written to {trace_file}")
+    otlp_endpoint = os.environ.get(OTLP_ENDPOINT_ENV)
+    if otlp_endpoint:
+        _tracer.export_otlp(otlp_endpoint)
+    return exit_code
+
+
+def record_http(method, status_code, headers, bytes_sent, bytes_received):
+    """Attribute one HTTP attempt to the current span."""
+    span = _current_span.get()
+    if span is None:
+        return
+    span.add("http.requests")
+    span.add("http.bytes_sent", bytes_sent)
+    span.add("http.bytes_received", bytes_received)
+    if span.kind == "lro" and method == "GET":
+        span.add("lro.polls")
+    if status_code == 429:
+        span.add("http.throttled")
+    if status_code in RETRIED_STATUS_CODES:
+        span.add("http.retries")
+    for header in CORRELATION_HEADERS:
+        value = headers.get(header)
+        if value:
+            ids = span.attributes.setdefault("correlation_ids", [])
+            if value not in ids:
+                ids.append(value)
+
+
+def content_length(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+class HttpTracingPolicy(SansIOHTTPPolicy):
+    """Per-retry azure-core policy that records every attempt, including throttled ones, on the current span."""
+
+    def on_response(self, request, response):
+        http_request, http_response = request.http_request, response.http_response
+        record_http(http_request.method, http_response.status_code, http_response.headers,
+                    content_length(http_request.body), int(http_response.headers.get("Content-Length") or 0))
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import sys
+import time
+
+from AsyncProvisioning import AsyncAzureClients, ProvisioningResult, provision_workspaces
+from ConfigFiles import load_document
+from FleetProvisioning import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_PER_SUBSCRIPTION_LIMIT,
+    DEFAULT_WRITES_PER_HOUR,
+    load_manifest,
+    print_fleet_results,
+)
+from ProvisioningJournal import ProvisioningJournal, DEFAULT_JOURNAL_PATH
+from ProvisioningTrace import get_tracer, start_tracing, finish_tracing
+
+DEFAULT_PER_REGION_LIMIT = 4
+# Seconds between two lines of the progress view; a line is only printed when something changed.
+DEFAULT_REFRESH_SECONDS = 10.0
+
+
+class RolloutHalted(Exception):
+    """A stack was not provisioned because an earlier wave failed."""
+
+    def __init__(self, wave, failures):
+        super().__init__(f"rollout halted after wave {wave} ({failures} failed)")
+        self.wave = wave
+        self.failures = failures
+
+
+def load_waves(path):
+    """The manifest's rollout.waves, a list of region lists; [] when it has none."""
+    manifest = load_document(path)
+    return parse_waves((manifest.get("rollout") or {}).get("waves", []))
+
+
+def parse_waves(waves):
+    """Normalise waves given as "uksouth" / "ukwest,northeurope" strings or lists to lists of lower-case regions."""
+    parsed = []
+    for wave in waves:
+        regions = wave.split(",") if isinstance(wave, str) else wave
+        parsed.append([region.strip().lower() for region in regions if region.strip()])
+    return [wave for wave in parsed if wave]
+
+
+def plan_waves(stacks, waves):
+    """Group the stacks into waves by location; with no waves, each region is its own wave, in manifest order.
+
+    Raises ValueError when a stack's region is in no wave, or a region is
+    in more than one.
+    """
+    by_region = {}
+    for stack in stacks:
+        by_region.setdefault(stack.location.lower(), []).append(stack)
+    if not waves:
+        waves = [[region] for region in by_region]
+    seen = set()
+    for wave in waves:
+        for region in wave:
+            if region in seen:
+                raise ValueError(f"Region {region} is in more than one wave")
+            seen.add(region)
+    missing = sorted(set(by_region) - seen)
+    if missing:
+        raise ValueError(f"Stacks in {', '.join(missing)} are in no rollout wave")
+    return [[stack for region in wave for stack in by_region.get(region, [])] for wave in waves]
+
+
+class RolloutProgress:
+    """Per-region counts of pending, running, succeeded and failed stacks, fed by run_graphs."""
+
+    def __init__(self, stacks):
+        self.regions = {}
+        for stack in stacks:
+            counts = self.regions.setdefault(stack.location.lower(), {"pending": 0, "running": 0, "succeeded": 0,
+                                                                      "failed": 0})
+            counts["pending"] += 1
+        self.wave = None
+        self.started_at = time.monotonic()
+        self.changed = True
+
+    def started(self, stack):
+        counts = self.regions[stack.location.lower()]
+        counts["pending"] -= 1
+        counts["running"] += 1
+        self.changed = True
+
+    def finished(self, stack, result):
+        counts = self.regions[stack.location.lower()]
+        if counts["running"]:
+            counts["running"] -= 1
+        else:
+            # Stacks that fail pre-flight never start.
+            counts["pending"] -= 1
+        counts["succeeded" if result.succeeded else "failed"] += 1
+        self.changed = True
+
+    def line(self):
+        """One line for the whole rollout: each region as done/total, with running and failed counts."""
+        parts = []
+        for region, counts in self.regions.items():
+            total = sum(counts.values())
+            part = f"{region} {counts['succeeded'] + counts['failed']}/{total}"
+            if counts["running"]:
+                part += f" ({counts['running']} running)"
+            if counts["failed"]:
+                part += f" [{counts['failed']} failed]"
+            parts.append(part)
+        elapsed = time.monotonic() - self.started_at
+        return f"[rollout {elapsed:>5.0f}s wave {self.wave}] " + " | ".join(parts)
+
+    async def show(self, refresh=DEFAULT_REFRESH_SECONDS):
+        """Print line() every refresh seconds while something changes; run as a task and cancel it when done."""
+        while True:
+            if self.changed:
+                self.changed = False
+                print(self.line(), flush=True)
+            await asyncio.sleep(refresh)
+
+
+async def run_rollout(waves, max_concurrency=DEFAULT_MAX_CONCURRENCY, per_region_limit=DEFAULT_PER_REGION_LIMIT,
+                      per_subscription_limit=DEFAULT_PER_SUBSCRIPTION_LIMIT, writes_per_hour=DEFAULT_WRITES_PER_HOUR,
+                      max_failures=0, bake_seconds=0, rollback_on_failure=False, single_deployment=False,
+                      journal=None, resume=False, preflight=True, refresh=DEFAULT_REFRESH_SECONDS, clients=None):
+    """Provision the waves one after another and return (results per wave, elapsed seconds).
+
+    The first wave is the canary: any failure in it halts the rollout.
+    Later waves halt it when more than max_failures of their stacks fail.
+    Stacks in waves that never ran get a RolloutHalted error. One client
+    set, and so one ARM write budget, is shared by every wave.
+    """
+    if clients is None:
+        async with AsyncAzureClients(max_connections=max_concurrency * 4, writes_per_hour=writes_per_hour) as clients:
+            return await run_rollout(waves, max_concurrency, per_region_limit, per_subscription_limit, writes_per_hour,
+                                     max_failures, bake_seconds, rollback_on_failure, single_deployment, journal,
+                                     resume, preflight, refresh, clients)
+    start = time.monotonic()
+    progress = RolloutProgress([stack for wave in waves for stack in wave])
+    view = asyncio.create_task(progress.show(refresh))
+    wave_results = []
+    halted = None
+    try:
+        for number, stacks in enumerate(waves, 1):
+            if halted is not None:
+                wave_results.append([ProvisioningResult(stack.name, error=halted) for stack in stacks])
+                continue
+            regions = sorted({stack.location.lower() for stack in stacks})
+            label = "canary" if number == 1 else f"wave {number}"
+            print(f"Starting {label}: {len(stacks)} stacks in {', '.join(regions)}...")
+            progress.wave = number
+            with get_tracer().span(f"rollout wave {number}", kind="step") as span:
+                span.set("rollout.regions", ",".join(regions))
+                span.set("rollout.stacks", len(stacks))
+                results = await provision_workspaces(stacks, max_concurrency, rollback_on_failure, clients,
+                                                     per_subscription_limit, single_deployment=single_deployment,
+                                                     journal=journal, resume=resume, preflight=preflight,
+                                                     per_region_limit=per_region_limit, progress=progress)
+                failures = sum(1 for result in results if not result.succeeded)
+                span.set("rollout.failed", failures)
+            wave_results.append(results)
+            if failures > (0 if number == 1 else max_failures):
+                halted = RolloutHalted(number, failures)
+                print(f"Halting rollout: {failures} stacks failed in {label}.")
+            elif bake_seconds and number < len(waves):
+                print(f"{label} succeeded; baking for {bake_seconds:.0f}s before the next wave...")
+                await asyncio.sleep(bake_seconds)
+    finally:
+        view.cancel()
+    print(progress.line())
+    return wave_results, time.monotonic() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provision the stacks of a manifest region by region, canary first.")
+    parser.add_argument("manifest", help="YAML or JSON manifest of workspace stacks")
+    parser.add_argument("--waves", nargs="+", metavar="REGIONS",
+                        help="comma-separated regions per wave, canary first (default: the manifest's rollout.waves, "
+                             "else one wave per region in manifest order)")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="stacks provisioned at the same time across all regions")
+    parser.add_argument("--per-region", type=int, default=DEFAULT_PER_REGION_LIMIT,
+                        help="stacks provisioned at the same time in one region")
+    parser.add_argument("--per-subscription", type=int, default=DEFAULT_PER_SUBSCRIPTION_LIMIT,
+                        help="stacks provisioned at the same time in one subscription")
+    parser.add_argument("--writes-per-hour", type=int, default=DEFAULT_WRITES_PER_HOUR,
+                        help="ARM write budget per subscription, shared by every wave")
+    parser.add_argument("--max-failures", type=int, default=0,
+                        help="failed stacks a wave after the canary may have before the rollout halts")
+    parser.add_argument("--bake", type=float, default=0, help="seconds to wait after a wave before starting the next")
+    parser.add_argument("--refresh", type=float, default=DEFAULT_REFRESH_SECONDS,
+                        help="seconds between progress lines")
+    parser.add_argument("--rollback", action="store_true", help="delete the resources failed stacks created in this run")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH, help="checkpoint journal of completed steps")
+    parser.add_argument("--resume", action="store_true", help="skip steps the journal records as completed")
+    parser.add_argument("--skip-preflight", action="store_true",
+                        help="provision without running the pre-flight checks")
+    parser.add_argument("--single-deployment", action="store_true", help="deploy each stack as one ARM template")
+    args = parser.parse_args(argv)
+
+    stacks = load_manifest(args.manifest)
+    waves = plan_waves(stacks, parse_waves(args.waves) if args.waves else load_waves(args.manifest))
+    start_tracing("RegionalRollout")
+    print(f"Rolling out {len(stacks)} stacks from {args.manifest} in {len(waves)} waves...")
+    wave_results, elapsed = asyncio.run(run_rollout(waves, args.max_concurrency, args.per_region, args.per_subscription,
+                                                    args.writes_per_hour, args.max_failures, args.bake, args.rollback,
+                                                    args.single_deployment, ProvisioningJournal(args.journal),
+                                                    args.resume, not args.skip_preflight, args.refresh))
+    ordered = [stack for wave in waves for stack in wave]
+    results = [result for results in wave_results for result in results]
+    print_fleet_results(ordered, results, elapsed)
+    return finish_tracing(0 if all(result.succeeded for result in results) else 1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
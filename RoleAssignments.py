@@ -0,0 +1,147 @@
+import asyncio
+import uuid
+from dataclasses import dataclass
+
+from azure.core.exceptions import HttpResponseError
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+
+@dataclass(frozen=True)
+class RoleGrant:
+    """A role a principal should hold on a scope, such as a storage account."""
+    subscription_id: str
+    scope: str
+    principal_id: str
+    role_definition_name: str
+    principal_type: str = "ServicePrincipal"
+
+
+@dataclass
+class GrantResult:
+    grant: RoleGrant
+    assignment_id: str = None
+    created: bool = False
+    error: Exception = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+def assignment_name(scope, principal_id, role_definition_id):
+    """The same GUID for the same grant on every run, so a re-run updates instead of duplicating."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{scope}|{principal_id}|{role_definition_id.split('/')[-1]}".lower()))
+
+
+def _role_key(role_definition_id):
+    # The same role definition is reported under subscription and tenant scopes; its GUID is what matters.
+    return role_definition_id.split("/")[-1].lower()
+
+
+class RoleAssignmentReconciler:
+    """Grants roles, creating only the assignments that are missing.
+
+    Role definitions are looked up once per subscription and name, and the
+    assignments of a scope are listed once; both lookups are shared by
+    concurrent callers. An assignment of the same role to the same
+    principal at the scope or above it counts as granted.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self._role_definitions = {}
+        self._assignments = {}
+
+    def _once(self, cache, key, lookup):
+        if key not in cache:
+            cache[key] = asyncio.ensure_future(lookup())
+        return cache[key]
+
+    async def role_definition_id(self, subscription_id, role_definition_name):
+        async def lookup():
+            async for definition in self.clients.authorization(subscription_id).role_definitions.list(
+                    scope=f"/subscriptions/{subscription_id}", filter=f"roleName eq '{role_definition_name}'"):
+                return definition.id
+            raise ValueError(f"Role definition not found: {role_definition_name}")
+
+        return await self._once(self._role_definitions, (subscription_id, role_definition_name), lookup)
+
+    async def assignments(self, subscription_id, scope):
+        """{(principal ID, role definition GUID): assignment ID} for the scope, including inherited assignments."""
+        async def lookup():
+            found = {}
+            async for assignment in self.clients.authorization(subscription_id).role_assignments.list_for_scope(
+                    scope, filter="atScope()"):
+                found[(assignment.principal_id.lower(), _role_key(assignment.role_definition_id))] = assignment.id
+            return found
+
+        return await self._once(self._assignments, scope.lower(), lookup)
+
+    async def lookup(self, grant):
+        """(role definition ID, ID of an assignment that already grants it at the scope or above, or None)."""
+        role_definition_id, existing = await asyncio.gather(
+            self.role_definition_id(grant.subscription_id, grant.role_definition_name),
+            self.assignments(grant.subscription_id, grant.scope),
+        )
+        return role_definition_id, existing.get((grant.principal_id.lower(), _role_key(role_definition_id)))
+
+    async def _find_existing(self, grant, role_definition_id):
+        """The ID of the assignment of the role to the principal at the scope, read fresh; None if there is none."""
+        async for assignment in self.clients.authorization(grant.subscription_id).role_assignments.list_for_scope(
+                grant.scope, filter=f"principalId eq '{grant.principal_id}'"):
+            if _role_key(assignment.role_definition_id) == _role_key(role_definition_id):
+                return assignment.id
+        return None
+
+    async def ensure(self, grant, label=None):
+        """Return (assignment ID, created) for the grant, creating the assignment only when it is missing."""
+        label = label or grant.principal_id
+        role_definition_id, assignment_id = await self.lookup(grant)
+        if assignment_id is not None:
+            print(f"[{label}] {grant.role_definition_name} is already granted on {grant.scope.split('/')[-1]}.")
+            return assignment_id, False
+        existing = await self.assignments(grant.subscription_id, grant.scope)
+        key = (grant.principal_id.lower(), _role_key(role_definition_id))
+
+        name = assignment_name(grant.scope, grant.principal_id, role_definition_id)
+        await self.clients.throttle(grant.subscription_id)
+        try:
+            assignment = await self.clients.authorization(grant.subscription_id).role_assignments.create(
+                grant.scope,
+                name,
+                {
+                    "principal_id": grant.principal_id,
+                    "role_definition_id": role_definition_id,
+                    "principal_type": grant.principal_type,
+                }
+            )
+        except HttpResponseError as e:
+            # Another run granted it between our listing and the create, most likely under another name.
+            if e.status_code != 409:
+                raise
+            assignment_id = await self._find_existing(grant, role_definition_id)
+            if assignment_id is None:
+                raise
+            existing[key] = assignment_id
+            return assignment_id, False
+        existing[key] = assignment.id
+        return assignment.id, True
+
+    async def reconcile(self, grants, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """Ensure every grant, max_concurrency at a time; returns one GrantResult per grant."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def ensure_one(grant):
+            async with semaphore:
+                try:
+                    assignment_id, created = await self.ensure(grant)
+                    return GrantResult(grant, assignment_id, created)
+                except Exception as e:
+                    return GrantResult(grant, error=e)
+
+        results = await asyncio.gather(*(ensure_one(grant) for grant in grants))
+        created = sum(result.created for result in results)
+        failed = sum(not result.succeeded for result in results)
+        print(f"Role grants: {created} created, {len(results) - created - failed} already in place, {failed} failed.")
+        return results
@@ -0,0 +1,204 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+
+from ProvisioningTrace import get_tracer
+
+DEFAULT_MIN_INTERVAL = 5.0
+DEFAULT_MAX_INTERVAL = 60.0
+BACKOFF_FACTOR = 1.5
+JITTER = 0.2
+DEFAULT_CLUSTER_TIMEOUT = 1800
+# runs/list returns at most this many runs per page.
+RUNS_LIST_LIMIT = 25
+
+TERMINAL_RUN_STATES = ("TERMINATED", "SKIPPED", "INTERNAL_ERROR")
+CLUSTER_STARTING_STATES = ("PENDING", "RESTARTING", "RESIZING")
+
+
+class ClusterStateError(Exception):
+    """Raised when a cluster stops instead of reaching RUNNING."""
+
+    def __init__(self, cluster_id, state, message):
+        super().__init__(f"Cluster {cluster_id} is {state}: {message}")
+        self.cluster_id = cluster_id
+        self.state = state
+
+
+@dataclass(frozen=True)
+class RunState:
+    """The state of a job run as reported by the Jobs API."""
+    life_cycle_state: str
+    result_state: str = None
+    state_message: str = ""
+
+    @classmethod
+    def from_run(cls, run):
+        state = run.get("state", {})
+        return cls(state.get("life_cycle_state"), state.get("result_state"), state.get("state_message", ""))
+
+    @property
+    def is_terminal(self):
+        return self.life_cycle_state in TERMINAL_RUN_STATES
+
+    @property
+    def succeeded(self):
+        return self.result_state == "SUCCESS"
+
+
+@dataclass
+class RunTransition:
+    """A run moving from one state to another; previous is None the first time a run is seen."""
+    run_id: int
+    job_id: int
+    previous: RunState
+    current: RunState
+
+
+class AdaptiveInterval:
+    """Polling interval that backs off while nothing changes and snaps back on a change."""
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+    def next_delay(self, changed):
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * BACKOFF_FACTOR)
+        # Jitter keeps many watched runs from polling in lockstep.
+        return self.interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+@dataclass
+class _TrackedRun:
+    run_id: int
+    job_id: int = None
+    state: RunState = None
+    due: float = 0.0
+    interval: AdaptiveInterval = field(default_factory=AdaptiveInterval)
+
+
+class RunWatcher:
+    """Tracks many job runs and streams their state transitions.
+
+    Each run is polled on its own adaptive interval, and the runs that are
+    due together are looked up in one batch: runs/list pages per job when
+    several runs of the job are due, runs/get for the rest. API calls go
+    through the DatabricksClient on a worker thread.
+    """
+
+    def __init__(self, client, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.api_calls = 0
+        self._runs = {}
+
+    def track(self, run_id, job_id=None):
+        if run_id not in self._runs:
+            self._runs[run_id] = _TrackedRun(run_id, job_id,
+                                             interval=AdaptiveInterval(self.min_interval, self.max_interval))
+
+    @property
+    def states(self):
+        return {run.run_id: run.state for run in self._runs.values()}
+
+    def _active(self):
+        return [run for run in self._runs.values() if run.state is None or not run.state.is_terminal]
+
+    def _lookup(self, runs):
+        """Current run payloads by run ID for the given tracked runs."""
+        found = {}
+        by_job = {}
+        for run in runs:
+            if run.job_id is not None:
+                by_job.setdefault(run.job_id, []).append(run.run_id)
+        for job_id, run_ids in by_job.items():
+            if len(run_ids) < 2:
+                continue
+            wanted = set(run_ids)
+            # Runs are listed newest first, so a few pages cover the runs we started.
+            for page in range(len(run_ids) // RUNS_LIST_LIMIT + 2):
+                listed, has_more = self.client.list_runs(job_id, offset=page * RUNS_LIST_LIMIT, limit=RUNS_LIST_LIMIT)
+                self.api_calls += 1
+                for item in listed:
+                    if item["run_id"] in wanted:
+                        found[item["run_id"]] = item
+                if not has_more or wanted <= set(found):
+                    break
+        for run in runs:
+            if run.run_id not in found:
+                found[run.run_id] = self.client.get_run(run.run_id)
+                self.api_calls += 1
+        return found
+
+    async def watch(self):
+        """Yield a RunTransition whenever a tracked run changes state, until every run is terminal."""
+        while True:
+            active = self._active()
+            if not active:
+                return
+            now = time.monotonic()
+            due = [run for run in active if run.due <= now]
+            if not due:
+                await asyncio.sleep(min(run.due for run in active) - now)
+                continue
+            found = await asyncio.to_thread(self._lookup, due)
+            now = time.monotonic()
+            for run in due:
+                payload = found[run.run_id]
+                run.job_id = payload.get("job_id", run.job_id)
+                state = RunState.from_run(payload)
+                changed = state != run.state
+                if changed:
+                    yield RunTransition(run.run_id, run.job_id, run.state, state)
+                    run.state = state
+                run.due = now + run.interval.next_delay(changed)
+
+
+async def watch_runs(client, run_ids, job_id=None, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                     on_transition=None):
+    """Print every state change of the runs until they finish; returns their final RunStates by run ID.
+
+    on_transition, when given, is called with each RunTransition as it is seen.
+    """
+    watcher = RunWatcher(client, min_interval, max_interval)
+    for run_id in run_ids:
+        watcher.track(run_id, job_id)
+    with get_tracer().span(f"watch {len(run_ids)} runs", kind="lro", run_ids=list(run_ids)) as span:
+        async for transition in watcher.watch():
+            current = transition.current
+            result = f" ({current.result_state})" if current.result_state else ""
+            print(f"[run {transition.run_id}] {current.life_cycle_state}{result} {current.state_message}".rstrip())
+            if on_transition is not None:
+                on_transition(transition)
+        span.set("transitions", sum(1 for state in watcher.states.values() if state is not None))
+    print(f"Watched {len(run_ids)} runs with {watcher.api_calls} API calls.")
+    return watcher.states
+
+
+def wait_for_cluster(client, cluster_id, timeout=DEFAULT_CLUSTER_TIMEOUT, min_interval=DEFAULT_MIN_INTERVAL,
+                     max_interval=DEFAULT_MAX_INTERVAL):
+    """Block until the cluster is RUNNING; raise ClusterStateError if it stops, TimeoutError if it takes too long."""
+    interval = AdaptiveInterval(min_interval, max_interval)
+    deadline = time.monotonic() + timeout
+    previous = None
+    with get_tracer().span(f"wait for cluster {cluster_id}", kind="lro", cluster_id=cluster_id):
+        while True:
+            cluster = client.get_cluster(cluster_id)
+            state = cluster.get("state")
+            if state != previous:
+                print(f"[cluster {cluster_id}] {state}")
+            if state == "RUNNING":
+                return cluster
+            if state not in CLUSTER_STARTING_STATES:
+                raise ClusterStateError(cluster_id, state, cluster.get("state_message", ""))
+            delay = interval.next_delay(state != previous)
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Cluster {cluster_id} did not reach RUNNING within {timeout}s")
+            previous = state
+            time.sleep(delay)
@@ -1,88 +1,62 @@
-from azure.mgmt.network import NetworkManagementClient
-from azure.mgmt.resource.resources import ResourceManagementClient
-from azure.mgmt.resource.resources.models import DeploymentMode
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.network.models import (
-    VirtualNetwork,
-    AddressSpace,
-    Subnet,
-    NetworkSecurityGroup,
-    PrivateEndpoint,
-    PrivateLinkServiceConnection,
-)
-
-# Initialize Azure clients
+import argparse
+import asyncio
+import dataclasses
+import sys
+
+from AsyncProvisioning import request_source_private_endpoints, print_results, DEFAULT_MAX_CONCURRENCY
+from ProvisioningJournal import ProvisioningJournal, DEFAULT_JOURNAL_PATH
+from PrivateEndpointApproval import DEFAULT_APPROVAL_TIMEOUT
+from ProvisioningSpecs import SourcePrivateEndpoint, source_private_endpoints
+from ProvisioningTrace import start_tracing, finish_tracing
+
+# Constants
 SUBSCRIPTION_ID = "<>"
 RESOURCE_GROUP = "adqueryvnettestrg"
-WORKSPACE_NAME = "adbdevsourcews"
 VNET_NAME = "adbdev2queryvnet2"
 PRIVATE_LINK_SUBNET_NAME = "PrivateLink"
 
 LOCATION = "uksouth"
 PRIVATE_ENDPOINT_NAME = "adbPrivateEndpointCustomerWorkspace"
 DATABRICKS_WORKSPACE_RESOURCE_ID = f"/subscriptions/27ef0436-f648-4bad-be15-3e872e16318b/resourceGroups/adbsourcevnetrg/providers/Microsoft.Databricks/workspaces/adbdevsourcews"
-VNET_ID = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP}/providers/Microsoft.Network/virtualNetworks/{VNET_NAME}"
-SUBNET_ID = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP}/providers/Microsoft.Network/virtualNetworks/{VNET_NAME}/subnets/{PRIVATE_LINK_SUBNET_NAME}"
 PRIVATE_DNS_ZONE_NAME = "privatelink.azuredatabricks.net"
-PRIVATE_DNS_ZONE_RESOURCE_ID = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP}/providers/Microsoft.Network/privateDnsZones/privatelink.azuredatabricks.net"
-
-credential = DefaultAzureCredential()
-network_client = NetworkManagementClient(credential, SUBSCRIPTION_ID)
-resource_client = ResourceManagementClient(credential, SUBSCRIPTION_ID)
-
-print("Creating Private Endpoint...")
-private_endpoint = network_client.private_endpoints.begin_create_or_update(
-    RESOURCE_GROUP,
-    PRIVATE_ENDPOINT_NAME,
-    PrivateEndpoint(
-        location=LOCATION,
-        subnet=Subnet(id=SUBNET_ID),
-        private_link_service_connections=[
-            PrivateLinkServiceConnection(
-                name=PRIVATE_ENDPOINT_NAME,
-                private_link_service_id=DATABRICKS_WORKSPACE_RESOURCE_ID,
-                group_ids=["databricks_ui_api"]
-            )
-        ]
-    )
-).result()
-print(f"Private Endpoint '{PRIVATE_ENDPOINT_NAME}' created successfully.")
 
-print("Deploying ARM Template for Private DNS Zone Group...")
-
-dns_zone_group_arm_template = {
-    "$schema": "https://schema.management.azure.com/schemas/2019-04-01/deploymentTemplate.json#",
-    "contentVersion": "1.0.0.0",
-    "resources": [
-        {
-            "type": "Microsoft.Network/privateEndpoints/privateDnsZoneGroups",
-            "apiVersion": "2020-03-01",
-            "name": f"{PRIVATE_ENDPOINT_NAME}/default",
-            "location": "global",
-            "properties": {
-                "privateDnsZoneConfigs": [
-                    {
-                        "name": PRIVATE_DNS_ZONE_NAME,
-                        "properties": {
-                            "privateDnsZoneId": f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP}/providers/Microsoft.Network/privateDnsZones/{PRIVATE_DNS_ZONE_NAME}"
-                        }
-                    }
-                ]
-            }
-        }
-    ]
-}
-
-dns_zone_group_deployment = resource_client.deployments.begin_create_or_update(
-    RESOURCE_GROUP,
-    "PrivateDnsZoneGroupDeployment",
-    {
-        "properties": {
-            "mode": DeploymentMode.INCREMENTAL,
-            "template": dns_zone_group_arm_template,
-            "parameters": {}
-        }
-    }
-).result()
-print("Private DNS Zone Group associated with Private Endpoint successfully.")
+REQUEST = SourcePrivateEndpoint(
+    subscription_id=SUBSCRIPTION_ID,
+    resource_group=RESOURCE_GROUP,
+    location=LOCATION,
+    vnet_name=VNET_NAME,
+    remote_workspace_id=DATABRICKS_WORKSPACE_RESOURCE_ID,
+    private_endpoint_name=PRIVATE_ENDPOINT_NAME,
+    private_link_subnet_name=PRIVATE_LINK_SUBNET_NAME,
+    private_dns_zone_name=PRIVATE_DNS_ZONE_NAME,
+)
 
+parser = argparse.ArgumentParser(description="Connect the query VNet to a workspace in another subscription.")
+parser.add_argument("--remote-workspace-ids",
+                    help="comma-separated workspace resource IDs to connect to, instead of the one constant")
+parser.add_argument("--remote-workspaces-file", help="file with one workspace resource ID per line")
+parser.add_argument("--manual-approval", action="store_true",
+                    help="request the connections for the workspaces' owners to approve")
+parser.add_argument("--auto-approve", action="store_true",
+                    help="approve pending connections on the workspaces' side (needs rights on their subscriptions)")
+parser.add_argument("--approval-timeout", type=float, default=DEFAULT_APPROVAL_TIMEOUT,
+                    help="seconds to wait for each connection to be approved")
+parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH, help="checkpoint journal of completed steps")
+parser.add_argument("--resume", action="store_true", help="skip steps the journal records as completed")
+args = parser.parse_args()
+
+remote_workspace_ids = args.remote_workspace_ids.split(",") if args.remote_workspace_ids else []
+if args.remote_workspaces_file:
+    with open(args.remote_workspaces_file) as f:
+        remote_workspace_ids += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+request = dataclasses.replace(REQUEST, manual_approval=args.manual_approval)
+requests = source_private_endpoints(request, remote_workspace_ids) if remote_workspace_ids else [request]
+
+start_tracing("SourcePrivateEndpointRequest")
+results = asyncio.run(request_source_private_endpoints(requests, args.max_concurrency,
+                                                       journal=ProvisioningJournal(args.journal), resume=args.resume,
+                                                       auto_approve=args.auto_approve,
+                                                       approval_timeout=args.approval_timeout))
+print_results(results)
+sys.exit(finish_tracing(0 if all(result.succeeded for result in results) else 1))
@@ -0,0 +1,201 @@
+import asyncio
+import bisect
+import ipaddress
+from dataclasses import replace
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from ProvisioningSpecs import DEFAULT_PUBLIC_SUBNET_NAME, DEFAULT_PRIVATE_SUBNET_NAME
+
+# Azure keeps the first four and the last address of every subnet.
+AZURE_RESERVED_ADDRESSES = 5
+# Smallest public/private subnet a Databricks workspace accepts.
+LONGEST_DATABRICKS_PREFIX = 26
+# Smallest subnet Azure allows.
+LONGEST_SUBNET_PREFIX = 29
+# Private endpoints to leave room for per workspace: the workspace's own plus storage and source endpoints.
+DEFAULT_ENDPOINTS_PER_WORKSPACE = 8
+
+_DEFAULT_NAMES = {"public_subnet_name": DEFAULT_PUBLIC_SUBNET_NAME, "private_subnet_name": DEFAULT_PRIVATE_SUBNET_NAME}
+
+
+class AddressSpaceExhausted(Exception):
+    """Raised when a VNet has no free block large enough for a subnet."""
+
+    def __init__(self, vnet_name, prefix_length):
+        super().__init__(f"No free /{prefix_length} left in the address space of {vnet_name}")
+        self.vnet_name = vnet_name
+        self.prefix_length = prefix_length
+
+
+def prefix_length_for(addresses, longest=LONGEST_SUBNET_PREFIX):
+    """Longest prefix whose subnet holds the addresses on top of Azure's reserved ones."""
+    needed = addresses + AZURE_RESERVED_ADDRESSES
+    return min(longest, 32 - (needed - 1).bit_length())
+
+
+class AddressPool:
+    """Used and free IPv4 space of one VNet.
+
+    Used prefixes are kept as sorted, disjoint intervals, so overlap checks
+    are a binary search. Free space is kept buddy-style as one sorted list
+    of aligned blocks per prefix length: an allocation takes the smallest
+    free block that fits and splits it at most 32 times, however many
+    subnets the VNet already has.
+    """
+
+    def __init__(self, name, address_prefixes, used_prefixes=()):
+        self.name = name
+        self.address_prefixes = [ipaddress.ip_network(prefix) for prefix in address_prefixes]
+        self._starts = []
+        self._ends = []
+        self._free = [[] for _ in range(33)]
+        for network in self.address_prefixes:
+            self._add_free(int(network.network_address), network.prefixlen)
+        for prefix in used_prefixes:
+            self.reserve(prefix)
+
+    def overlaps(self, prefix):
+        network = ipaddress.ip_network(prefix)
+        start, end = int(network.network_address), int(network.broadcast_address)
+        index = bisect.bisect_right(self._starts, end)
+        return index > 0 and self._ends[index - 1] >= start
+
+    def reserve(self, prefix):
+        """Mark a prefix as used: an existing subnet, or a range that must stay free, like a peered VNet's."""
+        network = ipaddress.ip_network(prefix)
+        if self.overlaps(network):
+            raise ValueError(f"{network} overlaps a prefix already used in {self.name}")
+        start, length = int(network.network_address), network.prefixlen
+        self._mark_used(start, int(network.broadcast_address))
+        for block_length in range(length, -1, -1):
+            block = start >> (32 - block_length) << (32 - block_length)
+            if self._take_free(block, block_length):
+                self._split(block, block_length, length, keep=start)
+                return
+        # Larger than any single free block: drop every free block inside it.
+        for block_length in range(length + 1, 33):
+            blocks = self._free[block_length]
+            low = bisect.bisect_left(blocks, start)
+            high = bisect.bisect_right(blocks, int(network.broadcast_address))
+            del blocks[low:high]
+
+    def allocate(self, prefix_length):
+        """The lowest free aligned block of the given length, taken from the smallest free block that fits."""
+        for block_length in range(prefix_length, -1, -1):
+            if self._free[block_length]:
+                block = self._free[block_length].pop(0)
+                self._split(block, block_length, prefix_length, keep=block)
+                network = ipaddress.ip_network((block, prefix_length))
+                self._mark_used(int(network.network_address), int(network.broadcast_address))
+                return network
+        raise AddressSpaceExhausted(self.name, prefix_length)
+
+    def address_prefix_of(self, network):
+        return next((str(prefix) for prefix in self.address_prefixes if network.subnet_of(prefix)), None)
+
+    def _split(self, block, block_length, length, keep):
+        # Halve the block down to the wanted length, freeing the halves that do not hold `keep`.
+        while block_length < length:
+            block_length += 1
+            half = 1 << (32 - block_length)
+            if keep >= block + half:
+                self._add_free(block, block_length)
+                block += half
+            else:
+                self._add_free(block + half, block_length)
+
+    def _add_free(self, block, length):
+        bisect.insort(self._free[length], block)
+
+    def _take_free(self, block, length):
+        blocks = self._free[length]
+        index = bisect.bisect_left(blocks, block)
+        if index < len(blocks) and blocks[index] == block:
+            del blocks[index]
+            return True
+        return False
+
+    def _mark_used(self, start, end):
+        index = bisect.bisect_left(self._starts, start)
+        self._starts.insert(index, start)
+        self._ends.insert(index, end)
+
+
+async def read_address_pool(clients, subscription_id, resource_group, vnet_name, address_space):
+    """The pool of an existing VNet and its subnet prefixes by name; a new VNet gets address_space."""
+    try:
+        vnet = await clients.network(subscription_id).virtual_networks.get(resource_group, vnet_name)
+    except ResourceNotFoundError:
+        return AddressPool(vnet_name, [address_space]), {}
+    subnets = {}
+    for subnet in vnet.subnets or []:
+        subnets[subnet.name] = subnet.address_prefix or (subnet.address_prefixes or [None])[0]
+    used = [prefix for prefix in subnets.values() if prefix and ipaddress.ip_network(prefix).version == 4]
+    address_prefixes = [prefix for prefix in vnet.address_space.address_prefixes or []
+                        if ipaddress.ip_network(prefix).version == 4]
+    return AddressPool(vnet_name, address_prefixes, used), subnets
+
+
+def stack_subnet_names(stack):
+    """The stack's public and private subnet names: named after the workspace for allocated stacks, unless set."""
+    if stack.max_cluster_nodes is None:
+        return {field: getattr(stack, field) for field in _DEFAULT_NAMES}
+    return {
+        field: f"{stack.workspace_name}-{field.split('_')[0]}" if getattr(stack, field) == default else getattr(stack, field)
+        for field, default in _DEFAULT_NAMES.items()
+    }
+
+
+def allocate_stack_subnets(stack, pool, existing, endpoints_per_vnet=DEFAULT_ENDPOINTS_PER_WORKSPACE):
+    """The stack with its public, private and PrivateLink prefixes allocated from the pool.
+
+    Subnets that already exist keep their prefixes, so allocating again is
+    a no-op. Public and private subnets are named after the workspace
+    unless the stack names them, and the stack gets no "default" subnet.
+    """
+    names = stack_subnet_names(stack)
+    node_length = min(LONGEST_DATABRICKS_PREFIX, prefix_length_for(stack.max_cluster_nodes))
+    prefixes = {}
+    for field, subnet_name, length in (
+        ("public_subnet_prefix", names["public_subnet_name"], node_length),
+        ("private_subnet_prefix", names["private_subnet_name"], node_length),
+        ("private_link_subnet_prefix", stack.private_link_subnet_name, prefix_length_for(endpoints_per_vnet)),
+    ):
+        if existing.get(subnet_name):
+            prefixes[field] = existing[subnet_name]
+        else:
+            prefixes[field] = str(pool.allocate(length))
+            existing[subnet_name] = prefixes[field]
+    address_space = pool.address_prefix_of(ipaddress.ip_network(prefixes["public_subnet_prefix"]))
+    return replace(stack, **names, **prefixes, default_subnet_prefix=None,
+                   address_space=address_space or stack.address_space)
+
+
+async def allocate_subnets(clients, stacks, endpoints_per_workspace=DEFAULT_ENDPOINTS_PER_WORKSPACE):
+    """Allocate prefixes for every stack with max_cluster_nodes set; the other stacks are returned as they are.
+
+    Each VNet is read once, concurrently, and the stacks that share it are
+    packed into its free space, sharing one PrivateLink subnet sized for
+    all of their private endpoints.
+    """
+    by_vnet = {}
+    for stack in stacks:
+        if stack.max_cluster_nodes is not None:
+            by_vnet.setdefault(stack.vnet_id.lower(), []).append(stack)
+    if not by_vnet:
+        return list(stacks)
+
+    pools = await asyncio.gather(*(
+        read_address_pool(clients, group[0].subscription_id, group[0].resource_group, group[0].vnet_name,
+                          group[0].address_space)
+        for group in by_vnet.values()
+    ))
+    allocated = {}
+    for group, (pool, existing) in zip(by_vnet.values(), pools):
+        for stack in group:
+            allocated[id(stack)] = allocate_stack_subnets(stack, pool, existing, endpoints_per_workspace * len(group))
+            print(f"[{stack.name}] Subnets in {stack.vnet_name}: public {allocated[id(stack)].public_subnet_prefix}, "
+                  f"private {allocated[id(stack)].private_subnet_prefix}, "
+                  f"PrivateLink {allocated[id(stack)].private_link_subnet_prefix}")
+    return [allocated.get(id(stack), stack) for stack in stacks]
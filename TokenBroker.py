@@ -0,0 +1,274 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from azure.core.credentials import AccessToken
+
+ARM_SCOPE = "https://management.azure.com/.default"
+# The AzureDatabricks first-party application.
+DATABRICKS_RESOURCE_ID = "2ff814a6-3304-4ab8-85cb-cd0e6f879c1d"
+DATABRICKS_SCOPE = f"{DATABRICKS_RESOURCE_ID}/.default"
+
+# Tokens are refreshed this long before they expire, or halfway through their lifetime if that is sooner.
+REFRESH_AHEAD_SECONDS = 300
+
+# Pin the credential (e.g. AZURE_CREDENTIAL_TYPE=cli) to skip probing the whole DefaultAzureCredential chain.
+CREDENTIAL_TYPE_ENV = "AZURE_CREDENTIAL_TYPE"
+# Setting both persists tokens across runs, encrypted with the Fernet key.
+TOKEN_CACHE_PATH_ENV = "AZURE_TOKEN_CACHE_PATH"
+TOKEN_CACHE_KEY_ENV = "AZURE_TOKEN_CACHE_KEY"
+
+# With AZURE_CREDENTIAL_TYPE=static, this pre-acquired token is returned for every scope.
+ACCESS_TOKEN_ENV = "AZURE_ACCESS_TOKEN"
+STATIC_TOKEN_LIFETIME = 3600
+# The client (service principal or user-assigned identity) or user the environment credentials sign in as.
+CLIENT_IDENTITY_ENVS = ("AZURE_CLIENT_ID", "AZURE_USERNAME")
+AZURE_CONFIG_DIR_ENV = "AZURE_CONFIG_DIR"
+
+CREDENTIAL_TYPES = {
+    "default": "DefaultAzureCredential",
+    "cli": "AzureCliCredential",
+    "environment": "EnvironmentCredential",
+    "managed_identity": "ManagedIdentityCredential",
+    "workload_identity": "WorkloadIdentityCredential",
+    "static": "StaticTokenCredential",
+}
+
+
+class StaticTokenCredential:
+    """A token minted elsewhere (a CI step, or any string for the local FakeAzure server)."""
+
+    def __init__(self, token=None, expires_on=None):
+        self.token = token or os.environ.get(ACCESS_TOKEN_ENV)
+        if not self.token:
+            raise ValueError(f"Set {ACCESS_TOKEN_ENV} to use the static credential")
+        self.expires_on = expires_on or int(time.time()) + STATIC_TOKEN_LIFETIME
+
+    def get_token(self, *scopes, **kwargs):
+        return AccessToken(self.token, self.expires_on)
+
+    def close(self):
+        pass
+
+
+class AsyncStaticTokenCredential(StaticTokenCredential):
+    async def get_token(self, *scopes, **kwargs):
+        return AccessToken(self.token, self.expires_on)
+
+    async def close(self):
+        pass
+
+
+def _credential_class(module, credential_type):
+    credential_type = credential_type or os.environ.get(CREDENTIAL_TYPE_ENV, "default")
+    if credential_type == "static":
+        return AsyncStaticTokenCredential if module.__name__.endswith(".aio") else StaticTokenCredential
+    if credential_type not in CREDENTIAL_TYPES:
+        raise ValueError(f"Unknown credential type '{credential_type}', expected one of: {', '.join(CREDENTIAL_TYPES)}")
+    return getattr(module, CREDENTIAL_TYPES[credential_type])
+
+
+def _cli_account():
+    """The user or service principal `az login` signed in as, from the CLI profile; None when there is none."""
+    config_dir = os.environ.get(AZURE_CONFIG_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".azure")
+    try:
+        # The CLI writes the profile with a byte order mark.
+        with open(os.path.join(config_dir, "azureProfile.json"), encoding="utf-8-sig") as f:
+            subscriptions = json.load(f).get("subscriptions", [])
+    except (OSError, ValueError):
+        return None
+    for subscription in subscriptions:
+        if subscription.get("isDefault"):
+            return (subscription.get("user") or {}).get("name")
+    return None
+
+
+def credential_identity(credential_type=None, credential=None):
+    """Who cached tokens belong to: the credential type and the client or account it signs in as.
+
+    Part of every cache key, so a persisted token is never handed to a
+    run that signs in as someone else.
+    """
+    if credential is not None:
+        credential_type = type(credential).__name__
+    else:
+        credential_type = credential_type or os.environ.get(CREDENTIAL_TYPE_ENV, "default")
+    if isinstance(credential, StaticTokenCredential) or (credential is None and credential_type == "static"):
+        token = credential.token if credential is not None else os.environ.get(ACCESS_TOKEN_ENV, "")
+        account = hashlib.sha256(token.encode()).hexdigest()[:16]
+    else:
+        account = next((os.environ[name] for name in CLIENT_IDENTITY_ENVS if os.environ.get(name)), None)
+        if credential_type in ("cli", "AzureCliCredential"):
+            account = _cli_account()
+        elif credential_type in ("default", "DefaultAzureCredential"):
+            # The chain signs in with the environment's client if it has one, else (typically) the CLI's.
+            account = "+".join(filter(None, (account, _cli_account())))
+    return f"{credential_type}:{account or '-'}"
+
+
+def _cache_key(identity, scopes, tenant_id):
+    return f"{identity} " + " ".join(sorted(scopes)) + (f"@{tenant_id}" if tenant_id else "")
+
+
+class TokenCache:
+    """Access tokens by credential identity and scope, in memory and optionally in an encrypted file.
+
+    The file is a Fernet-encrypted JSON document, so the cryptography
+    package is only needed when a path is given.
+    """
+
+    def __init__(self, path=None, key=None):
+        self.path = path
+        self._tokens = {}
+        self._refresh_on = {}
+        self._lock = threading.Lock()
+        self._fernet = None
+        if path is not None:
+            if not key:
+                raise ValueError(f"An encryption key is required for the token cache file (set {TOKEN_CACHE_KEY_ENV})")
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                raise ImportError("cryptography is required for the token cache file: pip install cryptography")
+            self._fernet = Fernet(key)
+            self._load()
+
+    def get(self, key):
+        """The cached token, unless it is due for refresh."""
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is not None and time.time() < self._refresh_on[key]:
+                return token
+        return None
+
+    def put(self, key, token):
+        with self._lock:
+            self._store(key, token)
+            if self.path is not None:
+                self._save()
+
+    def _store(self, key, token):
+        lifetime = token.expires_on - time.time()
+        self._tokens[key] = token
+        self._refresh_on[key] = token.expires_on - min(REFRESH_AHEAD_SECONDS, lifetime / 2)
+
+    def _load(self):
+        from cryptography.fernet import InvalidToken
+
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            try:
+                entries = json.loads(self._fernet.decrypt(f.read()))
+            except (InvalidToken, ValueError):
+                # Written with another key or corrupted: start over rather than fail the run.
+                return
+        for key, (token, expires_on) in entries.items():
+            if expires_on > time.time():
+                self._store(key, AccessToken(token, expires_on))
+
+    def _save(self):
+        data = self._fernet.encrypt(json.dumps({key: list(token) for key, token in self._tokens.items()}).encode())
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache():
+    """The process-wide TokenCache, persisted when the cache path and key environment variables are set."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = TokenCache(os.environ.get(TOKEN_CACHE_PATH_ENV), os.environ.get(TOKEN_CACHE_KEY_ENV))
+        return _shared_cache
+
+
+class TokenBroker:
+    """Synchronous TokenCredential that serves tokens from the shared cache.
+
+    Pass it wherever a credential is expected (management clients,
+    get_token for the Databricks REST API); only the first request per
+    scope, or one close to expiry, reaches the underlying credential.
+    """
+
+    def __init__(self, credential_type=None, cache=None, credential=None):
+        if credential is None:
+            import azure.identity
+            credential = _credential_class(azure.identity, credential_type)()
+            self.identity = credential_identity(credential_type)
+        else:
+            self.identity = credential_identity(credential=credential)
+        self.credential = credential
+        self.cache = cache or shared_cache()
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, claims=None, tenant_id=None, **kwargs):
+        if claims:
+            # Claims challenges (CAE) need a fresh token.
+            return self.credential.get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+        key = _cache_key(self.identity, scopes, tenant_id)
+        token = self.cache.get(key)
+        if token is None:
+            with self._lock:
+                token = self.cache.get(key)
+                if token is None:
+                    token = self.credential.get_token(*scopes, tenant_id=tenant_id, **kwargs)
+                    self.cache.put(key, token)
+        return token
+
+    def close(self):
+        self.credential.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncTokenBroker:
+    """The asyncio counterpart of TokenBroker, for the azure.mgmt .aio clients.
+
+    Concurrent requests for the same scope wait on a single fetch, so a
+    fleet run acquires each token once.
+    """
+
+    def __init__(self, credential_type=None, cache=None, credential=None):
+        if credential is None:
+            import azure.identity.aio
+            credential = _credential_class(azure.identity.aio, credential_type)()
+            self.identity = credential_identity(credential_type)
+        else:
+            self.identity = credential_identity(credential=credential)
+        self.credential = credential
+        self.cache = cache or shared_cache()
+        self._locks = {}
+
+    async def get_token(self, *scopes, claims=None, tenant_id=None, **kwargs):
+        if claims:
+            return await self.credential.get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+        key = _cache_key(self.identity, scopes, tenant_id)
+        token = self.cache.get(key)
+        if token is None:
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                token = self.cache.get(key)
+                if token is None:
+                    token = await self.credential.get_token(*scopes, tenant_id=tenant_id, **kwargs)
+                    self.cache.put(key, token)
+        return token
+
+    async def close(self):
+        await self.credential.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
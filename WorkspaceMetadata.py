@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+
+from AzureEndpoints import arm_client_options
+from AzureSdk import create_client
+
+DEFAULT_CACHE_PATH = "workspace-metadata.json"
+CACHE_PATH_ENV = "WORKSPACE_METADATA_CACHE_PATH"
+CACHE_TTL_ENV = "WORKSPACE_METADATA_TTL"
+# A workspace recreated under the same name keeps its resource ID but gets a new URL and identity.
+DEFAULT_TTL = 24 * 3600
+# Set it to skip the lookup; otherwise the scripts take the URL from the workspace itself.
+WORKSPACE_URL_ENV = "DATABRICKS_WORKSPACE_URL"
+MANAGED_IDENTITY_API_VERSION = "2023-01-31"
+MANAGED_IDENTITY_NAME = "dbmanagedidentity"
+
+
+def workspace_resource_id(subscription_id, resource_group, workspace_name):
+    return (f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+            f"/providers/Microsoft.Databricks/workspaces/{workspace_name}")
+
+
+def managed_identity_id(subscription_id, managed_resource_group):
+    return (f"/subscriptions/{subscription_id}/resourceGroups/{managed_resource_group}"
+            f"/providers/Microsoft.ManagedIdentity/userAssignedIdentities/{MANAGED_IDENTITY_NAME}")
+
+
+@dataclass
+class WorkspaceMetadata:
+    """What the scripts need to know about a workspace, read from ARM once and then cached."""
+    workspace_id: str
+    workspace_url: str
+    managed_resource_group: str
+    msi_client_id: str
+    msi_principal_id: str
+    fetched_at: float = 0.0
+
+    @property
+    def url(self):
+        return f"https://{self.workspace_url}"
+
+
+def _metadata(workspace, managed_identity):
+    properties = managed_identity.properties or {}
+    if not properties.get("clientId") or not properties.get("principalId"):
+        raise ValueError(f"Failed to retrieve the Managed Identity of workspace {workspace.name}.")
+    return WorkspaceMetadata(
+        workspace_id=workspace.id,
+        workspace_url=workspace.workspace_url,
+        managed_resource_group=workspace.managed_resource_group_id.split("/")[-1],
+        msi_client_id=properties["clientId"],
+        msi_principal_id=properties["principalId"],
+        fetched_at=time.time(),
+    )
+
+
+class WorkspaceMetadataCache:
+    """WorkspaceMetadata by workspace resource ID, in memory and in a JSON file, for ttl seconds.
+
+    A hit costs no ARM call at all; a miss reads the workspace and its
+    dbmanagedidentity. Concurrent async lookups of one workspace share a
+    single read.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or os.environ.get(CACHE_PATH_ENV, DEFAULT_CACHE_PATH)
+        self.ttl = ttl if ttl is not None else float(os.environ.get(CACHE_TTL_ENV, DEFAULT_TTL))
+        self._entries = {}
+        self._pending = {}
+        self._changed = False
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self._entries = {key: WorkspaceMetadata(**entry) for key, entry in json.load(f).items()}
+
+    def get(self, workspace_id):
+        with self._lock:
+            metadata = self._entries.get(workspace_id.lower())
+        if metadata is None or time.time() - metadata.fetched_at > self.ttl:
+            return None
+        return metadata
+
+    def put(self, metadata):
+        with self._lock:
+            self._entries[metadata.workspace_id.lower()] = metadata
+            self._changed = True
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({key: asdict(entry) for key, entry in self._entries.items()}, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+            self._changed = False
+
+    def lookup(self, credential, subscription_id, resource_group, workspace_name):
+        """The workspace's metadata, read with synchronous clients on a miss."""
+        metadata = self.get(workspace_resource_id(subscription_id, resource_group, workspace_name))
+        if metadata is not None:
+            return metadata
+        print(f"[{workspace_name}] Retrieving workspace URL and Databricks Managed Identity...")
+        with create_client("databricks", credential, subscription_id, **arm_client_options()) as databricks, \
+                create_client("resource", credential, subscription_id, **arm_client_options()) as resources:
+            workspace = databricks.workspaces.get(resource_group, workspace_name)
+            managed_identity = resources.resources.get_by_id(
+                managed_identity_id(subscription_id, workspace.managed_resource_group_id.split("/")[-1]),
+                api_version=MANAGED_IDENTITY_API_VERSION
+            )
+        metadata = _metadata(workspace, managed_identity)
+        self.put(metadata)
+        self.save()
+        return metadata
+
+    async def lookup_async(self, clients, subscription_id, resource_group, workspace_name):
+        """The workspace's metadata, read with the AsyncAzureClients on a miss."""
+        key = workspace_resource_id(subscription_id, resource_group, workspace_name).lower()
+        metadata = self.get(key)
+        if metadata is not None:
+            return metadata
+        if key not in self._pending or self._pending[key].done() and self._pending[key].exception() is not None:
+            self._pending[key] = asyncio.ensure_future(
+                self._read_async(clients, subscription_id, resource_group, workspace_name))
+        return await self._pending[key]
+
+    async def _read_async(self, clients, subscription_id, resource_group, workspace_name):
+        workspace = await clients.databricks(subscription_id).workspaces.get(resource_group, workspace_name)
+        managed_identity = await clients.resource(subscription_id).resources.get_by_id(
+            managed_identity_id(subscription_id, workspace.managed_resource_group_id.split("/")[-1]),
+            api_version=MANAGED_IDENTITY_API_VERSION
+        )
+        metadata = _metadata(workspace, managed_identity)
+        self.put(metadata)
+        return metadata
+
+
+def resolve_workspace_url(metadata):
+    """DATABRICKS_WORKSPACE_URL when it is set, else the workspace's own URL, which is then exported."""
+    url = os.environ.get(WORKSPACE_URL_ENV)
+    if not url:
+        url = os.environ[WORKSPACE_URL_ENV] = metadata.url
+    return url